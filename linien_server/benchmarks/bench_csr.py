@@ -0,0 +1,90 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmark of CSR access, comparing the compiled access plans of `PythonCSR`
+with the previous implementation that decoded `csrmap` on every call.
+
+Run with `python benchmarks/bench_csr.py`.
+"""
+
+import os
+import tempfile
+from timeit import repeat
+
+from linien_server.csr import MMapRegisters, PythonCSR
+
+HOT_PATH_NAMES = ("logic_slow_value", "logic_autolock_lock_running")
+
+
+class LegacyCSR(PythonCSR):
+    """`PythonCSR.set` / `get` before access plans were introduced."""
+
+    def set(self, name: str, value: int) -> None:
+        map, addr, width, wr = self.map[name]
+        assert wr, name
+
+        ma = 1 << width
+        bit_mask = ma - 1
+        val = value & bit_mask
+        assert value == val or ma + value == val
+
+        b = (width + 8 - 1) // 8
+        for i in range(b):
+            v = (val >> (8 * (b - i - 1))) & 0xFF
+            self.set_one(self.offset + (map << 11) + ((addr + i) << 2), v)
+
+    def get(self, name: str) -> int:
+        if name in self.constants:
+            return self.constants[name]
+
+        map, addr, nr, wr = self.map[name]
+        v = 0
+        b = (nr + 8 - 1) // 8
+        for i in range(b):
+            v |= self.get_one(self.offset + (map << 11) + ((addr + i) << 2)) << 8 * (
+                b - i - 1
+            )
+        return v
+
+
+def benchmark(number=20000):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "registers")
+        open(path, "wb").close()
+        registers = MMapRegisters(path, file_offset=0)
+
+        for csr in (LegacyCSR(registers), PythonCSR(registers)):
+
+            def get():
+                for name in HOT_PATH_NAMES:
+                    csr.get(name)
+
+            def set():
+                csr.set("logic_pid_kp", -1234)
+
+            t_get = min(repeat(get, number=number, repeat=5)) / number
+            t_set = min(repeat(set, number=number, repeat=5)) / number
+            print(
+                f"{type(csr).__name__:<10} get per frame: {t_get * 1e6:6.2f} us   "
+                f"set logic_pid_kp: {t_set * 1e6:6.2f} us"
+            )
+        registers.close()
+
+
+if __name__ == "__main__":
+    benchmark()
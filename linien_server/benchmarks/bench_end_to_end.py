@@ -0,0 +1,322 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+End-to-end benchmark of the path from a new frame on the server to the client having
+decoded it.
+
+A server is started in a subprocess with the fake (`FakeRedPitayaControlService`) or
+the simulated (`RedPitayaControlService` on a `SimulatedRedPitaya`) backend. For each
+scenario, 1, 4 and 16 clients connect in separate processes and receive `to_plot`
+either like a client with parameter cache (remote listener and
+`get_changed_parameters_queue`), with pushed changes (`subscribe_parameter_changes`)
+or without cache (polling `get_param`). Measured are the frames per second received by
+each client, the latency from the scope trigger (simulated backend) or from publishing
+the frame (fake backend) to the client, the CPU usage of the server process and the
+size of the frame payloads received by the clients.
+
+Run with `python benchmarks/bench_end_to_end.py [--backend simulate] [--output
+results.json]`, results are written to a JSON file to compare versions.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import socket
+import subprocess
+import sys
+from random import random
+from time import perf_counter, sleep, time
+
+import numpy as np
+import rpyc
+from linien_common.communication import unpack
+from linien_server.wire_format import (
+    WIRE_FORMAT_BINARY_ZLIB,
+    WIRE_FORMAT_PICKLE,
+    decode_plot_data,
+    is_binary_frame,
+)
+from rpyc.utils.server import ThreadedServer
+
+MODES = ("cache", "push", "nocache")
+WIRE_FORMATS = (WIRE_FORMAT_PICKLE, WIRE_FORMAT_BINARY_ZLIB)
+N_CLIENTS = (1, 4, 16)
+
+PROTOCOL_CONFIG = {"allow_pickle": True, "allow_public_attrs": True}
+
+
+def fingerprint(plot_data) -> bytes:
+    """Identifies a frame on server and client, independent of the wire format."""
+    for name in ("error_signal_1", "error_signal"):
+        if name in plot_data:
+            return np.asarray(plot_data[name][:16], dtype=np.int16).tobytes()
+    return b""
+
+
+def decode(data: bytes):
+    if is_binary_frame(data):
+        return decode_plot_data(data)
+    return pickle.loads(data)
+
+
+# server
+
+
+def benchmark_service(base):
+    class BenchmarkService(base):
+        """Records when each frame was triggered (or published) and the CPU time."""
+
+        def __init__(self, *args, **kwargs):
+            self.frame_times = {}
+            super().__init__(*args, **kwargs)
+            self.parameters.to_plot.add_callback(self._record_frame_time)
+
+        def _record_frame_time(self, frame) -> None:
+            now = perf_counter()
+            trigger_time = getattr(frame, "trigger_time", None)
+            self.frame_times[fingerprint(frame.as_plot_data())] = trigger_time or now
+
+        def exposed_get_frame_times(self) -> bytes:
+            return pickle.dumps(dict(self.frame_times))
+
+        def exposed_get_cpu_time(self) -> float:
+            times = os.times()
+            return times.user + times.system
+
+    return BenchmarkService
+
+
+def serve(backend: str, port: int, frame_rate: float) -> None:
+    from linien_server.server import (
+        FakeRedPitayaControlService,
+        RedPitayaControlService,
+    )
+
+    if backend == "fake":
+        service = benchmark_service(FakeRedPitayaControlService)(frame_rate=frame_rate)
+    else:
+        from linien_server.simulation import create_simulated_red_pitaya
+
+        service = benchmark_service(RedPitayaControlService)(
+            board=create_simulated_red_pitaya()
+        )
+    ThreadedServer(
+        service, hostname="127.0.0.1", port=port, protocol_config=PROTOCOL_CONFIG
+    ).start()
+
+
+def start_server(backend: str, frame_rate: float) -> tuple[subprocess.Popen, int]:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            __file__,
+            "--serve",
+            "--backend",
+            backend,
+            "--port",
+            str(port),
+            "--frame-rate",
+            str(frame_rate),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(300):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, port
+        except OSError:
+            sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server did not start")
+
+
+# clients
+
+
+def connect(port: int, uuid: str):
+    class ClientService(rpyc.Service):
+        exposed_uuid = uuid
+
+    return rpyc.connect(
+        "127.0.0.1", port, service=ClientService, config=PROTOCOL_CONFIG
+    )
+
+
+def run_client(port, mode, wire_format, duration, poll_interval, results) -> None:
+    uuid = f"bench-{random()}"
+    conn = connect(port, uuid)
+    received = []  # (time received, fingerprint, payload size)
+
+    def handle(data: bytes) -> None:
+        plot_data = decode(data)
+        received.append((perf_counter(), fingerprint(plot_data), len(data)))
+
+    conn.root.negotiate_wire_format(uuid, [wire_format])
+    if mode != "nocache":
+        conn.root.register_remote_listener(uuid, "to_plot")
+        conn.root.get_changed_parameters_queue(uuid)
+
+    end = perf_counter() + duration
+    if mode == "push":
+
+        def callback(batch: bytes) -> None:
+            for name, value in pickle.loads(batch):
+                if name == "to_plot":
+                    handle(value)
+
+        conn.root.subscribe_parameter_changes(uuid, callback, 0)
+        # serve the callbacks of the server (`BgServingThread` sleeps between requests)
+        while perf_counter() < end:
+            conn.serve(0.1)
+    else:
+        last = None
+        while perf_counter() < end:
+            if mode == "cache":
+                for name, value in conn.root.get_changed_parameters_queue(uuid):
+                    if name == "to_plot":
+                        handle(value)
+            else:
+                value = unpack(conn.root.get_param("to_plot", wire_format))
+                if value != last:
+                    last = value
+                    handle(value)
+            sleep(poll_interval)
+    conn.close()
+    results.put(received)
+
+
+def run_scenario(port, n_clients, mode, wire_format, duration, poll_interval) -> dict:
+    control = connect(port, f"bench-control-{random()}")
+    cpu_before = control.root.get_cpu_time()
+    start = perf_counter()
+
+    results = multiprocessing.Queue()
+    clients = [
+        multiprocessing.Process(
+            target=run_client,
+            args=(port, mode, wire_format, duration, poll_interval, results),
+        )
+        for _ in range(n_clients)
+    ]
+    for client in clients:
+        client.start()
+    received = [results.get(timeout=duration + 60) for _ in clients]
+    for client in clients:
+        client.join()
+
+    elapsed = perf_counter() - start
+    cpu = control.root.get_cpu_time() - cpu_before
+    frame_times = pickle.loads(control.root.get_frame_times())
+    control.close()
+
+    latencies = [
+        received_at - frame_times[key]
+        for client in received
+        for received_at, key, _ in client
+        if key in frame_times
+    ]
+    n_frames = sum(len(client) for client in received)
+    n_bytes = sum(size for client in received for *_, size in client)
+    return {
+        "clients": n_clients,
+        "mode": mode,
+        "wire_format": wire_format,
+        "frames_per_second": n_frames / n_clients / duration,
+        "latency_p50_ms": 1e3 * np.percentile(latencies, 50) if latencies else None,
+        "latency_p99_ms": 1e3 * np.percentile(latencies, 99) if latencies else None,
+        "server_cpu_percent": 100 * cpu / elapsed,
+        "bytes_per_frame": n_bytes / n_frames if n_frames else None,
+        "bytes_per_second": n_bytes / duration,
+    }
+
+
+def benchmark(args) -> None:
+    from linien_server import __version__
+
+    process, port = start_server(args.backend, args.frame_rate)
+    results = []
+    try:
+        sleep(1)
+        for wire_format in args.wire_formats:
+            for mode in args.modes:
+                for n_clients in args.clients:
+                    result = run_scenario(
+                        port,
+                        n_clients,
+                        mode,
+                        wire_format,
+                        args.duration,
+                        args.poll_interval,
+                    )
+                    results.append(result)
+                    print(
+                        f"{wire_format:>15} {mode:>8} {n_clients:3d} clients: "
+                        f"{result['frames_per_second']:6.1f} frames/s  "
+                        f"p50 {result['latency_p50_ms'] or 0:7.2f} ms  "
+                        f"p99 {result['latency_p99_ms'] or 0:7.2f} ms  "
+                        f"CPU {result['server_cpu_percent']:5.1f} %  "
+                        f"{(result['bytes_per_frame'] or 0) / 1e3:6.1f} kB/frame"
+                    )
+    finally:
+        process.kill()
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "version": __version__,
+                "time": time(),
+                "backend": args.backend,
+                "frame_rate": args.frame_rate,
+                "duration": args.duration,
+                "poll_interval": args.poll_interval,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {args.output}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=("fake", "simulate"), default="fake")
+    parser.add_argument("--frame-rate", type=float, default=100.0)
+    parser.add_argument("--clients", type=int, nargs="+", default=N_CLIENTS)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--wire-formats", nargs="+", default=WIRE_FORMATS)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--poll-interval", type=float, default=0.005)
+    parser.add_argument("--output", default="bench_end_to_end.json")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.backend, args.port, args.frame_rate)
+    else:
+        benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
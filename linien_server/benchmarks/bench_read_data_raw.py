@@ -0,0 +1,114 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmark of reading the scope memory, comparing the vectorized reader used by
+`AcquisitionService` with the previous implementation.
+
+Run with `python benchmarks/bench_read_data_raw.py`.
+"""
+
+from timeit import repeat
+
+import numpy as np
+from linien_common.common import MAX_N_POINTS, N_POINTS
+from linien_server.scope import CHANNEL_OFFSETS, read_scope_channels
+
+SCOPE_BUFFER_LENGTH = 16384
+
+
+class FakeScope:
+    """Mimics `pyrp3.instrument.Scope.reads` on top of random scope memory."""
+
+    def __init__(self, seed: int = 0) -> None:
+        rng = np.random.default_rng(seed)
+        self.memory = {}
+        for offset in CHANNEL_OFFSETS:
+            adc_a = rng.integers(0, 2**14, SCOPE_BUFFER_LENGTH, dtype=np.uint32)
+            adc_b = rng.integers(0, 2**14, SCOPE_BUFFER_LENGTH, dtype=np.uint32)
+            self.memory[offset] = ((adc_b << 16) | adc_a).tobytes()
+
+    def reads(self, addr: int, length: int) -> np.ndarray:
+        offset = addr & ~0xFFFF
+        start = (addr - offset) // 4
+        # like pyrp3, return a read-only view on the memory
+        return np.frombuffer(
+            self.memory[offset], dtype=np.uint32, count=length, offset=4 * start
+        )
+
+
+def read_data_raw_legacy(scope, offset, addr, data_length):
+    """The implementation of `AcquisitionService.read_data_raw` before vectorization."""
+    max_data_length = 16383
+    if data_length + addr > max_data_length:
+        to_read_later = data_length + addr - max_data_length
+        data_length -= to_read_later
+    else:
+        to_read_later = 0
+
+    raw_data = scope.reads(offset + (4 * addr), data_length).copy()
+    raw_data.dtype = np.int16
+    raw_data[raw_data >= 2**13] -= 2**14
+    signals = tuple(raw_data[signal_idx::2] for signal_idx in (0, 1))
+
+    if to_read_later > 0:
+        additional_raw_data = read_data_raw_legacy(scope, offset, 0, to_read_later)
+        signals = tuple(
+            np.append(signals[signal_idx], additional_raw_data[signal_idx])
+            for signal_idx in (0, 1)
+        )
+
+    return signals
+
+
+def check_results_agree(scope, addr, data_length):
+    out = np.zeros((4, MAX_N_POINTS), dtype=np.int16)
+    read_scope_channels(scope, CHANNEL_OFFSETS, addr, data_length, out)
+    for channel_idx, offset in enumerate(CHANNEL_OFFSETS):
+        legacy = read_data_raw_legacy(scope, offset, addr, data_length)
+        for sub_channel_idx in (0, 1):
+            expected = legacy[sub_channel_idx]
+            actual = out[2 * channel_idx + sub_channel_idx, :data_length]
+            assert np.array_equal(expected, actual), (addr, data_length)
+
+
+def benchmark(name, data_length, offsets, number=200):
+    scope = FakeScope()
+    # start close to the end of the buffer such that the read wraps around
+    addr = SCOPE_BUFFER_LENGTH - data_length // 3
+    check_results_agree(scope, addr, data_length)
+    out = np.zeros((4, MAX_N_POINTS), dtype=np.int16)
+
+    def legacy():
+        for offset in offsets:
+            read_data_raw_legacy(scope, offset, addr, data_length)
+
+    def vectorized():
+        read_scope_channels(scope, offsets, addr, data_length, out)
+
+    t_legacy = min(repeat(legacy, number=number, repeat=5)) / number
+    t_vectorized = min(repeat(vectorized, number=number, repeat=5)) / number
+    print(
+        f"{name:<32} legacy: {t_legacy * 1e6:8.1f} us/frame   "
+        f"vectorized: {t_vectorized * 1e6:8.1f} us/frame   "
+        f"speedup: {t_legacy / t_vectorized:4.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    benchmark(f"raw acquisition ({MAX_N_POINTS} points)", MAX_N_POINTS, (0x10000,))
+    benchmark(f"sweep, 4 signals ({N_POINTS} points)", N_POINTS, CHANNEL_OFFSETS)
@@ -21,7 +21,11 @@ from logging.handlers import RotatingFileHandler
 import importlib_metadata
 from linien_common.config import LOG_FILE_PATH
 
-#__version__ = importlib_metadata.version("linien-server")  # noqa: F401
+try:
+    __version__ = importlib_metadata.version("linien-server")  # noqa: F401
+except importlib_metadata.PackageNotFoundError:
+    # e.g. when running from a copy of the sources that is not installed
+    __version__ = "unknown"
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -19,17 +19,22 @@ import logging
 import pickle
 import subprocess
 from pathlib import Path
-from random import random
-from threading import Event, Thread
-from time import sleep
-from typing import Any, Optional
+from threading import Event, Lock, Thread
+from time import perf_counter, sleep
+from typing import Optional, Sequence
 
 import numpy as np
 from linien_common.common import DECIMATION, MAX_N_POINTS, N_POINTS
 from linien_common.config import ACQUISITION_PORT
-from linien_server.csr import PythonCSR
-from pyrp3.board import RedPitaya  # type: ignore
-from pyrp3.instrument import TriggerSource  # type: ignore
+from linien_server.csr import CSRWriteQueue, MMapRegisters, PythonCSR
+from linien_server.frame_buffer import RAW_SIGNAL_NAMES, FrameRingBuffer, FrameView
+from linien_server.metrics import PipelineMetrics
+from linien_server.polling import (
+    AdaptivePoller,
+    capture_time,
+    sweep_speed_to_time,
+)
+from linien_server.scope import CHANNEL_OFFSETS, read_scope_channels
 from rpyc import Service
 from rpyc.utils.server import ThreadedServer
 
@@ -38,29 +43,54 @@ logger.setLevel(logging.DEBUG)
 
 
 class AcquisitionService(Service):
-    def __init__(self) -> None:
+    def __init__(self, board=None) -> None:
+        """
+        `board` replaces the Red Pitaya, e.g. by a `SimulatedRedPitaya`. It has to
+        provide `read` / `write` for CSR access and a `scope` like
+        `pyrp3.board.RedPitaya`. By default, the gateware is flashed and the actual
+        board is used.
+        """
         super(AcquisitionService, self).__init__()
-        stop_nginx()
-        flash_fpga()
+        self.is_simulated = board is not None
+        if board is None:
+            stop_nginx()
+            flash_fpga()
+
+            # pyrp3 is only available on the Red Pitaya
+            from pyrp3.board import RedPitaya  # type: ignore
+            from pyrp3.instrument import TriggerSource  # type: ignore
+
+            self.red_pitaya = RedPitaya()
+            self.csr = PythonCSR(open_register_backend(self.red_pitaya))
+            self.trigger_source = TriggerSource.ext_posedge
+        else:
+            self.red_pitaya = board
+            self.csr = PythonCSR(board)
+            self.trigger_source = None
+        self.csr_queue = CSRWriteQueue()
+        self.csr_iir_queue = CSRWriteQueue()
+        # held while the queues are flushed such that batches of writes are applied
+        # between two frames as a whole
+        self.csr_write_lock = Lock()
+
+        # Recorded frames are published in a ring buffer that the control service reads
+        # without copying. Remote consumers fetch them via `exposed_return_data`.
+        self.frame_buffer = FrameRingBuffer()
+        self.data_uuid: float | None = None
 
-        self.red_pitaya = RedPitaya()
-        self.csr = PythonCSR(self.red_pitaya)
-        self.csr_queue: list[tuple[str, int]] = []
-        self.csr_iir_queue: list[tuple[str, list[float], list[float]]] = []
+        self.metrics = PipelineMetrics()
 
-        self.data: bytes | None = pickle.dumps(None)
-        self.data_was_raw = False
-        self.data_hash: float | None = None
-        self.data_uuid: float | None = None
+        # sleeps between polls of the scope trigger are adapted to the sweep period
+        self.poller = AdaptivePoller()
 
         self.locked = False
-        self.exposed_set_sweep_speed(9)
         # when self.locked is set to True, this doesn't mean that the lock is really on.
         # It just means that the lock is requested and that the gateware waits until the
         # sweep is at the correct position for the lock. Therefore, when self.locked is
         # set, the acquisition process waits for confirmation from the gateware that the
         # lock is actually running.
         self.confirmed_that_in_lock = False
+        self.exposed_set_sweep_speed(9)
 
         self.fetch_additional_signals = True
         self.raw_acquisition_enabled = False
@@ -87,138 +117,143 @@ class AcquisitionService(Service):
         self, stop_event: Event, pause_event: Event, skip_next_data_event: Event
     ) -> None:
         while not stop_event.is_set():
-            while self.csr_queue:
-                key, value = self.csr_queue.pop(0)
-                self.csr.set(key, value)
-
-            while self.csr_iir_queue:
-                name, b, a = self.csr_iir_queue.pop(0)
-                self.csr.set_iir(name, b, a)
+            with self.csr_write_lock:
+                self.csr_queue.flush(self.csr.set)
+                self.csr_iir_queue.flush(self._write_iir)
 
             if self.locked and not self.confirmed_that_in_lock:
-                self.confirmed_that_in_lock = bool(
-                    self.csr.get("logic_autolock_lock_running")
-                )
+                self.confirmed_that_in_lock = self.poller.poll(self._is_lock_running)
                 if not self.confirmed_that_in_lock:
-                    sleep(0.05)
+                    self.poller.wait()
                     continue
+                self.poller.set_period(capture_time(self.decimation))
 
             if pause_event.is_set():
                 sleep(0.05)
                 continue
 
-            # check that scope is triggered; copied from
-            # https://github.com/RedPitaya/RedPitaya/blob/14cca62dd58f29826ee89f4b28901602f5cdb1d8/api/src/oscilloscope.c#L115  # noqa: E501
-            if not (self.red_pitaya.scope.read(0x1 << 2) & 0x4) <= 0:
-                sleep(0.05)
+            if not self.poller.poll(self._is_triggered):
+                self.poller.wait()
                 continue
+            self.poller.frame_received()
+            trigger_time = perf_counter()
 
+            # the signals are read directly into the next slot of the ring buffer
+            slot, slot_data = self.frame_buffer.claim()
             if self.raw_acquisition_enabled:
-                data_raw = self.read_data_raw(
-                    0x10000, self.red_pitaya.scope.write_pointer_trigger, MAX_N_POINTS
+                self.read_data_raw(
+                    CHANNEL_OFFSETS[:1],
+                    self.red_pitaya.scope.write_pointer_trigger,
+                    MAX_N_POINTS,
+                    slot_data,
                 )
+                names, rows = RAW_SIGNAL_NAMES, (0, 1)
+                n_points = MAX_N_POINTS
+                slow_control_signal = None
                 is_raw = True
             else:
-                data = self.read_data()
+                names, rows, slow_control_signal = self.read_data(slot_data)
+                n_points = N_POINTS
                 is_raw = False
+            read_time = self.metrics.record_since("read", trigger_time)
 
             if pause_event.is_set():
                 # it may seem strange that we check this here a second time. Reason:
                 # `read_data` takes some time and if in the mean time acquisition
                 # was paused, we do not want to send the data
+                self.metrics.count("skipped_paused")
                 continue
 
             if skip_next_data_event.is_set():
                 skip_next_data_event.clear()
+                self.metrics.count("skipped_next")
             else:
-                if self.raw_acquisition_enabled:
-                    self.data = pickle.dumps(data_raw)
-                else:
-                    self.data = pickle.dumps(data)
-                self.data_was_raw = is_raw
-                self.data_hash = random()
+                self.frame_buffer.publish(
+                    slot,
+                    names,
+                    n_points,
+                    locked=self.locked,
+                    raw=is_raw,
+                    uuid=self.data_uuid,
+                    decimation=self.decimation,
+                    slow_control_signal=slow_control_signal,
+                    rows=rows,
+                    trigger_time=trigger_time,
+                )
+                self.metrics.record_since("publish", read_time)
 
             self.program_acquisition_and_rearm()
 
-    def read_data(self) -> dict[str, np.ndarray]:
-        signals = []
-
-        channel_offsets = [0x10000]
+    def _is_lock_running(self) -> bool:
+        return bool(self.csr.get("logic_autolock_lock_running"))
+
+    def _is_triggered(self) -> bool:
+        # check that scope is triggered; copied from
+        # https://github.com/RedPitaya/RedPitaya/blob/14cca62dd58f29826ee89f4b28901602f5cdb1d8/api/src/oscilloscope.c#L115  # noqa: E501
+        return (self.red_pitaya.scope.read(0x1 << 2) & 0x4) <= 0
+
+    def _write_iir(self, name: str, coefficients: tuple[list[float], list[float]]):
+        self.csr.set_iir(name, *coefficients)
+
+    def read_data(
+        self, out: np.ndarray
+    ) -> tuple[tuple[str, ...], tuple[int, ...], int]:
+        """
+        Read the signals into `out` (cf. `read_data_raw`). Returns the names of the
+        signals, the rows of `out` they are stored in and the value of the slow control
+        signal.
+        """
+        channel_offsets = CHANNEL_OFFSETS[:1]
         if self.fetch_additional_signals or self.locked:
-            channel_offsets.append(0x20000)
-
-        for channel_offset in channel_offsets:
-            channel_data = self.read_data_raw(
-                channel_offset,
-                self.red_pitaya.scope.write_pointer_trigger,
-                N_POINTS,
-            )
+            channel_offsets = CHANNEL_OFFSETS
 
-            for sub_channel_idx in (0, 1):
-                signals.append(channel_data[sub_channel_idx])
+        self.read_data_raw(
+            channel_offsets,
+            self.red_pitaya.scope.write_pointer_trigger,
+            N_POINTS,
+            out,
+        )
+        n_signals = 2 * len(channel_offsets)
 
-        signals_named = {}
+        # rows of `out`:
+        #   0: adc_a, 1: adc_b, 2: adc_a_q, 3: adc_b_q (only if both offsets are read)
+        signal_rows = {}
 
         if not self.locked:
-            signals_named["error_signal_1"] = signals[0]
+            signal_rows["error_signal_1"] = 0
 
-            if self.fetch_additional_signals and len(signals) >= 3:
-                signals_named["error_signal_1_quadrature"] = signals[2]
+            if self.fetch_additional_signals and n_signals >= 3:
+                signal_rows["error_signal_1_quadrature"] = 2
 
             if self.dual_channel:
-                signals_named["error_signal_2"] = signals[1]
-                if self.fetch_additional_signals and len(signals) >= 3:
-                    signals_named["error_signal_2_quadrature"] = signals[3]
+                signal_rows["error_signal_2"] = 1
+                if self.fetch_additional_signals and n_signals >= 3:
+                    signal_rows["error_signal_2_quadrature"] = 3
             else:
-                signals_named["monitor_signal"] = signals[1]
+                signal_rows["monitor_signal"] = 1
 
         else:
-            signals_named["error_signal"] = signals[0]
-            signals_named["control_signal"] = signals[1]
+            signal_rows["error_signal"] = 0
+            signal_rows["control_signal"] = 1
 
-            if not self.dual_channel and len(signals) >= 3:
-                signals_named["monitor_signal"] = signals[2]
+            if not self.dual_channel and n_signals >= 3:
+                signal_rows["monitor_signal"] = 2
 
         slow_out = self.csr.get("logic_slow_value")
         slow_out = slow_out if slow_out <= 8191 else slow_out - 16384
-        signals_named["slow_control_signal"] = slow_out
 
-        return signals_named
+        return tuple(signal_rows.keys()), tuple(signal_rows.values()), slow_out
 
     def read_data_raw(
-        self, offset: int, addr: int, data_length: int
-    ) -> tuple[Any, ...]:
-        max_data_length = 16383
-        if data_length + addr > max_data_length:
-            to_read_later = data_length + addr - max_data_length
-            data_length -= to_read_later
-        else:
-            to_read_later = 0
-
-        # raw data contains two signals:
-        #   2'h0,adc_b_rd,2'h0,adc_a_rd
-        #   i.e.: 2 zero bits, channel b (14 bit), 2 zero bits, channel a (14 bit)
-        # .copy() is required, because np.frombuffer returns a readonly array
-        raw_data = self.red_pitaya.scope.reads(offset + (4 * addr), data_length).copy()
-
-        # raw_data is an array of 32-bit ints. We cast it to 16 bit --> each original
-        # int is split into two ints
-        raw_data.dtype = np.int16
-
-        # sign bit is at position 14, but we have 16 bit ints
-        raw_data[raw_data >= 2**13] -= 2**14
-
-        # order is such that we have first the signal a then signal b
-        signals = tuple(raw_data[signal_idx::2] for signal_idx in (0, 1))
-
-        if to_read_later > 0:
-            additional_raw_data = self.read_data_raw(offset, 0, to_read_later)
-            signals = tuple(
-                np.append(signals[signal_idx], additional_raw_data[signal_idx])
-                for signal_idx in (0, 1)
-            )
-
-        return signals
+        self, offsets: Sequence[int], addr: int, data_length: int, out: np.ndarray
+    ) -> np.ndarray:
+        """
+        Read `data_length` samples starting at `addr` from the scope memory blocks
+        `offsets` into the int16 array `out` (two rows per memory block).
+        """
+        return read_scope_channels(
+            self.red_pitaya.scope, offsets, addr, data_length, out
+        )
 
     def program_acquisition_and_rearm(self, trigger_delay=16384):
         """Program the acquisition settings and rearm acquisition."""
@@ -229,28 +264,74 @@ class AcquisitionService(Service):
             self.red_pitaya.scope.trigger_delay = int(trigger_delay / DECIMATION) - 1
 
         elif self.raw_acquisition_enabled:
-            self.red_pitaya.scope.data_decimation = 2**self.raw_acquisition_decimation
+            target_decimation = 2**self.raw_acquisition_decimation
+            self.red_pitaya.scope.data_decimation = target_decimation
             self.red_pitaya.scope.trigger_delay = trigger_delay
 
         else:
-            self.red_pitaya.scope.data_decimation = 1
+            target_decimation = 1
+            self.red_pitaya.scope.data_decimation = target_decimation
             self.red_pitaya.scope.trigger_delay = int(trigger_delay / DECIMATION) - 1
 
-        self.red_pitaya.scope.rearm(trigger_source=TriggerSource.ext_posedge)
+        self.decimation = target_decimation
+        if not self.locked or not self.confirmed_that_in_lock:
+            # the scope is triggered by the sweep. When the lock was requested, the
+            # gateware waits for the sweep to reach the lock point, i.e. it is pointless
+            # to poll more often until the lock is confirmed.
+            self.poller.set_period(sweep_speed_to_time(self.sweep_speed))
+        else:
+            self.poller.set_period(capture_time(target_decimation))
 
-    def exposed_return_data(self, last_hash: Optional[float]) -> tuple[
+        self.red_pitaya.scope.rearm(trigger_source=self.trigger_source)
+
+    def exposed_return_data(self, last_sequence: Optional[int]) -> tuple[
         bool,
+        int | None,
+        bool | None,
+        bytes | None,
         float | None,
+    ]:
+        """
+        Return the most recent frame if it is newer than `last_sequence`. This is meant
+        for consumers that run in a different process (cf. `Registers`), local
+        consumers should read from `frame_buffer` directly.
+        """
+        return self._pack_frame(self.frame_buffer.latest(), last_sequence)
+
+    def exposed_wait_for_frame(
+        self, after_sequence: Optional[int], timeout: float
+    ) -> tuple[
+        bool,
+        int | None,
         bool | None,
         bytes | None,
         float | None,
     ]:
-        no_data_available = self.data_hash is None
-        data_not_changed = self.data_hash == last_hash
+        """
+        Like `exposed_return_data` but blocks for up to `timeout` seconds until a frame
+        newer than `after_sequence` has been recorded. Remote consumers should call this
+        on a connection of its own, as rpyc handles the requests of a connection
+        sequentially.
+        """
+        frame = self.frame_buffer.wait_for_frame(after_sequence, timeout)
+        return self._pack_frame(frame, after_sequence)
+
+    def _pack_frame(
+        self, frame: Optional[FrameView], last_sequence: Optional[int]
+    ) -> tuple[bool, int | None, bool | None, bytes | None, float | None]:
+        no_data_available = frame is None
+        data_not_changed = frame is not None and frame.sequence == last_sequence
         if data_not_changed or no_data_available or self.pause_event.is_set():
             return False, None, None, None, None
-        else:
-            return True, self.data_hash, self.data_was_raw, self.data, self.data_uuid
+
+        assert frame is not None
+        start = perf_counter()
+        data = pickle.dumps(frame.as_plot_data())
+        self.metrics.record_since("serialize", start)
+        if not frame.is_valid():
+            # slot was overwritten while pickling
+            return False, None, None, None, None
+        return True, frame.sequence, frame.header.raw, data, frame.header.uuid
 
     def exposed_set_sweep_speed(self, speed):
         self.sweep_speed = speed
@@ -272,29 +353,82 @@ class AcquisitionService(Service):
     def exposed_set_dual_channel(self, dual_channel):
         self.dual_channel = dual_channel
 
-    def exposed_set_csr(self, key: str, value: int) -> None:
-        self.csr_queue.append((key, value))
+    def exposed_set_csr(self, key: str, value: int, force: bool = False) -> None:
+        """
+        Queue a register write. Unless `force` is set, it may be merged with other
+        pending writes to the same register or skipped if the value did not change.
+        """
+        self.csr_queue.put(key, value, force)
 
     def exposed_set_iir_csr(self, name: str, b: list[float], a: list[float]) -> None:
-        self.csr_iir_queue.append((name, b, a))
+        self.csr_iir_queue.put(name, (list(b), list(a)))
+
+    def exposed_set_csr_batch(
+        self,
+        writes: Sequence[tuple],
+        iir_writes: Sequence[tuple[str, Sequence[float], Sequence[float]]] = (),
+    ) -> None:
+        """
+        Queue several register writes at once. They are applied atomically between two
+        acquisitions, i.e. the FPGA never runs with only part of the batch applied.
+
+        `writes` contains `(key, value)` or `(key, value, force)` tuples (see
+        `exposed_set_csr`), `iir_writes` contains `(name, b, a)` tuples.
+        """
+        csr_items = [
+            (entry[0], entry[1], bool(entry[2]) if len(entry) > 2 else False)
+            for entry in writes
+        ]
+        iir_items = [(name, (list(b), list(a)), False) for name, b, a in iir_writes]
+        with self.csr_write_lock:
+            self.csr_queue.put_many(csr_items)
+            self.csr_iir_queue.put_many(iir_items)
+
+    def exposed_get_csr_write_stats(self) -> dict[str, dict[str, int]]:
+        """Counters of queued, coalesced, skipped and actually written CSR writes."""
+        return {
+            "csr": self.csr_queue.get_stats(),
+            "iir": self.csr_iir_queue.get_stats(),
+        }
+
+    def exposed_set_poll_cpu_budget(self, cpu_budget: float) -> None:
+        """
+        Set the fraction of CPU time that may be spent polling the scope trigger. A
+        larger budget allows for shorter poll intervals, i.e. lower latency. Raises
+        `ValueError` if `cpu_budget` is not positive.
+        """
+        self.poller.set_cpu_budget(cpu_budget)
+
+    def exposed_get_acquisition_rate(self) -> dict[str, Optional[float]]:
+        """
+        Achieved frames per second compared to the rate expected from the sweep
+        period, along with statistics of the trigger polling.
+        """
+        return self.poller.get_stats()
+
+    def exposed_get_pipeline_metrics(self) -> dict[str, dict]:
+        """Timings of the acquisition stages and counters of skipped frames."""
+        return self.metrics.get_stats()
+
+    def exposed_set_pipeline_metrics_enabled(self, enabled: bool) -> None:
+        self.metrics.enabled = enabled
 
     def exposed_stop_acquisition(self) -> None:
         self.stop_event.set()
         self.thread.join()
-        start_nginx()
+        if not self.is_simulated:
+            start_nginx()
 
     def exposed_pause_acquisition(self):
         self.pause_event.set()
-        self.data_hash = None
-        self.data = None
+        self.frame_buffer.clear()
 
     def exposed_continue_acquisition(self, uuid: Optional[float]) -> None:
         self.program_acquisition_and_rearm()
         sleep(0.01)
         # resetting data here is not strictly required but we want to be on the safe
         # side
-        self.data_hash = None
-        self.data = None
+        self.frame_buffer.clear()
         self.pause_event.clear()
         self.data_uuid = uuid
         # if we are sweeping, we have to skip one data set because an incomplete sweep
@@ -315,6 +449,18 @@ def start_nginx():
     subprocess.Popen(["systemctl", "start", "redpitaya_nginx.service"])
 
 
+def open_register_backend(red_pitaya):
+    """
+    Access the CSRs through a memory map of the register window if possible, as this
+    is considerably faster than going through `pyrp3`.
+    """
+    try:
+        return MMapRegisters()
+    except OSError as e:
+        logger.warning(f"Unable to map CSRs, falling back to pyrp3: {e}")
+        return red_pitaya
+
+
 def stop_nginx():
     subprocess.Popen(["systemctl", "stop", "redpitaya_nginx.service"]).wait()
     subprocess.Popen(["systemctl", "stop", "redpitaya_scpi.service"]).wait()
@@ -16,7 +16,6 @@
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import pickle
 
 from linien_common.common import (
     SpectrumUncorrelatedException,
@@ -27,6 +26,7 @@ from linien_common.common import (
 from linien_server.autolock.algorithm_selection import AutolockAlgorithmSelector
 from linien_server.autolock.robust import RobustAutolock
 from linien_server.autolock.simple import SimpleAutolock
+from linien_server.frame_buffer import load_plot_data
 from linien_server.parameters import Parameters
 
 logger = logging.getLogger(__name__)
@@ -135,11 +135,15 @@ class Autolock:
     def add_data_listener(self):
         if not self._data_listener_added:
             self._data_listener_added = True
-            self.parameters.to_plot.add_callback(self.react_to_new_spectrum)
+            self.parameters.task_executor.add_callback(
+                self.parameters.to_plot, self.react_to_new_spectrum
+            )
 
     def remove_data_listener(self) -> None:
         self._data_listener_added = False
-        self.parameters.to_plot.remove_callback(self.react_to_new_spectrum)
+        self.parameters.task_executor.remove_callback(
+            self.parameters.to_plot, self.react_to_new_spectrum
+        )
 
     def react_to_new_spectrum(self, plot_data: bytes) -> None:
         """
@@ -163,7 +167,7 @@ class Autolock:
         if plot_data is None or not self.parameters.autolock_running.value:
             return
 
-        plot_data_unpickled = pickle.loads(plot_data)
+        plot_data_unpickled = load_plot_data(plot_data)
         if plot_data_unpickled is None:
             return
 
@@ -32,9 +32,9 @@ from linien_server.autolock.utils import (
     get_lock_region,
     get_target_peak,
     get_time_scale,
-    sign,
     sum_up_spectrum,
 )
+from linien_server.polling import sweep_speed_to_time
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -104,12 +104,19 @@ class RobustAutolock:
             logger.debug("enough spectra!, calculate")
 
             t1 = time()
-            description, final_wait_time, time_scale = calculate_autolock_instructions(
-                self.spectra, (self.x0, self.x1)
+            (
+                description,
+                final_wait_time,
+                time_scale,
+                diagnostics,
+            ) = calculate_autolock_instructions(
+                self.spectra, (self.x0, self.x1), return_diagnostics=True
             )
             t2 = time()
             dt = t2 - t1
-            logger.debug(f"Calculation of autolock description took {dt}")
+            logger.debug(
+                f"Calculation of autolock description took {dt} ({diagnostics})"
+            )
 
             # sets up a timeout: if the lock doesn't finish within a certain time span,
             # throw an error
@@ -176,11 +183,12 @@ class RobustAutolock:
 
 def get_all_peaks_improved(prepared_spectrum, target_idxs_prepared):
     
-    shift_extrema = (-max(prepared_spectrum), -min(prepared_spectrum)) #I want furst to shift everything down and then go up step by step
+    prepared_spectrum = np.asarray(prepared_spectrum)
+    shift_extrema = (-prepared_spectrum.max(), -prepared_spectrum.min()) #I want furst to shift everything down and then go up step by step
     shifts = np.linspace(shift_extrema[0], shift_extrema[1], num=6).astype(int)
     peaks = []
     for shift in shifts:
-        prepared_spectrum_shifted = [value + shift for value in prepared_spectrum]
+        prepared_spectrum_shifted = prepared_spectrum + shift
         temporary_peaks = get_all_peaks(prepared_spectrum_shifted, target_idxs_prepared)
         #print("temporary peaks", temporary_peaks)
         if len(temporary_peaks) > len(peaks):
@@ -192,10 +200,19 @@ def get_all_peaks_improved(prepared_spectrum, target_idxs_prepared):
     #print("final peaks", peaks)
     return peaks
 
-def calculate_autolock_instructions(spectra_with_jitter, target_idxs, zero_crossing_correction):
+def calculate_autolock_instructions(
+    spectra_with_jitter,
+    target_idxs,
+    zero_crossing_correction=None,
+    return_diagnostics=False,
+):
     '''
     zero_crossing_correction: - (+) if the shift in order to find easily the peaks has to be downwords (upwords)
     DA TOGLIERE
+
+    If `return_diagnostics` is set, a dictionary containing the selected tolerance
+    factor and the number of tolerances and lock positions that were evaluated is
+    returned as well.
     '''
 
     spectra, crop_left = crop_spectra_to_same_view(spectra_with_jitter)
@@ -222,9 +239,33 @@ def calculate_autolock_instructions(spectra_with_jitter, target_idxs, zero_cross
     y_scale = peaks[0][1]
 
     lock_regions = [get_lock_region(spectrum, target_idxs, prepared_spectrum) for spectrum in spectra]
+    # the spectra do not depend on the tolerance, so only prepare them once
+    spectra_xscaled = [
+        get_diff_at_time_scale(sum_up_spectrum(spectrum), time_scale)
+        for spectrum in spectra
+    ]
+    target_peak_idx = get_target_peak(prepared_spectrum, target_idxs_prepared)
 
+    diagnostics = {"n_tolerances_tried": 0, "n_lock_position_evaluations": 0}
+
+    def lock_position_is_correct(
+        summed_xscaled, lock_region, description, final_wait_time
+    ):
+        diagnostics["n_lock_position_evaluations"] += 1
+        try:
+            lock_position = get_lock_position_from_summed_xscaled(
+                summed_xscaled, description, final_wait_time
+            )
+        except LockPositionNotFound:
+            return False
+        return lock_region[0] <= lock_position <= lock_region[1]
+
+    # Tolerances have to be tried in order: whether a description works does not
+    # depend monotonically on the tolerance, so a bisection could end up with a
+    # different (less strict) description.
     for tolerance_factor in [0.95, 0.9, 0.85, 0.8, 0.75, 0.7, 0.65, 0.6, 0.55, 0.5]:
         logger.debug(f"Try out tolerance {tolerance_factor}")
+        diagnostics["n_tolerances_tried"] += 1
         peaks_filtered = [
             (peak_position, peak_height * tolerance_factor)
             for peak_position, peak_height in peaks
@@ -240,7 +281,6 @@ def calculate_autolock_instructions(spectra_with_jitter, target_idxs, zero_cross
         # now find out how much we have to wait in the end (because we detect the peak
         # too early because our threshold is too low)
         target_peak_described_height = peaks_filtered[0][1]
-        target_peak_idx = get_target_peak(prepared_spectrum, target_idxs_prepared)
         current_idx = target_peak_idx
         while True:
             current_idx -= 1
@@ -260,21 +300,16 @@ def calculate_autolock_instructions(spectra_with_jitter, target_idxs, zero_cross
                 (int(0.97 * (peak_position - last_peak_position)), int(peak_height))
             )
             last_peak_position = peak_position
-        print('for tolerance', tolerance_factor, 'description is', description)
-        # test whether description works fine for every recorded spectrum
-        does_work = True
-        for spectrum, lock_region in zip(spectra, lock_regions):
-            try:
-                lock_position = get_lock_position_from_autolock_instructions(
-                    spectrum, description, time_scale, spectra[0], final_wait_time
-                )
-                if not lock_region[0] <= lock_position <= lock_region[1]:
-                    raise LockPositionNotFound()
-
-            except LockPositionNotFound:
-                does_work = False
-
-        if does_work:
+        logger.debug(f"for tolerance {tolerance_factor} description is {description}")
+
+        # test whether description works fine for every recorded spectrum, stop at the
+        # first one that fails
+        if all(
+            lock_position_is_correct(
+                summed_xscaled, lock_region, description, final_wait_time
+            )
+            for summed_xscaled, lock_region in zip(spectra_xscaled, lock_regions)
+        ):
             break
     else:
         raise UnableToFindDescription()
@@ -284,43 +319,54 @@ def calculate_autolock_instructions(spectra_with_jitter, target_idxs, zero_cross
         description = description[-AUTOLOCK_MAX_N_INSTRUCTIONS:]
 
     logger.debug(f"Description is {description}")
+    if return_diagnostics:
+        diagnostics["tolerance_factor"] = tolerance_factor
+        return description, final_wait_time, time_scale, diagnostics
     return description, final_wait_time, time_scale
 
 
 def get_lock_position_from_autolock_instructions(
     spectrum, description, time_scale, initial_spectrum, final_wait_time
 ):
-    summed = sum_up_spectrum(spectrum)
-    summed_xscaled = get_diff_at_time_scale(summed, time_scale)
+    """Replay what the FPGA does when executing `description` on `spectrum`.
+
+    Each instruction `(wait_for, threshold)` is satisfied by the first index that lies
+    more than `wait_for` samples behind the previously detected peak and whose value
+    has the sign of `threshold` and at least its magnitude. The candidate indices of
+    every instruction are determined at once and the state machine only has to look
+    up the next candidate for each instruction."""
+    summed_xscaled = get_diff_at_time_scale(sum_up_spectrum(spectrum), time_scale)
+    return get_lock_position_from_summed_xscaled(
+        summed_xscaled, description, final_wait_time
+    )
 
-    description_idx = 0
 
-    last_detected_peak = 0
+def get_lock_position_from_summed_xscaled(
+    summed_xscaled, description, final_wait_time
+):
+    """Same as `get_lock_position_from_autolock_instructions` for a spectrum that
+    was already passed through `sum_up_spectrum` and `get_diff_at_time_scale`."""
+    if not description:
+        raise LockPositionNotFound()
 
-    for idx, value in enumerate(summed_xscaled):
-        wait_for, current_threshold = description[description_idx]
+    last_detected_peak = 0
+    next_idx = 0
 
-        if (
-            sign(value) == sign(current_threshold)
-            and abs(value) >= abs(current_threshold)
-            and idx - last_detected_peak > wait_for
-        ):
-            print('detected peak at', idx,  'with height', value, 'for threshold', current_threshold)
-            description_idx += 1
-            last_detected_peak = idx
+    for wait_for, current_threshold in description:
+        # equivalent to comparing sign and magnitude, `sign(0)` being positive
+        if current_threshold >= 0:
+            candidates = np.flatnonzero(summed_xscaled >= current_threshold)
+        else:
+            candidates = np.flatnonzero(summed_xscaled <= current_threshold)
 
-            if description_idx == len(description):
-                # this was the last peak!
-                return idx + final_wait_time
+        first_allowed = max(next_idx, last_detected_peak + wait_for + 1)
+        position = np.searchsorted(candidates, first_allowed)
+        if position == len(candidates):
+            raise LockPositionNotFound()
 
-    raise LockPositionNotFound()
+        last_detected_peak = int(candidates[position])
+        next_idx = last_detected_peak + 1
 
+    # this was the last peak!
+    return last_detected_peak + final_wait_time
 
-def sweep_speed_to_time(sweep_speed):
-    """
-    Sweep speed is an arbitrary unit (cf. `parameters.py`). This function converts it to
-    the duration of the sweep in seconds.
-    """
-    f_real = 3.8e3 / (2**sweep_speed)
-    duration = 1 / f_real
-    return duration
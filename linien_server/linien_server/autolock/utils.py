@@ -116,27 +116,22 @@ def get_time_scale(spectrum, target_idxs):
 
 
 def sum_up_spectrum(spectrum):
-    sum_ = 0
-    summed = []
-
-    for value in spectrum:
-        summed.append(sum_ + value)
-        sum_ += value
-
-    return summed
+    """Running sum of `spectrum`. Integer spectra are summed using int64 which is
+    wide enough to hold the sum register of the FPGA, so the result is bit-exact."""
+    spectrum = np.asarray(spectrum)
+    dtype = np.int64 if spectrum.dtype.kind in "biu" else np.float64
+    return np.cumsum(spectrum, dtype=dtype)
 
 
 def get_diff_at_time_scale(summed, xscale):
-    new = []
-
-    for idx, value in enumerate(summed):
-        if idx < xscale:
-            old = 0
-        else:
-            old = summed[idx - xscale]
-
-        new.append(value - old)
-
+    """Difference between the running sum and its copy delayed by `xscale` samples
+    (which is treated as zero before the start of the spectrum)."""
+    summed = np.asarray(summed)
+    new = summed.copy()
+    if xscale > 0:
+        new[xscale:] -= summed[:-xscale]
+    else:
+        new -= summed
     return new
 
 
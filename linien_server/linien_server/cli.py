@@ -19,7 +19,7 @@ import logging
 import shutil
 import subprocess
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
 import fire
 
@@ -59,13 +59,26 @@ class LinienServerCLI:
         """Check the status of the Linien server."""
         subprocess.run(["journalctl", "-u", "linien-server.service"])
 
-    def run(self, fake: bool = False, host: Optional[str] = None) -> None:
+    def run(
+        self,
+        fake: bool = False,
+        host: Optional[str] = None,
+        simulate: Union[bool, str] = False,
+        frame_rate: float = 10.0,
+    ) -> None:
         """
         Run the Linien server.
 
         Args:
-            fake: Whether to run a fake server.
+            fake: Whether to run a fake server that publishes synthetic data without
+                simulating the hardware. If `simulate` is a path, the fake server
+                replays these spectra.
             host: The hostname of the Red Pitaya.
+            simulate: Run the actual acquisition and control code on a simulated Red
+                Pitaya. If a path (or glob pattern) to recorded spectra such as
+                `robust_spectra.npy` is given, these are replayed. Otherwise, spectra
+                are synthesized.
+            frame_rate: Frames per second published by the fake server.
         """
         from linien_common.communication import (
             no_authenticator,
@@ -79,23 +92,63 @@ class LinienServerCLI:
         )
 
         if fake:
-            control = FakeRedPitayaControlService()
+            control = FakeRedPitayaControlService(
+                frame_rate=frame_rate,
+                spectra_path=simulate if isinstance(simulate, str) else None,
+            )
+        elif simulate:
+            from linien_server.simulation import create_simulated_red_pitaya
+
+            board = create_simulated_red_pitaya(
+                simulate if isinstance(simulate, str) else None
+            )
+            control = RedPitayaControlService(board=board)
         else:
             control = RedPitayaControlService(host=host)
 
-        if fake or host:
-            authenticator = no_authenticator
-        else:
+        on_red_pitaya = not (fake or host or simulate)
+        if on_red_pitaya:
             authenticator = username_and_password_authenticator
+        else:
+            authenticator = no_authenticator
 
         try:
-            if not (fake or host):  # only available on RP
+            if on_red_pitaya:  # only available on RP
                 mdio_tool.disable_ethernet_blinking()
             run_threaded_server(control, authenticator=authenticator)
         finally:
-            if not (fake or host):  # only available on RP
+            if on_red_pitaya:  # only available on RP
                 mdio_tool.enable_ethernet_blinking()
 
+    def run_host(self, boards: dict[str, str], simulate: bool = False) -> None:
+        """
+        Run a single server for several Red Pitayas. Autolock, optimization and noise
+        analysis of all boards run on this computer, only the acquisition runs on the
+        Red Pitayas. Clients select the board by name.
+
+        Args:
+            boards: Board names and hostnames of the Red Pitayas, e.g.
+                `--boards='{laser1: rp-f0a1b2.local, laser2: rp-f0c3d4.local}'`.
+            simulate: Use simulated Red Pitayas instead of connecting to the hosts.
+        """
+        from linien_common.communication import no_authenticator
+        from linien_server.multi_board import create_boards, run_multi_board_server
+        from linien_server.server import RedPitayaControlService
+
+        if simulate:
+            from linien_server.simulation import create_simulated_red_pitaya
+
+            def board_factory(host, parameter_store_filename):
+                return RedPitayaControlService(
+                    board=create_simulated_red_pitaya(),
+                    parameter_store_filename=parameter_store_filename,
+                )
+
+            services = create_boards(boards, board_factory)
+        else:
+            services = create_boards(boards)
+        run_multi_board_server(services, authenticator=no_authenticator)
+
     def enable(self) -> None:
         """Enable the Linien server to start on boot."""
         copy_systemd_service_file()
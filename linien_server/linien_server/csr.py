@@ -15,10 +15,94 @@
 # You should have received a copy of the GNU General Public License
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
+import mmap
+import os
+import stat
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Callable, Iterable, Mapping, Optional, Sequence, Union
 
 from . import csrmap
 from .iir_coeffs import get_params
 
+# size of the memory window that contains all CSRs (32 maps of 2 kB)
+REGISTER_WINDOW_SIZE = 32 << 11
+
+
+class MMapRegisters:
+    """
+    Register backend that accesses the CSRs through a memory map of the register
+    window. Each access is a single 32 bit load or store on the mapped memory.
+
+    On the Red Pitaya, `/dev/mem` is mapped at the physical address of the registers.
+    For tests, any regular file can be used as a stand-in by passing `file_offset=0`;
+    it is extended to the size of the register window if required.
+    """
+
+    def __init__(
+        self,
+        path: str = "/dev/mem",
+        address: int = 0x40300000,
+        size: int = REGISTER_WINDOW_SIZE,
+        file_offset: Optional[int] = None,
+    ) -> None:
+        self.address = address
+        self.size = size
+        if file_offset is None:
+            file_offset = address
+
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            if stat.S_ISREG(os.fstat(fd).st_mode):
+                if os.fstat(fd).st_size < file_offset + size:
+                    os.ftruncate(fd, file_offset + size)
+            self._mmap = mmap.mmap(
+                fd,
+                size,
+                mmap.MAP_SHARED,
+                mmap.PROT_READ | mmap.PROT_WRITE,
+                offset=file_offset,
+            )
+        finally:
+            os.close(fd)
+        self._words = memoryview(self._mmap).cast("I")
+
+    def read(self, addr: int) -> int:
+        return self._words[(addr - self.address) >> 2]
+
+    def write(self, addr: int, value: int) -> None:
+        self._words[(addr - self.address) >> 2] = value
+
+    def close(self) -> None:
+        self._words.release()
+        self._mmap.close()
+
+
+class CSRPlan:
+    """
+    Precomputed access plan of a single CSR. CSRs are split into bytes, each of which
+    is stored in its own 32 bit word. `addresses[i]` holds the bits starting at
+    `shifts[i]`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        addresses: tuple[int, ...],
+        shifts: tuple[int, ...],
+        width: int,
+        writable: bool,
+    ) -> None:
+        self.name = name
+        self.addresses = addresses
+        self.shifts = shifts
+        self.width = width
+        self.writable = writable
+        self.modulus = 1 << width
+        self.mask = self.modulus - 1
+        self.parts = tuple(zip(addresses, shifts))
+
 
 class PythonCSR:
     map = csrmap.csr
@@ -26,7 +110,14 @@ class PythonCSR:
     offset = 0x40300000
 
     def __init__(self, rp) -> None:
+        """
+        `rp` is the register backend, i.e. an object with `read(addr)` and
+        `write(addr, value)` methods like `pyrp3.board.RedPitaya` or `MMapRegisters`.
+        """
         self.rp = rp
+        self._plans: dict[str, CSRPlan] = {}
+        # shift, width and orders of the IIRs, cf. `_iir_format`
+        self._iir_formats: dict[str, tuple[int, int, tuple[int, ...]]] = {}
 
     def set_one(self, addr: int, value: int) -> None:
         self.rp.write(addr, value)
@@ -34,49 +125,191 @@ class PythonCSR:
     def get_one(self, addr: int):
         return int(self.rp.read(addr))
 
-    def set(self, name: str, value: int) -> None:
+    def plan(self, name: str) -> CSRPlan:
+        """Return the (cached) access plan of the CSR `name`."""
+        try:
+            return self._plans[name]
+        except KeyError:
+            pass
+
         map, addr, width, wr = self.map[name]
-        assert wr, name
+        b = (width + 8 - 1) // 8
+        plan = CSRPlan(
+            name,
+            addresses=tuple(
+                self.offset + (map << 11) + ((addr + i) << 2) for i in range(b)
+            ),
+            shifts=tuple(8 * (b - i - 1) for i in range(b)),
+            width=width,
+            writable=bool(wr),
+        )
+        self._plans[name] = plan
+        return plan
 
-        ma = 1 << width
-        bit_mask = ma - 1
-        val = value & bit_mask
-        assert value == val or ma + value == val, (
+    def set(self, name: str, value: int) -> None:
+        plan = self._plans.get(name) or self.plan(name)
+        assert plan.writable, name
+
+        val = value & plan.mask
+        assert value == val or plan.modulus + value == val, (
             f"Value for {name} out of range",
-            (value, val, ma),
+            (value, val, plan.modulus),
         )
 
-        b = (width + 8 - 1) // 8
-        for i in range(b):
-            v = (val >> (8 * (b - i - 1))) & 0xFF
-            self.set_one(self.offset + (map << 11) + ((addr + i) << 2), v)
+        write = self.rp.write
+        for address, shift in plan.parts:
+            write(address, (val >> shift) & 0xFF)
 
     def get(self, name: str) -> int:
         if name in self.constants:
             return self.constants[name]
 
-        map, addr, nr, wr = self.map[name]
+        plan = self._plans.get(name) or self.plan(name)
+        read = self.rp.read
         v = 0
-        b = (nr + 8 - 1) // 8
-        for i in range(b):
-            v |= self.get_one(self.offset + (map << 11) + ((addr + i) << 2)) << 8 * (
-                b - i - 1
-            )
+        for address, shift in plan.parts:
+            v |= int(read(address)) << shift
         return v
 
-    def set_iir(self, prefix: str, b: list[float], a: list[float]) -> None:
-        shift = self.get(prefix + "_shift") or 16
-        width = self.get(prefix + "_width") or 18
-        bb, _, params = get_params(b, a, shift, width)
+    def set_many(self, values: Union[Mapping[str, int], Iterable[tuple[str, int]]]):
+        """Write several CSRs in the given order."""
+        items = values.items() if isinstance(values, Mapping) else values
+        for name, value in items:
+            self.set(name, value)
+
+    def get_many(self, names: Iterable[str]) -> dict[str, int]:
+        """Read several CSRs."""
+        return {name: self.get(name) for name in names}
 
-        for k in sorted(params):
-            self.set(prefix + "_" + k, params[k])
-        self.set(prefix + "_z0", 0)
-        for i in range(len(bb), 3):
-            n = prefix + f"_b{i}"
-            if n in self.map:
-                self.set(n, 0)
-                self.set(prefix + f"_a{i}", 0)
+    def set_iir(self, prefix: str, b: Sequence[float], a: Sequence[float]) -> None:
+        shift, width, orders = self._iir_format(prefix)
+        for name, value in iir_register_values(
+            prefix, tuple(b), tuple(a), shift, width, orders
+        ):
+            self.set(name, value)
+
+    def _iir_format(self, prefix: str) -> tuple[int, int, tuple[int, ...]]:
+        """
+        Shift and width of the coefficients of the IIR `prefix` as well as the orders
+        for which it has coefficient registers. These don't change, so they are looked
+        up once.
+        """
+        try:
+            return self._iir_formats[prefix]
+        except KeyError:
+            pass
+        iir_format = (
+            self.get(prefix + "_shift") or 16,
+            self.get(prefix + "_width") or 18,
+            tuple(i for i in range(3) if prefix + f"_b{i}" in self.map),
+        )
+        self._iir_formats[prefix] = iir_format
+        return iir_format
 
     def states(self, *names):
         return sum(1 << csrmap.states.index(name) for name in names)
+
+
+@lru_cache(maxsize=256)
+def iir_register_values(
+    prefix: str,
+    b: tuple[float, ...],
+    a: tuple[float, ...],
+    shift: int,
+    width: int,
+    orders: tuple[int, ...],
+) -> tuple[tuple[str, int], ...]:
+    """
+    Register values that configure the IIR `prefix` as the filter given by `b` and
+    `a`, coefficients of unused `orders` are set to zero. Quantizing the coefficients is
+    comparatively expensive and the same few filters are written over and over again
+    (e.g. the automatic filters while `modulation_frequency` is optimized), hence the
+    result is memoized.
+    """
+    bb, _, params = get_params(list(b), list(a), shift, width)
+    values = [(f"{prefix}_{k}", params[k]) for k in sorted(params)]
+    values.append((f"{prefix}_z0", 0))
+    for i in orders:
+        if i >= len(bb):
+            values += [(f"{prefix}_b{i}", 0), (f"{prefix}_a{i}", 0)]
+    return tuple(values)
+
+
+class CSRWriteQueue:
+    """
+    Thread-safe queue of pending register writes.
+
+    Only the last pending value is kept for every key, i.e. writing the same register
+    several times before the queue is flushed results in a single write. Additionally,
+    a shadow copy of the values that were written last is kept such that writes that
+    would not change the register are skipped entirely.
+
+    Writes with `force=True` bypass the shadow copy and are not merged with writes that
+    are already pending for the same key. This is required for pulses like setting
+    `logic_sweep_run` to 0 and back to 1.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        # pending writes are organized in segments that are flushed one after another.
+        # A new segment is only started if a forced write must not be merged with a
+        # pending one.
+        self._segments: list[OrderedDict[str, tuple[Any, bool]]] = [OrderedDict()]
+        self._shadow: dict[str, Any] = {}
+
+        self.n_queued = 0
+        self.n_coalesced = 0
+        self.n_skipped = 0
+        self.n_written = 0
+
+    def put(self, key: str, value: Any, force: bool = False) -> None:
+        with self._lock:
+            self._put(key, value, force)
+
+    def put_many(self, items: Iterable[tuple[str, Any, bool]]) -> None:
+        """Enqueue several `(key, value, force)` writes atomically."""
+        with self._lock:
+            for key, value, force in items:
+                self._put(key, value, force)
+
+    def _put(self, key: str, value: Any, force: bool) -> None:
+        self.n_queued += 1
+        segment = self._segments[-1]
+        if key in segment:
+            if force:
+                segment = OrderedDict()
+                self._segments.append(segment)
+            else:
+                # move the key to the end such that the order of writes is preserved
+                del segment[key]
+                self.n_coalesced += 1
+        segment[key] = (value, force)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(segment) for segment in self._segments)
+
+    def flush(self, write: Callable[[str, Any], None]) -> None:
+        """Call `write(key, value)` for all pending writes that change a value."""
+        with self._lock:
+            if len(self._segments) == 1 and not self._segments[0]:
+                return
+            segments = self._segments
+            self._segments = [OrderedDict()]
+
+        for segment in segments:
+            for key, (value, force) in segment.items():
+                if not force and key in self._shadow and self._shadow[key] == value:
+                    self.n_skipped += 1
+                    continue
+                write(key, value)
+                self._shadow[key] = value
+                self.n_written += 1
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "queued": self.n_queued,
+            "coalesced": self.n_coalesced,
+            "skipped": self.n_skipped,
+            "written": self.n_written,
+        }
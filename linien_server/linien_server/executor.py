@@ -0,0 +1,170 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Any, Callable, Optional
+
+from linien_server.metrics import RollingWindow
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# marks an empty slot of `LatestValueWorker`, `None` is a valid value
+_EMPTY = object()
+
+
+class LatestValueWorker:
+    """
+    Calls `function` with the values passed to `submit` on a separate thread.
+
+    The work queue holds a single value: if `function` is still busy when new values
+    arrive, only the most recent one is processed and the others are dropped. Values for
+    which `is_stale` returns `True` when they are picked up are dropped as well.
+    """
+
+    def __init__(
+        self,
+        function: Callable[[Any], None],
+        name: str,
+        is_stale: Optional[Callable[[Any], bool]] = None,
+    ) -> None:
+        self.function = function
+        self.name = name
+        self.is_stale = is_stale
+        self.n_processed = 0
+        self.n_dropped = 0
+        self.n_stale = 0
+        # duration of the calls of `function`
+        self.durations = RollingWindow()
+
+        self._pending: Any = _EMPTY
+        self._lock = Lock()
+        self._new_value = Event()
+        self.stop_event = Event()
+        self.thread = Thread(target=self._run, name=name, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop the worker. May be called from within `function`."""
+        self.stop_event.set()
+        self._new_value.set()
+
+    def submit(self, value: Any) -> None:
+        with self._lock:
+            if self._pending is not _EMPTY:
+                self.n_dropped += 1
+            self._pending = value
+        self._new_value.set()
+
+    def _run(self) -> None:
+        while True:
+            self._new_value.wait()
+            self._new_value.clear()
+            if self.stop_event.is_set():
+                return
+            with self._lock:
+                value, self._pending = self._pending, _EMPTY
+            if value is _EMPTY:
+                continue
+            if self.is_stale is not None and self.is_stale(value):
+                self.n_stale += 1
+                continue
+
+            start = perf_counter()
+            try:
+                self.function(value)
+            except Exception:
+                logger.exception(f"Error in background task {self.name}")
+            self.durations.add(perf_counter() - start)
+            self.n_processed += 1
+
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            "processed": self.n_processed,
+            "dropped": self.n_dropped,
+            "stale": self.n_stale,
+            "duration": self.durations.summary(),
+        }
+
+
+class TaskExecutor:
+    """
+    Runs callbacks of tasks (autolock, optimization, noise analysis) that react to new
+    data of a parameter, e.g. `to_plot`.
+
+    As `Parameter` calls its callbacks synchronously, a slow callback would block the
+    thread that sets the value, i.e. the thread that pushes acquired data. In background
+    mode, each callback gets its own `LatestValueWorker` instead, such that computations
+    do not delay the next frames and frames that arrive while the task is busy are
+    skipped. Otherwise (the default, e.g. for scripted use and tests), callbacks are
+    registered with the parameter directly.
+
+    As a value may wait in a worker while the task itself changes the settings of the
+    acquisition, `is_stale` is checked right before a value is handed to the task, e.g.
+    to drop frames that were recorded with the previous settings.
+    """
+
+    def __init__(
+        self,
+        background: bool = False,
+        is_stale: Optional[Callable[[Any], bool]] = None,
+    ) -> None:
+        self.background = background
+        self.is_stale = is_stale
+        self._workers: dict[tuple[int, Callable[[Any], None]], LatestValueWorker] = {}
+
+    def add_callback(
+        self,
+        parameter,
+        function: Callable[[Any], None],
+        call_immediately: bool = False,
+    ) -> None:
+        if not self.background:
+            parameter.add_callback(function, call_immediately=call_immediately)
+            return
+
+        key = (id(parameter), function)
+        if key in self._workers:
+            return
+        worker = LatestValueWorker(
+            function, getattr(function, "__qualname__", "task"), self._is_stale
+        )
+        self._workers[key] = worker
+        worker.start()
+        parameter.add_callback(worker.submit, call_immediately=call_immediately)
+
+    def remove_callback(self, parameter, function: Callable[[Any], None]) -> None:
+        worker = self._workers.pop((id(parameter), function), None)
+        if worker is None:
+            parameter.remove_callback(function)
+            return
+        parameter.remove_callback(worker.submit)
+        worker.stop()
+
+    def _is_stale(self, value: Any) -> bool:
+        return self.is_stale is not None and self.is_stale(value)
+
+    def stop(self) -> None:
+        for worker in self._workers.values():
+            worker.stop()
+
+    def get_stats(self) -> dict[str, dict[str, Any]]:
+        return {worker.name: worker.get_stats() for worker in self._workers.values()}
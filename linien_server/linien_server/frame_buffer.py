@@ -0,0 +1,513 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import pickle
+from threading import Condition
+from time import perf_counter
+from typing import Any, Optional
+
+import numpy as np
+from linien_common.common import MAX_N_POINTS
+from linien_server.wire_format import (
+    WIRE_FORMAT_BINARY_ZLIB,
+    WIRE_FORMAT_PICKLE,
+    WireHeader,
+    encode,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# names of the two signals contained in a raw acquisition
+RAW_SIGNAL_NAMES = ("raw_a", "raw_b")
+
+
+class FrameHeader:
+    """Meta data that is stored alongside the signals of each frame."""
+
+    def __init__(
+        self,
+        sequence: int,
+        names: tuple[str, ...],
+        n_points: int,
+        locked: bool,
+        raw: bool,
+        uuid: Optional[float],
+        decimation: int,
+        slow_control_signal: Optional[int] = None,
+        rows: Optional[tuple[int, ...]] = None,
+        trigger_time: Optional[float] = None,
+        publish_time: Optional[float] = None,
+    ) -> None:
+        self.sequence = sequence
+        self.names = names
+        # row of the slot that holds the signal of the same index in `names`
+        self.rows = rows if rows is not None else tuple(range(len(names)))
+        self.n_points = n_points
+        self.locked = locked
+        self.raw = raw
+        self.uuid = uuid
+        self.decimation = decimation
+        self.slow_control_signal = slow_control_signal
+        # `perf_counter` timestamps of the scope trigger and of publishing the frame
+        self.trigger_time = trigger_time
+        self.publish_time = publish_time
+
+
+class FrameView:
+    """
+    Read-only view of a single slot of `FrameRingBuffer`.
+
+    The signals are numpy views on the memory of the ring buffer, i.e. no data is
+    copied. As the producer eventually reuses the slot, consumers that keep a view for a
+    longer time should check `is_valid` after they are done with the data.
+    """
+
+    def __init__(self, buffer: "FrameRingBuffer", slot: int, header: FrameHeader):
+        self._buffer = buffer
+        self._slot = slot
+        self.header = header
+
+    @property
+    def sequence(self) -> int:
+        return self.header.sequence
+
+    def signals(self) -> dict[str, np.ndarray]:
+        data = self._buffer.data[self._slot]
+        n_points = self.header.n_points
+        return {
+            name: data[row, :n_points]
+            for name, row in zip(self.header.names, self.header.rows)
+        }
+
+    def as_plot_data(self) -> dict[str, np.ndarray | int] | tuple[np.ndarray, ...]:
+        """
+        Return the frame in the format that was historically used for `to_plot`
+        (dictionary of signals) and `acquisition_raw_data` (tuple of two signals).
+        """
+        signals = self.signals()
+        if self.header.raw:
+            return tuple(signals[name] for name in RAW_SIGNAL_NAMES)
+
+        plot_data: dict[str, np.ndarray | int] = dict(signals)
+        if self.header.slow_control_signal is not None:
+            plot_data["slow_control_signal"] = self.header.slow_control_signal
+        return plot_data
+
+    def is_valid(self) -> bool:
+        """Check that the producer did not overwrite the slot in the meantime."""
+        return self._buffer.sequences[self._slot] == self.header.sequence
+
+
+class Frame:
+    """
+    Immutable frame of acquired signals as it is published on `parameters.to_plot` and
+    `parameters.acquisition_raw_data`.
+
+    Server-side consumers work with the (read-only) numpy arrays returned by
+    `as_plot_data`, e.g. via `load_plot_data`. The pickled representation that remote
+    clients expect is only created when needed (`to_bytes`) and then reused.
+    """
+
+    def __init__(
+        self,
+        signals: dict[str, np.ndarray],
+        sequence: int,
+        locked: bool,
+        raw: bool,
+        uuid: Optional[float] = None,
+        decimation: int = 1,
+        slow_control_signal: Optional[int] = None,
+        trigger_time: Optional[float] = None,
+        publish_time: Optional[float] = None,
+        pickled: Optional[bytes] = None,
+    ) -> None:
+        for signal in signals.values():
+            signal.flags.writeable = False
+        self._signals = signals
+        self._sequence = sequence
+        self._locked = locked
+        self._raw = raw
+        self._uuid = uuid
+        self._decimation = decimation
+        self._slow_control_signal = slow_control_signal
+        self._pickled = pickled
+        # encoded and decimated variants, cf. `to_bytes`
+        self._encoded: dict[
+            tuple[str, Optional[int], Optional[tuple[str, ...]]], bytes
+        ] = {}
+        # `perf_counter` timestamps, only meaningful within the acquiring process
+        self.trigger_time = trigger_time
+        self.publish_time = publish_time
+
+    @classmethod
+    def from_view(cls, view: FrameView) -> "Frame":
+        """
+        Copy a frame out of the ring buffer. As the slot may be overwritten while
+        copying, check `view.is_valid()` afterwards.
+        """
+        header = view.header
+        return cls(
+            {name: signal.copy() for name, signal in view.signals().items()},
+            sequence=header.sequence,
+            locked=header.locked,
+            raw=header.raw,
+            uuid=header.uuid,
+            decimation=header.decimation,
+            slow_control_signal=header.slow_control_signal,
+            trigger_time=header.trigger_time,
+            publish_time=header.publish_time,
+        )
+
+    @classmethod
+    def from_plot_data(
+        cls,
+        plot_data: dict[str, Any] | tuple[np.ndarray, ...],
+        sequence: int,
+        raw: bool,
+        uuid: Optional[float] = None,
+        pickled: Optional[bytes] = None,
+    ) -> "Frame":
+        """Create a frame from data in the format returned by `as_plot_data`."""
+        if raw:
+            signals = dict(zip(RAW_SIGNAL_NAMES, plot_data))
+            slow_control_signal = None
+        else:
+            assert isinstance(plot_data, dict)
+            signals = dict(plot_data)
+            slow_control_signal = signals.pop("slow_control_signal", None)
+        return cls(
+            signals,
+            sequence=sequence,
+            locked="control_signal" in signals,
+            raw=raw,
+            uuid=uuid,
+            slow_control_signal=slow_control_signal,
+            pickled=pickled,
+        )
+
+    @property
+    def sequence(self) -> int:
+        return self._sequence
+
+    @property
+    def locked(self) -> bool:
+        return self._locked
+
+    @property
+    def raw(self) -> bool:
+        return self._raw
+
+    @property
+    def uuid(self) -> Optional[float]:
+        return self._uuid
+
+    @property
+    def decimation(self) -> int:
+        return self._decimation
+
+    @property
+    def slow_control_signal(self) -> Optional[int]:
+        return self._slow_control_signal
+
+    def signals(self) -> dict[str, np.ndarray]:
+        return dict(self._signals)
+
+    def as_plot_data(self) -> dict[str, np.ndarray | int] | tuple[np.ndarray, ...]:
+        """
+        Return the frame in the format that was historically used for `to_plot`
+        (dictionary of signals) and `acquisition_raw_data` (tuple of two signals).
+        """
+        if self._raw:
+            return tuple(self._signals[name] for name in RAW_SIGNAL_NAMES)
+
+        plot_data: dict[str, np.ndarray | int] = dict(self._signals)
+        if self._slow_control_signal is not None:
+            plot_data["slow_control_signal"] = self._slow_control_signal
+        return plot_data
+
+    def to_bytes(
+        self,
+        n_points: Optional[int] = None,
+        signals: Optional[tuple[str, ...]] = None,
+        wire_format: str = WIRE_FORMAT_PICKLE,
+    ) -> bytes:
+        """
+        Plot data encoded for remote clients, by default pickled as expected by clients
+        that did not negotiate a different `wire_format`.
+
+        If `n_points` is given, the signals are reduced to a min/max envelope of that
+        many points (cf. `min_max_envelope`). If `signals` is given, only these signals
+        are included. Each variant is computed at most once per frame such that it can
+        be shared among clients.
+        """
+        if n_points is None and signals is None and wire_format == WIRE_FORMAT_PICKLE:
+            if self._pickled is None:
+                self._pickled = pickle.dumps(self.as_plot_data())
+            return self._pickled
+
+        key = (wire_format, n_points, signals)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            if wire_format == WIRE_FORMAT_PICKLE:
+                encoded = pickle.dumps(self._reduced_plot_data(n_points, signals))
+            else:
+                encoded = self._encode_binary(
+                    n_points, signals, compress=wire_format == WIRE_FORMAT_BINARY_ZLIB
+                )
+            self._encoded[key] = encoded
+        return encoded
+
+    def _reduced_signals(
+        self, n_points: Optional[int], signals: Optional[tuple[str, ...]]
+    ) -> dict[str, np.ndarray]:
+        reduced = self._signals
+        if signals is not None and not self._raw:
+            reduced = {name: s for name, s in reduced.items() if name in signals}
+        if n_points is not None:
+            reduced = {
+                name: min_max_envelope(s, n_points) for name, s in reduced.items()
+            }
+        return reduced
+
+    def _reduced_plot_data(
+        self, n_points: Optional[int], signals: Optional[tuple[str, ...]]
+    ) -> dict[str, np.ndarray | int] | tuple[np.ndarray, ...]:
+        reduced = self._reduced_signals(n_points, signals)
+        if self._raw:
+            return tuple(reduced[name] for name in RAW_SIGNAL_NAMES)
+        plot_data: dict[str, np.ndarray | int] = dict(reduced)
+        if self._slow_control_signal is not None and (
+            signals is None or "slow_control_signal" in signals
+        ):
+            plot_data["slow_control_signal"] = self._slow_control_signal
+        return plot_data
+
+    def _encode_binary(
+        self,
+        n_points: Optional[int],
+        signals: Optional[tuple[str, ...]],
+        compress: bool,
+    ) -> bytes:
+        reduced = self._reduced_signals(n_points, signals)
+        names = RAW_SIGNAL_NAMES if self._raw else tuple(reduced)
+        header = WireHeader(
+            names,
+            n_points=len(reduced[names[0]]) if names else 0,
+            sequence=self._sequence,
+            locked=self._locked,
+            raw=self._raw,
+            uuid=self._uuid,
+            decimation=self._decimation,
+            slow_control_signal=(
+                self._slow_control_signal
+                if signals is None or "slow_control_signal" in signals
+                else None
+            ),
+        )
+        try:
+            return encode(header, reduced, compress=compress)
+        except ValueError:
+            # e.g. simulated data that exceeds the range of the ADC
+            logger.warning("Frame does not fit into the binary format, using pickle")
+            return pickle.dumps(self._reduced_plot_data(n_points, signals))
+
+
+def min_max_envelope(signal: np.ndarray, n_points: int) -> np.ndarray:
+    """
+    Decimate `signal` to `n_points` points that alternate between the minimum and the
+    maximum of `n_points // 2` consecutive segments of the signal. Unlike plain
+    downsampling, this preserves narrow features like peaks.
+    """
+    n_bins = max(n_points // 2, 1)
+    if len(signal) <= 2 * n_bins:
+        return signal
+    edges = np.linspace(0, len(signal), n_bins + 1).astype(int)[:-1]
+    envelope = np.empty((n_bins, 2), dtype=signal.dtype)
+    envelope[:, 0] = np.minimum.reduceat(signal, edges)
+    envelope[:, 1] = np.maximum.reduceat(signal, edges)
+    return envelope.ravel()
+
+
+def load_plot_data(value: Frame | bytes) -> Any:
+    """
+    Return the plot data of a value of `to_plot` or `acquisition_raw_data`. These are
+    `Frame`s, pickled data are accepted as well.
+    """
+    if isinstance(value, Frame):
+        return value.as_plot_data()
+    return pickle.loads(value)
+
+
+def serialize_frame(value: Any, wire_format: str = WIRE_FORMAT_PICKLE) -> Any:
+    """
+    Replace `Frame`s by their representation in `wire_format` before sending to
+    clients.
+    """
+    if isinstance(value, Frame):
+        return value.to_bytes(wire_format=wire_format)
+    return value
+
+
+class FrameRingBuffer:
+    """
+    Preallocated ring buffer that holds the most recent frames recorded by the
+    `AcquisitionService`.
+
+    The acquisition loop writes the signals of each frame directly into a slot of a
+    single int16 array (`claim` / `publish`) and publishes it with a monotonically
+    increasing sequence number. Consumers (`RedPitayaControlService` and the tasks
+    running there) read the data as numpy views, so no serialization is required as
+    long as producer and consumer live in the same process. Consumers block in
+    `wait_for_frame` until a new frame is published.
+    """
+
+    def __init__(
+        self, n_slots: int = 8, n_signals: int = 4, max_n_points: int = MAX_N_POINTS
+    ) -> None:
+        self.n_slots = n_slots
+        self.data = np.zeros((n_slots, n_signals, max_n_points), dtype=np.int16)
+        # sequence number of the frame that is currently stored in each slot, -1 means
+        # that the slot is empty or currently being written to
+        self.sequences = np.full(n_slots, -1, dtype=np.int64)
+        self._headers: list[Optional[FrameHeader]] = [None] * n_slots
+        self._condition = Condition()
+        self._last_sequence = 0
+        self._latest_slot: Optional[int] = None
+
+    @property
+    def last_sequence(self) -> int:
+        """Sequence number of the most recently published frame (0 if none)."""
+        return self._last_sequence
+
+    def claim(self) -> tuple[int, np.ndarray]:
+        """
+        Reserve the next slot for writing. Returns its index and its memory (shape
+        `(n_signals, max_n_points)`) that the caller fills before calling `publish`.
+        """
+        slot = (self._last_sequence + 1) % self.n_slots
+        # invalidate views that consumers may still hold on the old frame
+        self.sequences[slot] = -1
+        return slot, self.data[slot]
+
+    def publish(
+        self,
+        slot: int,
+        names: tuple[str, ...],
+        n_points: int,
+        locked: bool,
+        raw: bool,
+        uuid: Optional[float],
+        decimation: int,
+        slow_control_signal: Optional[int] = None,
+        rows: Optional[tuple[int, ...]] = None,
+        trigger_time: Optional[float] = None,
+    ) -> int:
+        """
+        Publish a slot that was filled after `claim`. Returns the sequence number of the
+        new frame.
+        """
+        with self._condition:
+            self._last_sequence += 1
+            header = FrameHeader(
+                self._last_sequence,
+                names,
+                n_points,
+                locked,
+                raw,
+                uuid,
+                decimation,
+                slow_control_signal,
+                rows,
+                trigger_time,
+                perf_counter(),
+            )
+            self._headers[slot] = header
+            self.sequences[slot] = header.sequence
+            self._latest_slot = slot
+            self._condition.notify_all()
+        return header.sequence
+
+    def write(
+        self,
+        signals: dict[str, np.ndarray],
+        locked: bool,
+        raw: bool,
+        uuid: Optional[float],
+        decimation: int,
+        slow_control_signal: Optional[int] = None,
+    ) -> int:
+        """
+        Copy `signals` into the next slot and publish them. Returns the sequence number
+        of the new frame.
+        """
+        n_points = len(next(iter(signals.values())))
+        slot, slot_data = self.claim()
+        for idx, signal in enumerate(signals.values()):
+            slot_data[idx, :n_points] = signal
+
+        return self.publish(
+            slot,
+            tuple(signals.keys()),
+            n_points,
+            locked,
+            raw,
+            uuid,
+            decimation,
+            slow_control_signal,
+        )
+
+    def latest(self) -> Optional[FrameView]:
+        """Return a view of the most recent frame or `None` if there is none."""
+        with self._condition:
+            return self._latest()
+
+    def wait_for_frame(
+        self, after_sequence: Optional[int], timeout: Optional[float] = None
+    ) -> Optional[FrameView]:
+        """
+        Block until a frame with a sequence number larger than `after_sequence` is
+        available and return a view of the most recent frame. Returns `None` if no such
+        frame was published within `timeout` seconds.
+        """
+        after_sequence = after_sequence or 0
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._latest_slot is not None
+                and self._last_sequence > after_sequence,
+                timeout,
+            )
+            frame = self._latest()
+        if frame is None or frame.sequence <= after_sequence:
+            return None
+        return frame
+
+    def _latest(self) -> Optional[FrameView]:
+        if self._latest_slot is None:
+            return None
+        header = self._headers[self._latest_slot]
+        assert header is not None
+        return FrameView(self, self._latest_slot, header)
+
+    def clear(self) -> None:
+        """
+        Forget about the frames that were published so far. Sequence numbers keep
+        increasing.
+        """
+        with self._condition:
+            self._latest_slot = None
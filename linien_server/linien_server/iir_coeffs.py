@@ -16,6 +16,7 @@
 # along with Linien. If not, see <http://www.gnu.org/licenses/>.
 
 import warnings
+from functools import lru_cache
 from math import ceil, log2, pi
 from typing import Optional
 
@@ -110,6 +111,15 @@ def make_filter(
     return b, a
 
 
+@lru_cache(maxsize=256)
+def make_filter_cached(
+    name: str, k: float = 1.0, f: float = 0.0, g: float = 1e20, q: float = 0.5
+) -> tuple[tuple[float, ...], tuple[float, ...]]:
+    """Memoized `make_filter` that returns tuples, which can't be altered by callers."""
+    b, a = make_filter(name, k=k, f=f, g=g, q=q)
+    return tuple(b), tuple(a)
+
+
 def quantize_filter(
     b: list[float], a: list[float], shift: Optional[int] = None, width: int = 25
 ) -> tuple[list[int], list[int], int]:
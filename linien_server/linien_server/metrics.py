@@ -0,0 +1,106 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+class RollingWindow:
+    """Fixed-size window of the most recent samples of a quantity."""
+
+    def __init__(self, size: int = 1024) -> None:
+        self._values = [0.0] * size
+        self._size = size
+        self._idx = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self._values[self._idx] = value
+        self._idx = (self._idx + 1) % self._size
+        self.count += 1
+
+    def values(self) -> np.ndarray:
+        return np.array(self._values[: min(self.count, self._size)])
+
+    def summary(self) -> dict[str, float]:
+        values = self.values()
+        if not len(values):
+            return {"count": 0}
+        summary = {"count": self.count, "mean": float(np.mean(values))}
+        for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+            summary[f"p{percentile}"] = float(value)
+        return summary
+
+
+class PipelineMetrics:
+    """
+    Timings of the stages that a frame passes on its way from the scope trigger to the
+    clients, as well as counters for frames that were skipped.
+
+    Recording a sample only costs a few list operations, percentiles are computed when
+    the statistics are requested.
+    """
+
+    def __init__(self, window_size: int = 1024, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._window_size = window_size
+        self._stages: dict[str, RollingWindow] = {}
+        self._counters: dict[str, int] = {}
+
+    def record(self, stage: str, duration: float) -> None:
+        """Record the duration of `stage` (in seconds) for a single frame."""
+        if not self.enabled:
+            return
+        try:
+            window = self._stages[stage]
+        except KeyError:
+            window = self._stages[stage] = RollingWindow(self._window_size)
+        window.add(duration)
+
+    def record_since(self, stage: str, start: Optional[float]) -> float:
+        """
+        Record the time that passed since `start` (a `perf_counter` timestamp) and
+        return the current time.
+        """
+        now = perf_counter()
+        if start is not None:
+            self.record(stage, now - start)
+        return now
+
+    def count(self, counter: str, n: int = 1) -> None:
+        if self.enabled:
+            self._counters[counter] = self._counters.get(counter, 0) + n
+
+    def reset(self) -> None:
+        self._stages.clear()
+        self._counters.clear()
+
+    def get_stats(self) -> dict[str, dict]:
+        """
+        Return `count`, `mean`, `p50`, `p95` and `p99` (in seconds) for each stage as
+        well as the counters.
+        """
+        return {
+            "stages": {
+                stage: window.summary() for stage, window in list(self._stages.items())
+            },
+            "counters": dict(self._counters),
+        }
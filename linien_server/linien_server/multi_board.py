@@ -0,0 +1,148 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+from socket import socket
+from typing import Any, Callable, Optional
+
+import rpyc
+from linien_common.config import SERVER_PORT
+from rpyc.core.protocol import Connection
+from rpyc.utils.helpers import classpartial
+from rpyc.utils.server import ThreadedServer
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# board names are used in file names of the parameter stores
+BOARD_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class BoardSelectorService(rpyc.Service):
+    """
+    Root service of a single connection to a multi-board host, cf.
+    `run_multi_board_server`.
+
+    The client selects a board by name, either by exposing a `board` attribute on its
+    own root service (like `uuid`) or by calling `select_board`. Afterwards, all
+    attributes that are not defined here are forwarded to the `RedPitayaControlService`
+    of that board, i.e. the connection behaves like a connection to a single-board
+    server. If the host manages a single board only, it is selected automatically.
+    """
+
+    def __init__(self, boards: dict[str, rpyc.Service]) -> None:
+        self._boards = boards
+        self._board_name: Optional[str] = None
+        self._conn: Optional[Connection] = None
+
+    @property
+    def _board(self) -> Optional[rpyc.Service]:
+        if self._board_name is None:
+            return None
+        return self._boards[self._board_name]
+
+    def on_connect(self, conn: Connection) -> None:
+        self._conn = conn
+        try:
+            board_name = conn.root.board
+        except AttributeError:
+            board_name = None
+
+        if board_name is not None:
+            self.exposed_select_board(board_name)
+        elif len(self._boards) == 1:
+            self.exposed_select_board(next(iter(self._boards)))
+
+    def on_disconnect(self, conn: Connection) -> None:
+        if self._board is not None:
+            self._board.on_disconnect(conn)
+        self._board_name = None
+
+    def exposed_get_boards(self) -> list[str]:
+        return list(self._boards)
+
+    def exposed_get_board(self) -> Optional[str]:
+        return self._board_name
+
+    def exposed_select_board(self, name: str) -> None:
+        if name not in self._boards:
+            raise ValueError(f"Unknown board {name}, available: {list(self._boards)}")
+        if self._board is not None:
+            self._board.on_disconnect(self._conn)
+        self._board_name = name
+        self._board.on_connect(self._conn)
+        logger.info(f"Client selected board {name}")
+
+    def exposed_shutdown(self) -> None:
+        raise RuntimeError(
+            "A multi-board host can't be shut down by a client of a single board"
+        )
+
+    def _rpyc_getattr(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(f"cannot access {name!r}")
+        exposed_name = name if name.startswith("exposed_") else f"exposed_{name}"
+        if hasattr(self, exposed_name):
+            return getattr(self, exposed_name)
+        if self._board is None:
+            raise AttributeError(f"No board selected, cannot access {name!r}")
+        if hasattr(self._board, exposed_name):
+            return getattr(self._board, exposed_name)
+        return getattr(self._board, name)
+
+
+def create_boards(
+    hosts: dict[str, Optional[str]],
+    board_factory: Optional[Callable[..., rpyc.Service]] = None,
+) -> dict[str, rpyc.Service]:
+    """
+    Create a control service for each board in `hosts` that maps board names to the
+    hostnames of the Red Pitayas running the acquisition service. Each board gets its
+    own parameters (stored in `parameters_<name>.json`), registers and tasks.
+    `board_factory` defaults to `RedPitayaControlService`.
+    """
+    if board_factory is None:
+        from linien_server.server import RedPitayaControlService
+
+        board_factory = RedPitayaControlService
+
+    boards = {}
+    for name, host in hosts.items():
+        if not BOARD_NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid board name {name}")
+        logger.info(f"Starting control service for board {name} ({host})")
+        boards[name] = board_factory(
+            host=host, parameter_store_filename=f"parameters_{name}.json"
+        )
+    return boards
+
+
+def run_multi_board_server(
+    boards: dict[str, rpyc.Service],
+    authenticator: Callable[[socket], tuple[socket, None]],
+    port: int = SERVER_PORT,
+) -> None:
+    """Serve several boards with a single listener, cf. `BoardSelectorService`."""
+    logger.info(f"Starting multi-board server for {', '.join(boards)}")
+    server = ThreadedServer(
+        classpartial(BoardSelectorService, boards),
+        port=port,
+        authenticator=authenticator,
+        protocol_config={"allow_pickle": True, "allow_public_attrs": True},
+    )
+    server.start()
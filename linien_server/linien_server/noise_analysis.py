@@ -23,6 +23,7 @@ from time import sleep, time
 
 import numpy as np
 from linien_common.common import PSDAlgorithm
+from linien_server.frame_buffer import load_plot_data
 from linien_server.optimization.engine import MultiDimensionalOptimizationEngine
 from pylpsd import lpsd
 from scipy import signal
@@ -127,15 +128,17 @@ class PSDAcquisition:
             raise e
 
     def add_callbacks(self):
-        self.parameters.acquisition_raw_data.add_callback(
-            self.react_to_new_signal, call_immediately=False
+        self.parameters.task_executor.add_callback(
+            self.parameters.acquisition_raw_data, self.react_to_new_signal
         )
 
     def cleanup(self):
         self.running = False
         self.parameters.psd_acquisition_running.value = False
 
-        self.parameters.acquisition_raw_data.remove_callback(self.react_to_new_signal)
+        self.parameters.task_executor.remove_callback(
+            self.parameters.acquisition_raw_data, self.react_to_new_signal
+        )
 
         if not self.is_child:
             self.control.exposed_pause_acquisition()
@@ -150,7 +153,7 @@ class PSDAcquisition:
             if not self.running or self.parameters.pause_acquisition.value:
                 return
 
-            data = pickle.loads(data_pickled)
+            data = load_plot_data(data_pickled)
 
             current_decimation = self.parameters.acquisition_raw_decimation.value
             logger.debug(f"Recorded signal for decimation {current_decimation}")
@@ -20,6 +20,7 @@ import pickle
 
 import numpy as np
 from linien_common.common import determine_shift_by_correlation, get_lock_point
+from linien_server.frame_buffer import load_plot_data
 
 from .approach_line import Approacher
 from .engine import OptimizerEngine
@@ -61,7 +62,9 @@ class OptimizeSpectroscopy:
 
         params = self.parameters
         self.engine = OptimizerEngine(self.control, params)
-        params.to_plot.add_callback(self.react_to_new_spectrum, call_immediately=True)
+        params.task_executor.add_callback(
+            params.to_plot, self.react_to_new_spectrum, call_immediately=True
+        )
         params.optimization_running.value = True
         params.optimization_improvement.value = 0
 
@@ -101,7 +104,7 @@ class OptimizeSpectroscopy:
             dual_channel = params.dual_channel.value
             channel = params.optimization_channel.value
             spectrum_idx = 1 if not dual_channel else (1, 2)[channel]
-            unpickled = pickle.loads(spectrum)
+            unpickled = load_plot_data(spectrum)
             spectrum = unpickled[f"error_signal_{spectrum_idx}"]
             quadrature = unpickled[f"error_signal_{spectrum_idx}_quadrature"]
 
@@ -166,7 +169,9 @@ class OptimizeSpectroscopy:
             self.engine.request_and_set_new_parameters(use_initial_parameters=True)
 
         self.parameters.optimization_running.value = False
-        self.parameters.to_plot.remove_callback(self.react_to_new_spectrum)
+        self.parameters.task_executor.remove_callback(
+            self.parameters.to_plot, self.react_to_new_spectrum
+        )
         self.parameters.task.value = None
 
         self.reset_scan()
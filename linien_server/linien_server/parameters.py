@@ -17,14 +17,28 @@
 
 import json
 import logging
+import os
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import partial
+from itertools import count
+from pathlib import Path
+from threading import Event, Lock, Thread
 from time import time
 from typing import Any, Callable, Iterator
 
 import linien_server
 from linien_common.common import AutolockMode, MHz, PSDAlgorithm, Vpp
 from linien_common.config import USER_DATA_PATH, create_backup_file
+from linien_server.executor import TaskExecutor
+from linien_server.frame_buffer import serialize_frame
+from linien_server.wire_format import WIRE_FORMAT_PICKLE
 
 PARAMETER_STORE_FILENAME = "parameters.json"
+# appended to `PARAMETER_STORE_FILENAME` for the file of `ParameterJournal`
+JOURNAL_SUFFIX = ".journal"
+# maximum number of queued values of parameters without `collapsed_sync` per client
+MAX_CHANGED_PARAMETERS_QUEUE_SIZE = 1000
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -93,6 +107,51 @@ class Parameter:
             self._callbacks.remove(function)
 
 
+class ChangedParametersQueue:
+    """
+    Parameter changes that were not yet fetched by a client.
+
+    A new value of a parameter with `collapsed_sync` replaces its previous value and is
+    moved to the end of the queue, other values are appended. Both is O(1). Of the
+    latter, at most `max_size` values are kept, older ones are dropped and counted in
+    `n_dropped` such that a stalled client can't grow the memory without limit.
+    """
+
+    def __init__(self, max_size: int = MAX_CHANGED_PARAMETERS_QUEUE_SIZE) -> None:
+        self.max_size = max_size
+        self.n_dropped = 0
+        # parameter name (collapsed) or running index (not collapsed) -> (name, value)
+        self._items: OrderedDict[str | int, tuple[str, Any]] = OrderedDict()
+        self._uncollapsed_keys: deque[int] = deque()
+        self._index = count()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def append(self, name: str, value: Any, collapse: bool = True) -> None:
+        with self._lock:
+            if collapse:
+                self._items.pop(name, None)
+                self._items[name] = (name, value)
+                return
+
+            key = next(self._index)
+            self._items[key] = (name, value)
+            self._uncollapsed_keys.append(key)
+            if len(self._uncollapsed_keys) > self.max_size:
+                del self._items[self._uncollapsed_keys.popleft()]
+                self.n_dropped += 1
+
+    def drain(self) -> list[tuple[str, Any]]:
+        """Remove and return all queued changes in the order they happened."""
+        with self._lock:
+            items = self._items
+            self._items = OrderedDict()
+            self._uncollapsed_keys.clear()
+        return list(items.values())
+
+
 class Parameters:
     """
     This class defines the parameters of the Linien server. They represent the public
@@ -117,15 +176,25 @@ class Parameters:
     """
 
     def __init__(self):
-        # dict[str, list[tuple[str, Any]]]
+        # dict[str, ChangedParametersQueue]
         self._changed_parameters_queue = {}
         # dict[tuple[Parameter, Callable[[Any], None]]]
         self._remote_listener_callbacks = {}
+        # dict[str, Event], set when the queue of the client is not empty
+        self._changed_parameters_events = {}
+        # dict[str, str], wire format of frames negotiated by the client, cf.
+        # `linien_server.wire_format`
+        self._wire_formats = {}
+        # while > 0, clients are not notified about changes, cf. `batch_changes`
+        self._batch_depth = 0
+        # runs the callbacks of tasks that react to new data, cf. `TaskExecutor`
+        self.task_executor = TaskExecutor()
 
         self.to_plot = Parameter(sync=False)
         """
-        The `to_plot` parameter is a pickled dictionary that contains signals that may
-        be plotted. Depending on the locking state, it may contain these signals:
+        The `to_plot` parameter is a `Frame` (clients receive it as pickled dictionary,
+        cf. `Frame.to_bytes`) that contains signals that may be plotted. Depending on
+        the locking state, it may contain these signals:
         Unlocked state:
           - `error_signal_1` and `error_signal_1_quadrature`:
               IQ-demodulated and low-pass-filtered error signals from ANALOG IN 0
@@ -154,6 +223,14 @@ class Parameters:
         `error_signal_2_max`.
         """
 
+        self.signal_stats_selection = Parameter(
+            start=["mean", "std", "max", "min"], restorable=True
+        )
+        """
+        The statistics that are calculated for `signal_stats`, any of `mean`, `std`,
+        `max` and `min`. If empty, `signal_stats` is not updated at all.
+        """
+
         # ------------------- GENERAL PARAMETERS ---------------------------------------
 
         self.mod_channel = Parameter(start=0, min_=0, max_=1, restorable=True)
@@ -597,6 +674,46 @@ class Parameters:
             if isinstance(param, Parameter):
                 yield name, param
 
+    @contextmanager
+    def batch_changes(self) -> Iterator[None]:
+        """
+        Defer notifying clients (cf. `wait_for_changed_parameters`) about changes made
+        within this context, such that they are woken up once for all of them.
+        """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                for uuid, queue in list(self._changed_parameters_queue.items()):
+                    event = self._changed_parameters_events.get(uuid)
+                    if len(queue) and event is not None:
+                        event.set()
+
+    def set_values(self, values: dict[str, Any]) -> None:
+        """
+        Set several parameters at once. All names and values are checked before any
+        parameter is changed, i.e. if a `ValueError` or `TypeError` is raised, no
+        parameter was changed.
+        """
+        params = {}
+        for name, value in values.items():
+            param = getattr(self, name, None)
+            if not isinstance(param, Parameter):
+                raise ValueError(f"Unknown parameter {name}")
+            for bound in (param.min, param.max):
+                try:
+                    if bound is not None:
+                        value < bound
+                except TypeError:
+                    raise TypeError(f"Invalid value {value!r} for parameter {name}")
+            params[name] = param
+
+        with self.batch_changes():
+            for name, value in values.items():
+                params[name].value = value
+
     def init_parameter_sync(
         self, uuid: str
     ) -> Iterator[tuple[str, Any, bool, bool, bool, bool]]:
@@ -605,10 +722,11 @@ class Parameters:
         and if the parameters are suited to be cached registers a listener that pushes
         changes of these parameters to the client.
         """
+        wire_format = self.get_wire_format(uuid)
         for name, param in self:
             yield (
                 name,
-                param.value,
+                serialize_frame(param.value, wire_format),
                 param.can_be_cached,
                 param.restorable,
                 param.loggable,
@@ -617,16 +735,28 @@ class Parameters:
             if param.can_be_cached:
                 self.register_remote_listener(uuid, name)
 
+    def set_wire_format(self, uuid: str, wire_format: str) -> None:
+        """Set the format in which frames are sent to a specific client."""
+        self._wire_formats[uuid] = wire_format
+
+    def get_wire_format(self, uuid: str) -> str:
+        return self._wire_formats.get(uuid, WIRE_FORMAT_PICKLE)
+
     def register_remote_listener(self, uuid: str, param_name: str) -> None:
-        self._changed_parameters_queue.setdefault(uuid, [])
+        if uuid not in self._changed_parameters_queue:
+            self._changed_parameters_queue[uuid] = ChangedParametersQueue()
         self._remote_listener_callbacks.setdefault(uuid, [])
+        event = self._changed_parameters_events.setdefault(uuid, Event())
+        param: Parameter = getattr(self, param_name)
 
         def append_changed_values_to_queue(value: Any) -> None:
             """Appends changed values to the queue of a specific client."""
-            if uuid in self._changed_parameters_queue:
-                self._changed_parameters_queue[uuid].append((param_name, value))
+            queue = self._changed_parameters_queue.get(uuid)
+            if queue is not None:
+                queue.append(param_name, value, param._collapsed_sync)
+                if not self._batch_depth:
+                    event.set()
 
-        param: Parameter = getattr(self, param_name)
         param.add_callback(append_changed_values_to_queue, call_immediately=True)
 
         self._remote_listener_callbacks[uuid].append(
@@ -634,45 +764,80 @@ class Parameters:
         )
 
     def unregister_remote_listeners(self, uuid: str):
-        for param, callback in self._remote_listener_callbacks[uuid]:
+        # clients that don't cache parameters may not have registered any listener
+        for param, callback in self._remote_listener_callbacks.pop(uuid, []):
             param.remove_callback(callback)
 
-        del self._changed_parameters_queue[uuid]
-        del self._remote_listener_callbacks[uuid]
+        self._changed_parameters_queue.pop(uuid, None)
+        self._wire_formats.pop(uuid, None)
+        # wake up anyone waiting for changes of this client
+        if uuid in self._changed_parameters_events:
+            self._changed_parameters_events.pop(uuid).set()
+
+    def wait_for_changed_parameters(self, uuid: str, timeout: float) -> bool:
+        """
+        Block until the queue of parameter changes of a specific client is not empty.
+        Returns `False` if nothing changed within `timeout` seconds. Raises `KeyError`
+        if the client has no remote listeners (anymore).
+        """
+        event = self._changed_parameters_events[uuid]
+        return event.wait(timeout) and uuid in self._changed_parameters_queue
 
     def get_changed_parameters_queue(self, uuid: str) -> list[tuple[str, Any]]:
-        """Get the queue of parameter changes for a specific client."""
-        queue = self._changed_parameters_queue.get(uuid, [])
-        self._changed_parameters_queue[uuid] = []
-
-        # filter out multiple values for collapsible parameters
-        already_has_value = []
-        for idx in reversed(range(len(queue))):
-            param_name, value = queue[idx]
-            if getattr(self, param_name)._collapsed_sync:
-                if param_name in already_has_value:
-                    del queue[idx]
-                else:
-                    already_has_value.append(param_name)
-        return queue
-
-
-def restore_parameters(parameters: Parameters) -> Parameters:
-    """When the server starts, this method restores previously saved parameters."""
-    filename = str(USER_DATA_PATH / PARAMETER_STORE_FILENAME)
+        """
+        Get the queue of parameter changes for a specific client. For parameters with
+        `collapsed_sync`, only the most recent value is contained.
+        """
+        if uuid in self._changed_parameters_events:
+            self._changed_parameters_events[uuid].clear()
+        queue = self._changed_parameters_queue.get(uuid)
+        if queue is None:
+            return []
+
+        wire_format = self.get_wire_format(uuid)
+        # frames are encoded only for the values that are actually sent
+        return [
+            (param_name, serialize_frame(value, wire_format))
+            for param_name, value in queue.drain()
+        ]
+
+    def get_dropped_parameter_changes(self, uuid: str) -> int:
+        """
+        Number of changes of parameters without `collapsed_sync` that were dropped
+        because the client did not fetch them in time.
+        """
+        queue = self._changed_parameters_queue.get(uuid)
+        return queue.n_dropped if queue is not None else 0
+
+
+def restore_parameters(
+    parameters: Parameters, store_filename: str = PARAMETER_STORE_FILENAME
+) -> Parameters:
+    """
+    When the server starts, this method restores previously saved parameters: the
+    snapshot in `store_filename` followed by the changes recorded in its journal (cf.
+    `ParameterJournal`).
+    """
+    filename = str(USER_DATA_PATH / store_filename)
+    attributes_by_name: dict[str, dict[str, Any]] = {}
     try:
         with open(filename, "r") as f:
             logger.info(f"Restoring parameters from {filename}")
-            data = json.load(f)
+            attributes_by_name = json.load(f)["parameters"]
     except FileNotFoundError:
         logger.info(f"Couldn't find {filename}. Using default parameters.")
-        return parameters
     except json.JSONDecodeError:
         logger.error(f"Parameters file {filename} was corrupted.")
         create_backup_file(filename)
-        return parameters
 
-    for name, attributes in data["parameters"].items():
+    journal_filename = USER_DATA_PATH / f"{store_filename}{JOURNAL_SUFFIX}"
+    changes = read_journal(journal_filename)
+    if changes:
+        logger.info(f"Replaying {len(changes)} changes from {journal_filename}")
+    for name, attributes in changes.items():
+        attributes_by_name.setdefault(name, {"log": False}).update(attributes)
+
+    for name, attributes in attributes_by_name.items():
         try:
             getattr(parameters, name).value = attributes["value"]
             getattr(parameters, name).log = attributes["log"]
@@ -682,23 +847,164 @@ def restore_parameters(parameters: Parameters) -> Parameters:
     return parameters
 
 
-def save_parameters(parameters: Parameters) -> None:
-    """Gather all parameters and store them on disk."""
+def save_parameters(
+    parameters: Parameters, store_filename: str = PARAMETER_STORE_FILENAME
+) -> None:
+    """
+    Gather all parameters and store them on disk. The file is replaced atomically, i.e.
+    a crash while saving leaves the previous file intact.
+    """
 
     parameters_dict = {}
     for name, param in parameters:
         if param.restorable:
             parameters_dict[name] = {"value": param.value, "log": param.log}
 
-    filename = str(USER_DATA_PATH / PARAMETER_STORE_FILENAME)
-    with open(filename, "w") as f:
+    filename = str(USER_DATA_PATH / store_filename)
+    temporary_filename = f"{filename}.tmp"
+    with open(temporary_filename, "w") as f:
         json.dump(
             {
-                "version": linien_server.__version__,
+                "version": getattr(linien_server, "__version__", "unknown"),
                 "time": time(),
                 "parameters": parameters_dict,
             },
             f,
             indent=2,
         )
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_filename, filename)
     logger.info(f"Saved parameters to {filename}")
+
+
+def read_journal(filename: Path) -> dict[str, dict[str, Any]]:
+    """
+    Return the most recent attributes (`value` and `log`) of each parameter recorded in
+    the journal `filename`. An incomplete last entry, e.g. due to a power cut while
+    writing, is ignored.
+    """
+    changes: dict[str, dict[str, Any]] = {}
+    try:
+        with open(filename, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Ignoring incomplete entry of {filename}")
+                    break
+                changes.update(entry["changes"])
+    except FileNotFoundError:
+        pass
+    return changes
+
+
+class ParameterJournal:
+    """
+    Append-only journal of the changes of restorable parameters, such that they survive
+    a crash or power cut (`save_parameters` only runs when the server exits).
+
+    Changes are collected by callbacks (the only work done when a parameter is set) and
+    written by a background thread every `flush_interval` seconds as a single line of
+    JSON, followed by an fsync. After `compact_after` entries, a snapshot is written
+    with `save_parameters` and the journal is truncated. `restore_parameters` replays
+    the journal on top of the snapshot.
+    """
+
+    def __init__(
+        self,
+        parameters: Parameters,
+        store_filename: str = PARAMETER_STORE_FILENAME,
+        flush_interval: float = 1.0,
+        compact_after: int = 1000,
+    ) -> None:
+        self.parameters = parameters
+        self.store_filename = store_filename
+        self.filename = USER_DATA_PATH / f"{store_filename}{JOURNAL_SUFFIX}"
+        self.flush_interval = flush_interval
+        self.compact_after = compact_after
+
+        self._pending: dict[str, Any] = {}
+        self._lock = Lock()
+        self._changed = Event()
+        self.stop_event = Event()
+        self._n_entries = 0
+        self._callbacks: list[tuple[Parameter, Callable[[Any], None]]] = []
+        self.thread = Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        for name, param in self.parameters:
+            if param.restorable:
+                callback = partial(self._record, name)
+                param.add_callback(callback)
+                self._callbacks.append((param, callback))
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Write the pending changes and a snapshot. Called when the server exits."""
+        if self.stop_event.is_set():
+            return
+        for param, callback in self._callbacks:
+            param.remove_callback(callback)
+        self.stop_event.set()
+        self._changed.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        # this runs at exit, so don't raise if the snapshot can't be written
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("Unable to save parameters when stopping journal")
+
+    def _record(self, name: str, value: Any) -> None:
+        with self._lock:
+            self._pending[name] = value
+        self._changed.set()
+
+    def _run(self) -> None:
+        while not self.stop_event.is_set():
+            self._changed.wait()
+            # collect the changes of `flush_interval` in a single entry
+            self.stop_event.wait(self.flush_interval)
+            self._changed.clear()
+            # an error must not stop the thread, otherwise no further changes would be
+            # journaled
+            try:
+                self.flush()
+                if self._n_entries >= self.compact_after:
+                    self.compact()
+            except Exception:
+                logger.exception("Error while writing parameter journal")
+
+    def flush(self) -> None:
+        """Append the pending changes to the journal."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        changes = {}
+        for name, value in pending.items():
+            attributes = {"value": value, "log": getattr(self.parameters, name).log}
+            try:
+                json.dumps(attributes)
+            except TypeError:
+                logger.warning(f"Can't record {name} in journal, value isn't JSON")
+                continue
+            changes[name] = attributes
+
+        line = json.dumps({"time": time(), "changes": changes}) + "\n"
+        with open(self.filename, "a") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._n_entries += 1
+
+    def compact(self) -> None:
+        """Write a snapshot of all parameters and truncate the journal."""
+        save_parameters(self.parameters, self.store_filename)
+        # changes that happened after the snapshot are still pending
+        with open(self.filename, "w") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self._n_entries = 0
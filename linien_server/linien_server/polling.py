@@ -0,0 +1,149 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import deque
+from time import perf_counter, sleep
+from typing import Callable, Optional
+
+# sampling rate of the FPGA
+FPGA_CLOCK_RATE = 125e6
+# number of samples recorded by the scope per acquisition
+SCOPE_BUFFER_LENGTH = 16384
+
+
+def sweep_speed_to_time(sweep_speed):
+    """
+    Sweep speed is an arbitrary unit (cf. `parameters.py`). This function converts it to
+    the duration of the sweep in seconds.
+    """
+    f_real = 3.8e3 / (2**sweep_speed)
+    duration = 1 / f_real
+    return duration
+
+
+def capture_time(decimation: int) -> float:
+    """Time the scope needs to fill its buffer with the given decimation."""
+    return SCOPE_BUFFER_LENGTH * decimation / FPGA_CLOCK_RATE
+
+
+class AdaptivePoller:
+    """
+    Determines how long to sleep between two polls of a register (e.g. the scope
+    trigger) that is expected to change once every `period` seconds.
+
+    After each frame, polling starts with an interval of `period / polls_per_period`
+    that grows by `backoff` after each unsuccessful poll until it reaches half of the
+    period (but at most `max_interval`). The interval never drops below what is
+    allowed by `cpu_budget`, i.e. the fraction of time that may be spent polling.
+    """
+
+    def __init__(
+        self,
+        period: float = 0.05,
+        cpu_budget: float = 0.1,
+        polls_per_period: int = 8,
+        backoff: float = 1.5,
+        min_interval: float = 1e-4,
+        max_interval: float = 0.5,
+        clock: Callable[[], float] = perf_counter,
+    ) -> None:
+        self.set_cpu_budget(cpu_budget)
+        self.polls_per_period = polls_per_period
+        self.backoff = backoff
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._clock = clock
+
+        # exponential moving average of the time a single poll takes
+        self.poll_cost = 0.0
+        self.period = period
+        self._interval = self._initial_interval()
+
+        self.n_polls = 0
+        self.n_frames = 0
+        self._polls_since_frame = 0
+        self._polls_per_frame: deque[int] = deque(maxlen=32)
+        self._frame_times: deque[float] = deque(maxlen=32)
+
+    def set_period(self, period: float) -> None:
+        """Set the expected time between two frames."""
+        if period != self.period:
+            self.period = period
+            self._interval = self._initial_interval()
+            # the frame rate with the old period is meaningless now
+            self._frame_times.clear()
+
+    def set_cpu_budget(self, cpu_budget: float) -> None:
+        if not cpu_budget > 0:
+            raise ValueError(f"CPU budget has to be positive, got {cpu_budget}")
+        self.cpu_budget = cpu_budget
+
+    def _floor(self) -> float:
+        return max(self.min_interval, self.poll_cost / self.cpu_budget)
+
+    def _cap(self) -> float:
+        return max(self._floor(), min(self.period / 2, self.max_interval))
+
+    def _initial_interval(self) -> float:
+        return min(max(self.period / self.polls_per_period, self._floor()), self._cap())
+
+    def poll(self, check: Callable[[], bool]) -> bool:
+        """Call `check` and keep track of how long this takes."""
+        start = self._clock()
+        result = check()
+        cost = self._clock() - start
+        self.poll_cost = cost if not self.n_polls else 0.9 * self.poll_cost + 0.1 * cost
+        self.n_polls += 1
+        self._polls_since_frame += 1
+        return result
+
+    def next_interval(self) -> float:
+        """Return the time to sleep before the next poll and back off."""
+        interval = min(max(self._interval, self._floor()), self._cap())
+        self._interval = interval * self.backoff
+        return interval
+
+    def wait(self) -> None:
+        sleep(self.next_interval())
+
+    def frame_received(self) -> None:
+        """Reset the backoff after the polled register changed."""
+        self._interval = self._initial_interval()
+        self.n_frames += 1
+        self._frame_times.append(self._clock())
+        self._polls_per_frame.append(self._polls_since_frame)
+        self._polls_since_frame = 0
+
+    def achieved_frame_rate(self) -> Optional[float]:
+        if len(self._frame_times) < 2:
+            return None
+        elapsed = self._frame_times[-1] - self._frame_times[0]
+        return (len(self._frame_times) - 1) / elapsed if elapsed > 0 else None
+
+    def get_stats(self) -> dict[str, Optional[float]]:
+        return {
+            "achieved_frame_rate": self.achieved_frame_rate(),
+            "theoretical_frame_rate": 1 / self.period,
+            "poll_interval": self._initial_interval(),
+            "poll_cost": self.poll_cost,
+            "cpu_budget": self.cpu_budget,
+            "polls_per_frame": (
+                sum(self._polls_per_frame) / len(self._polls_per_frame)
+                if self._polls_per_frame
+                else None
+            ),
+        }
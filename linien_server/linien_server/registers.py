@@ -15,16 +15,93 @@
 # You should have received a copy of the GNU General Public License
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Optional
+from contextlib import contextmanager
+from functools import partial
+from typing import Iterator, Optional, Sequence
 
 import numpy as np
 import rpyc
 from linien_common.common import FilterType, MHz, convert_channel_mixing_value
 from linien_common.config import ACQUISITION_PORT, DEFAULT_SWEEP_SPEED
+from linien_server.frame_buffer import FrameRingBuffer
 from linien_server.parameters import Parameters
 
 from . import csrmap
-from .iir_coeffs import make_filter
+from .iir_coeffs import make_filter_cached
+
+FPGA_BASE_FREQ = 125e6
+
+
+def _iir_dependencies(chain: str) -> tuple[str, ...]:
+    return (f"filter_automatic_{chain}", "modulation_frequency") + tuple(
+        f"filter_{iir_idx}_{kind}_{chain}"
+        for iir_idx in (1, 2)
+        for kind in ("enabled", "type", "frequency")
+    )
+
+
+_CHANNEL_POLARITIES = (
+    "polarity_fast_out1",
+    "polarity_fast_out2",
+    "polarity_analog_out0",
+)
+
+# Registers are written in groups. Each group lists the parameters that it depends on.
+# Setting one of these parameters marks the group as dirty such that only the registers
+# of dirty groups are recomputed and written by `Registers.write_registers`.
+REGISTER_GROUP_DEPENDENCIES: dict[str, tuple[str, ...]] = {
+    "static": (),
+    "sweep": ("sweep_pause", "sweep_amplitude", "sweep_speed", "sweep_center"),
+    "modulation": (
+        "modulation_frequency",
+        "modulation_amplitude",
+        "pid_only_mode",
+        "demodulation_phase_a",
+        "demodulation_phase_b",
+        "demodulation_multiplier_a",
+        "demodulation_multiplier_b",
+    ),
+    "channels": (
+        "dual_channel",
+        "channel_mixing",
+        "offset_a",
+        "offset_b",
+        "combined_offset",
+        "invert_a",
+        "invert_b",
+    ),
+    "outputs": (
+        "control_channel",
+        "mod_channel",
+        "sweep_channel",
+        "slow_control_channel",
+        "pid_on_slow_enabled",
+        "analog_out_1",
+        "analog_out_2",
+        "analog_out_3",
+    ),
+    "autolock": (
+        "autolock_target_position",
+        "autolock_mode",
+        "autolock_instructions",
+        "autolock_time_scale",
+        "autolock_final_wait_time",
+    ),
+    "gpio": ("gpio_p_out", "gpio_n_out"),
+    "scope": ("lock", "acquisition_raw_filter_enabled", "dual_channel"),
+    "raw_filter": ("acquisition_raw_filter_frequency",),
+    "iir_a": _iir_dependencies("a"),
+    "iir_b": _iir_dependencies("b"),
+    "pid": ("p", "i", "d", "target_slope_rising", "control_channel", "sweep_channel")
+    + _CHANNEL_POLARITIES,
+    "slow_pid": (
+        "pid_on_slow_strength",
+        "pid_on_slow_enabled",
+        "control_channel",
+        "slow_control_channel",
+    )
+    + _CHANNEL_POLARITIES,
+}
 
 
 class Registers:
@@ -40,6 +117,7 @@ class Registers:
         control,
         parameters: Parameters,
         host: Optional[str] = None,
+        board=None,
     ) -> None:
         self.control = control
         self.parameters = parameters
@@ -49,14 +127,41 @@ class Registers:
             # available on Windows
             from linien_server.acquisition import AcquisitionService
 
-            self.acquisition = AcquisitionService()
+            # `board` may replace the Red Pitaya, e.g. by a `SimulatedRedPitaya`
+            self.acquisition = AcquisitionService(board=board)
+            # acquired data is read directly from the acquisition's ring buffer
+            self.frame_buffer: Optional[FrameRingBuffer] = self.acquisition.frame_buffer
+            self.frame_source = self.acquisition
         else:
             # AcquisitionService has to be started manually on the Red Pitaya
             self.acquisition = rpyc.connect(host, ACQUISITION_PORT).root
+            # memory is not shared with a remote AcquisitionService, acquired data is
+            # transferred via `exposed_wait_for_frame` instead
+            self.frame_buffer = None
+            # rpyc serves the requests of a connection one after the other, so frames
+            # are waited for on a separate connection. Otherwise, register writes would
+            # be stuck behind a pending `exposed_wait_for_frame`.
+            self.frame_source = rpyc.connect(host, ACQUISITION_PORT).root
 
         self._last_sweep_speed = None
         self._last_raw_acquisition_settings = None
         self._iir_cache: dict[str, tuple[list[float], list[float]]] = {}
+        # writes are collected here while a batch is open (see `batch`)
+        self._pending_writes: Optional[list[tuple[str, int, bool]]] = None
+        self._pending_iir_writes: Optional[
+            list[tuple[str, tuple[float, ...], tuple[float, ...]]]
+        ] = None
+
+        # all register groups have to be written on the first call of `write_registers`
+        self._dirty_groups: set[str] = set(REGISTER_GROUP_DEPENDENCIES)
+        groups_by_parameter: dict[str, set[str]] = {}
+        for group, parameter_names in REGISTER_GROUP_DEPENDENCIES.items():
+            for name in parameter_names:
+                groups_by_parameter.setdefault(name, set()).add(group)
+        for name, groups in groups_by_parameter.items():
+            getattr(self.parameters, name).add_callback(
+                partial(self._mark_dirty, frozenset(groups))
+            )
 
         self.parameters.lock.add_callback(self.acquisition.exposed_set_lock_status)
         self.parameters.fetch_additional_signals.add_callback(
@@ -66,152 +171,66 @@ class Registers:
             self.acquisition.exposed_set_dual_channel, call_immediately=True
         )
 
+    def _mark_dirty(self, groups: frozenset[str], value) -> None:
+        self._dirty_groups.update(groups)
+
+    def mark_all_dirty(self) -> None:
+        """Make the next call of `write_registers` write all registers."""
+        self._dirty_groups.update(REGISTER_GROUP_DEPENDENCIES)
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Collect all writes issued within the context and send them to the acquisition
+        service in a single call when it is left. This saves a lot of round trips if
+        the acquisition service runs remotely.
+        """
+        if self._pending_writes is not None:
+            # already batching
+            yield
+            return
+
+        self._pending_writes, self._pending_iir_writes = [], []
+        try:
+            yield
+        finally:
+            writes, iir_writes = self._pending_writes, self._pending_iir_writes
+            self._pending_writes, self._pending_iir_writes = None, None
+            if writes or iir_writes:
+                # tuples of primitives are transferred by value by rpyc
+                self.acquisition.exposed_set_csr_batch(tuple(writes), tuple(iir_writes))
+
     def write_registers(self):
-        """Writes data from `parameters` to the FPGA."""
+        """
+        Writes data from `parameters` to the FPGA.
 
-        def max_(val):
-            return val if np.abs(val) <= 8191 else (8191 * val / np.abs(val))
+        Only the register groups that depend on parameters that were set since the last
+        call are recomputed and written (see `REGISTER_GROUP_DEPENDENCIES`). All writes
+        are sent to the acquisition service as a single batch.
+        """
+        with self.batch():
+            self._write_registers()
 
-        def phase_to_delay(phase):
-            return int(phase / 360 * (1 << 14))
-
-        if not self.parameters.dual_channel.value:
-            factor_a = 256
-            factor_b = 0
-        else:
-            factor_a, factor_b = convert_channel_mixing_value(
-                self.parameters.channel_mixing.value
-            )
+    def _write_registers(self) -> None:
+        # parameters that are set while writing mark the new set as dirty
+        dirty, self._dirty_groups = self._dirty_groups, set()
 
         lock_changed = self.parameters.lock.value != self.control.exposed_is_locked
         self.control.exposed_is_locked = self.parameters.lock.value
 
-        new = dict(
-            # sweep run is 1 by default. The gateware automatically takes care of
-            # stopping the sweep run after `request_lock` is set by setting
-            # `sweep.clear`
-            logic_sweep_run=1,
-            logic_sweep_pause=int(self.parameters.sweep_pause.value),
-            logic_sweep_step=int(
-                DEFAULT_SWEEP_SPEED
-                * self.parameters.sweep_amplitude.value
-                / (2**self.parameters.sweep_speed.value)
-            ),
-            # NOTE: Sweep center is set by `logic_out_offset`.
-            logic_sweep_min=-1 * max_(self.parameters.sweep_amplitude.value * 8191),
-            logic_sweep_max=max_(self.parameters.sweep_amplitude.value * 8191),
-            logic_mod_freq=(
-                self.parameters.modulation_frequency.value
-                if not self.parameters.pid_only_mode.value
-                else 0
-            ),
-            logic_mod_amp=(
-                self.parameters.modulation_amplitude.value
-                if (self.parameters.modulation_frequency.value > 0)
-                and (not self.parameters.pid_only_mode.value)
-                else 0
-            ),
-            logic_dual_channel=int(self.parameters.dual_channel.value),
-            logic_pid_only_mode=int(self.parameters.pid_only_mode.value),
-            logic_chain_a_factor=factor_a,
-            logic_chain_b_factor=factor_b,
-            logic_chain_a_offset=twos_complement(
-                int(self.parameters.offset_a.value), 14
-            ),
-            logic_chain_b_offset=twos_complement(
-                int(self.parameters.offset_b.value), 14
-            ),
-            logic_out_offset=int(self.parameters.sweep_center.value * 8191),
-            logic_combined_offset=twos_complement(
-                self.parameters.combined_offset.value, 14
-            ),
-            logic_control_channel=self.parameters.control_channel.value,
-            logic_mod_channel=self.parameters.mod_channel.value,
-            logic_sweep_channel=self.parameters.sweep_channel.value,
-            logic_slow_control_channel=self.parameters.slow_control_channel.value,
-            slow_chain_pid_reset=not self.parameters.pid_on_slow_enabled.value,
-            logic_analog_out_1=self.parameters.analog_out_1.value,
-            logic_analog_out_2=self.parameters.analog_out_2.value,
-            logic_analog_out_3=self.parameters.analog_out_3.value,
-            logic_autolock_fast_target_position=self.parameters.autolock_target_position.value,  # noqa: E501
-            logic_autolock_autolock_mode=self.parameters.autolock_mode.value,
-            logic_autolock_robust_N_instructions=len(
-                self.parameters.autolock_instructions.value
-            ),
-            logic_autolock_robust_time_scale=self.parameters.autolock_time_scale.value,
-            logic_autolock_robust_final_wait_time=self.parameters.autolock_final_wait_time.value,  # noqa: E501
-            # channel A
-            fast_a_demod_delay=(
-                phase_to_delay(self.parameters.demodulation_phase_a.value)
-                if (self.parameters.modulation_frequency.value > 0)
-                and (not self.parameters.pid_only_mode.value)
-                else 0
-            ),
-            fast_a_demod_multiplier=self.parameters.demodulation_multiplier_a.value,
-            fast_a_dx_sel=csrmap.signals.index("zero"),
-            fast_a_y_tap=2,
-            fast_a_dy_sel=csrmap.signals.index("zero"),
-            fast_a_invert=int(self.parameters.invert_a.value),
-            # channel B
-            fast_b_demod_delay=(
-                phase_to_delay(self.parameters.demodulation_phase_b.value)
-                if (self.parameters.modulation_frequency.value > 0)
-                and (not self.parameters.pid_only_mode.value)
-                else 0
-            ),
-            fast_b_demod_multiplier=self.parameters.demodulation_multiplier_b.value,
-            fast_b_dx_sel=csrmap.signals.index("zero"),
-            fast_b_y_tap=1,
-            fast_b_dy_sel=csrmap.signals.index("zero"),
-            fast_b_invert=int(self.parameters.invert_b.value),
-            # trigger on sweep
-            scopegen_external_trigger=1,
-            gpio_p_oes=0b11111111,
-            gpio_n_oes=0b11111111,
-            gpio_p_outs=self.parameters.gpio_p_out.value,
-            gpio_n_outs=self.parameters.gpio_n_out.value,
-            gpio_n_do0_en=csrmap.signals.index("zero"),
-            gpio_n_do1_en=csrmap.signals.index("zero"),
-            logic_slow_decimation=16,
-        )
-
-        for instruction_idx, [wait_for, peak_height] in enumerate(
-            self.parameters.autolock_instructions.value
+        new = {}
+        for group, get_registers in (
+            ("static", self._static_registers),
+            ("sweep", self._sweep_registers),
+            ("modulation", self._modulation_registers),
+            ("channels", self._channel_registers),
+            ("outputs", self._output_registers),
+            ("autolock", self._autolock_registers),
+            ("gpio", self._gpio_registers),
+            ("scope", self._scope_registers),
         ):
-            new[f"logic_autolock_robust_peak_height_{instruction_idx}"] = peak_height
-            new[f"logic_autolock_robust_wait_for_{instruction_idx}"] = wait_for
-
-        if self.parameters.lock.value:
-            # display combined error signal and control signal
-            new.update(
-                {
-                    "scopegen_adc_a_sel": csrmap.signals.index(
-                        "logic_combined_error_signal"
-                        if not self.parameters.acquisition_raw_filter_enabled.value
-                        else "logic_combined_error_signal_filtered"
-                    ),
-                    "scopegen_adc_a_q_sel": csrmap.signals.index("fast_b_x"),
-                    "scopegen_adc_b_sel": csrmap.signals.index("logic_control_signal"),
-                    "scopegen_adc_b_q_sel": csrmap.signals.index("zero"),
-                }
-            )
-        else:
-            # display both demodulated error signals (if dual channel mode) OR: display
-            # demodulated error signal 1 + monitor signal
-            new.update(
-                {
-                    "scopegen_adc_a_sel": csrmap.signals.index("fast_a_out_i"),
-                    "scopegen_adc_a_q_sel": csrmap.signals.index("fast_a_out_q"),
-                    "scopegen_adc_b_sel": csrmap.signals.index(
-                        "fast_b_out_i"
-                        if self.parameters.dual_channel.value
-                        else "fast_b_x"
-                    ),
-                    "scopegen_adc_b_q_sel": csrmap.signals.index(
-                        "fast_b_out_q" if self.parameters.dual_channel.value else "zero"
-                    ),
-                }
-            )
+            if group in dirty:
+                new.update(get_registers())
 
         # filter out values that did not change
         new = dict(
@@ -238,17 +257,16 @@ class Registers:
             self._last_raw_acquisition_settings = raw_acquisition_settings
             self.acquisition.exposed_set_raw_acquisition(*raw_acquisition_settings)
 
-        fpga_base_freq = 125e6
-
-        self.set_iir(
-            "logic_raw_acquisition_iir",
-            *make_filter(
-                "LP",
-                f=self.parameters.acquisition_raw_filter_frequency.value
-                / fpga_base_freq,
-                k=1,
-            ),
-        )
+        if "raw_filter" in dirty:
+            self.set_iir(
+                "logic_raw_acquisition_iir",
+                *make_filter_cached(
+                    "LP",
+                    f=self.parameters.acquisition_raw_filter_frequency.value
+                    / FPGA_BASE_FREQ,
+                    k=1,
+                ),
+            )
 
         for k, v in new.items():
             self.set(k, int(v))
@@ -257,8 +275,12 @@ class Registers:
             # reset sweep for a short time if the scan range was changed this is needed
             # because otherwise it may take too long before the new scan range is
             # reached --> no scope trigger is sent
-            self.set("logic_sweep_run", 0)
-            self.set("logic_sweep_run", 1)
+            self.set("logic_sweep_run", 0, force=True)
+            self.set("logic_sweep_run", 1, force=True)
+
+        for chain in ("a", "b"):
+            if f"iir_{chain}" in dirty:
+                self._write_iir_filters(chain)
 
         kp = self.parameters.p.value
         ki = self.parameters.i.value
@@ -293,63 +315,6 @@ class Registers:
             else -1
         )
 
-        for chain in ("a", "b"):
-            automatic = getattr(self.parameters, f"filter_automatic_{chain}").value
-            # iir_idx means iir_c or iir_d
-            for iir_idx in range(2):
-                # iir_sub_idx means in-phase signal or quadrature signal
-                for iir_sub_idx in range(2):
-                    iir_name = (
-                        f"fast_{chain}_iir_{('c', 'd')[iir_idx]}_{iir_sub_idx + 1}"
-                    )
-
-                    if automatic:
-                        filter_enabled = True
-                        filter_type = FilterType.LOW_PASS
-                        filter_frequency = (
-                            self.parameters.modulation_frequency.value / MHz * 1e6 / 2
-                        )
-
-                        # if the filter frequency is too low (< 10Hz), the IIR doesn't
-                        # work properly anymore. In that case, don't filter. This is
-                        # also helpful if the raw (not demodulated) signal should be
-                        # displayed which can be achieved by setting modulation
-                        # frequency to 0.
-                        if filter_frequency < 10:
-                            filter_enabled = False
-                    else:
-                        filter_enabled = getattr(
-                            self.parameters, f"filter_{iir_idx + 1}_enabled_{chain}"
-                        ).value
-                        filter_type = getattr(
-                            self.parameters, f"filter_{iir_idx + 1}_type_{chain}"
-                        ).value
-                        filter_frequency = getattr(
-                            self.parameters, f"filter_{iir_idx + 1}_frequency_{chain}"
-                        ).value
-
-                    if not filter_enabled:
-                        self.set_iir(iir_name, *make_filter("P", k=1))
-                    else:
-                        if filter_type == FilterType.LOW_PASS:
-                            self.set_iir(
-                                iir_name,
-                                *make_filter(
-                                    "LP", f=filter_frequency / fpga_base_freq, k=1
-                                ),
-                            )
-                        elif filter_type == FilterType.HIGH_PASS:
-                            self.set_iir(
-                                iir_name,
-                                *make_filter(
-                                    "HP", f=filter_frequency / fpga_base_freq, k=1
-                                ),
-                            )
-                        else:
-                            raise Exception(
-                                f"Unknown filter {filter_type} for {iir_name}"
-                            )
-
         if lock_changed:
             if self.parameters.lock.value:
                 # set PI parameters
@@ -361,8 +326,222 @@ class Registers:
         else:
             if self.parameters.lock.value:
                 # set new PI parameters
-                self.set_pid(kp, ki, kd, slope)
-                self.set_slow_pid(slow_strength, slow_slope)
+                if "pid" in dirty:
+                    self.set_pid(kp, ki, kd, slope)
+                if "slow_pid" in dirty:
+                    self.set_slow_pid(slow_strength, slow_slope)
+
+    def _static_registers(self) -> dict[str, int]:
+        return dict(
+            # sweep run is 1 by default. The gateware automatically takes care of
+            # stopping the sweep run after `request_lock` is set by setting
+            # `sweep.clear`
+            logic_sweep_run=1,
+            fast_a_dx_sel=csrmap.signals.index("zero"),
+            fast_a_y_tap=2,
+            fast_a_dy_sel=csrmap.signals.index("zero"),
+            fast_b_dx_sel=csrmap.signals.index("zero"),
+            fast_b_y_tap=1,
+            fast_b_dy_sel=csrmap.signals.index("zero"),
+            # trigger on sweep
+            scopegen_external_trigger=1,
+            gpio_p_oes=0b11111111,
+            gpio_n_oes=0b11111111,
+            gpio_n_do0_en=csrmap.signals.index("zero"),
+            gpio_n_do1_en=csrmap.signals.index("zero"),
+            logic_slow_decimation=16,
+        )
+
+    def _sweep_registers(self) -> dict[str, int]:
+        def max_(val):
+            return val if np.abs(val) <= 8191 else (8191 * val / np.abs(val))
+
+        return dict(
+            logic_sweep_pause=int(self.parameters.sweep_pause.value),
+            logic_sweep_step=int(
+                DEFAULT_SWEEP_SPEED
+                * self.parameters.sweep_amplitude.value
+                / (2**self.parameters.sweep_speed.value)
+            ),
+            # NOTE: Sweep center is set by `logic_out_offset`.
+            logic_sweep_min=-1 * max_(self.parameters.sweep_amplitude.value * 8191),
+            logic_sweep_max=max_(self.parameters.sweep_amplitude.value * 8191),
+            logic_out_offset=int(self.parameters.sweep_center.value * 8191),
+        )
+
+    def _modulation_registers(self) -> dict[str, int]:
+        def phase_to_delay(phase):
+            return int(phase / 360 * (1 << 14))
+
+        modulation_enabled = (self.parameters.modulation_frequency.value > 0) and (
+            not self.parameters.pid_only_mode.value
+        )
+        return dict(
+            logic_mod_freq=(
+                self.parameters.modulation_frequency.value
+                if not self.parameters.pid_only_mode.value
+                else 0
+            ),
+            logic_mod_amp=(
+                self.parameters.modulation_amplitude.value if modulation_enabled else 0
+            ),
+            logic_pid_only_mode=int(self.parameters.pid_only_mode.value),
+            fast_a_demod_delay=(
+                phase_to_delay(self.parameters.demodulation_phase_a.value)
+                if modulation_enabled
+                else 0
+            ),
+            fast_a_demod_multiplier=self.parameters.demodulation_multiplier_a.value,
+            fast_b_demod_delay=(
+                phase_to_delay(self.parameters.demodulation_phase_b.value)
+                if modulation_enabled
+                else 0
+            ),
+            fast_b_demod_multiplier=self.parameters.demodulation_multiplier_b.value,
+        )
+
+    def _channel_registers(self) -> dict[str, int]:
+        if not self.parameters.dual_channel.value:
+            factor_a = 256
+            factor_b = 0
+        else:
+            factor_a, factor_b = convert_channel_mixing_value(
+                self.parameters.channel_mixing.value
+            )
+
+        return dict(
+            logic_dual_channel=int(self.parameters.dual_channel.value),
+            logic_chain_a_factor=factor_a,
+            logic_chain_b_factor=factor_b,
+            logic_chain_a_offset=twos_complement(
+                int(self.parameters.offset_a.value), 14
+            ),
+            logic_chain_b_offset=twos_complement(
+                int(self.parameters.offset_b.value), 14
+            ),
+            logic_combined_offset=twos_complement(
+                self.parameters.combined_offset.value, 14
+            ),
+            fast_a_invert=int(self.parameters.invert_a.value),
+            fast_b_invert=int(self.parameters.invert_b.value),
+        )
+
+    def _output_registers(self) -> dict[str, int]:
+        return dict(
+            logic_control_channel=self.parameters.control_channel.value,
+            logic_mod_channel=self.parameters.mod_channel.value,
+            logic_sweep_channel=self.parameters.sweep_channel.value,
+            logic_slow_control_channel=self.parameters.slow_control_channel.value,
+            slow_chain_pid_reset=not self.parameters.pid_on_slow_enabled.value,
+            logic_analog_out_1=self.parameters.analog_out_1.value,
+            logic_analog_out_2=self.parameters.analog_out_2.value,
+            logic_analog_out_3=self.parameters.analog_out_3.value,
+        )
+
+    def _autolock_registers(self) -> dict[str, int]:
+        registers = dict(
+            logic_autolock_fast_target_position=self.parameters.autolock_target_position.value,  # noqa: E501
+            logic_autolock_autolock_mode=self.parameters.autolock_mode.value,
+            logic_autolock_robust_N_instructions=len(
+                self.parameters.autolock_instructions.value
+            ),
+            logic_autolock_robust_time_scale=self.parameters.autolock_time_scale.value,
+            logic_autolock_robust_final_wait_time=self.parameters.autolock_final_wait_time.value,  # noqa: E501
+        )
+        for instruction_idx, [wait_for, peak_height] in enumerate(
+            self.parameters.autolock_instructions.value
+        ):
+            registers[f"logic_autolock_robust_peak_height_{instruction_idx}"] = (
+                peak_height
+            )
+            registers[f"logic_autolock_robust_wait_for_{instruction_idx}"] = wait_for
+        return registers
+
+    def _gpio_registers(self) -> dict[str, int]:
+        return dict(
+            gpio_p_outs=self.parameters.gpio_p_out.value,
+            gpio_n_outs=self.parameters.gpio_n_out.value,
+        )
+
+    def _scope_registers(self) -> dict[str, int]:
+        if self.parameters.lock.value:
+            # display combined error signal and control signal
+            return {
+                "scopegen_adc_a_sel": csrmap.signals.index(
+                    "logic_combined_error_signal"
+                    if not self.parameters.acquisition_raw_filter_enabled.value
+                    else "logic_combined_error_signal_filtered"
+                ),
+                "scopegen_adc_a_q_sel": csrmap.signals.index("fast_b_x"),
+                "scopegen_adc_b_sel": csrmap.signals.index("logic_control_signal"),
+                "scopegen_adc_b_q_sel": csrmap.signals.index("zero"),
+            }
+        else:
+            # display both demodulated error signals (if dual channel mode) OR: display
+            # demodulated error signal 1 + monitor signal
+            return {
+                "scopegen_adc_a_sel": csrmap.signals.index("fast_a_out_i"),
+                "scopegen_adc_a_q_sel": csrmap.signals.index("fast_a_out_q"),
+                "scopegen_adc_b_sel": csrmap.signals.index(
+                    "fast_b_out_i" if self.parameters.dual_channel.value else "fast_b_x"
+                ),
+                "scopegen_adc_b_q_sel": csrmap.signals.index(
+                    "fast_b_out_q" if self.parameters.dual_channel.value else "zero"
+                ),
+            }
+
+    def _write_iir_filters(self, chain: str) -> None:
+        automatic = getattr(self.parameters, f"filter_automatic_{chain}").value
+        # iir_idx means iir_c or iir_d
+        for iir_idx in range(2):
+            # iir_sub_idx means in-phase signal or quadrature signal
+            for iir_sub_idx in range(2):
+                iir_name = f"fast_{chain}_iir_{('c', 'd')[iir_idx]}_{iir_sub_idx + 1}"
+
+                if automatic:
+                    filter_enabled = True
+                    filter_type = FilterType.LOW_PASS
+                    filter_frequency = (
+                        self.parameters.modulation_frequency.value / MHz * 1e6 / 2
+                    )
+
+                    # if the filter frequency is too low (< 10Hz), the IIR doesn't
+                    # work properly anymore. In that case, don't filter. This is
+                    # also helpful if the raw (not demodulated) signal should be
+                    # displayed which can be achieved by setting modulation
+                    # frequency to 0.
+                    if filter_frequency < 10:
+                        filter_enabled = False
+                else:
+                    filter_enabled = getattr(
+                        self.parameters, f"filter_{iir_idx + 1}_enabled_{chain}"
+                    ).value
+                    filter_type = getattr(
+                        self.parameters, f"filter_{iir_idx + 1}_type_{chain}"
+                    ).value
+                    filter_frequency = getattr(
+                        self.parameters, f"filter_{iir_idx + 1}_frequency_{chain}"
+                    ).value
+
+                if not filter_enabled:
+                    self.set_iir(iir_name, *make_filter_cached("P", k=1))
+                else:
+                    if filter_type == FilterType.LOW_PASS:
+                        self.set_iir(
+                            iir_name,
+                            *make_filter_cached(
+                                "LP", f=filter_frequency / FPGA_BASE_FREQ, k=1
+                            ),
+                        )
+                    elif filter_type == FilterType.HIGH_PASS:
+                        self.set_iir(
+                            iir_name,
+                            *make_filter_cached(
+                                "HP", f=filter_frequency / FPGA_BASE_FREQ, k=1
+                            ),
+                        )
+                    else:
+                        raise Exception(f"Unknown filter {filter_type} for {iir_name}")
 
     def set_pid(self, p, i, d, slope, reset=None, request_lock=None):
         if request_lock is not None:
@@ -383,14 +562,22 @@ class Registers:
         if reset is not None:
             self.set("slow_chain_pid_reset", reset)
 
-    def set(self, key, value):
-        self.acquisition.exposed_set_csr(key, value)
+    def set(self, key, value, force=False):
+        if self._pending_writes is not None:
+            self._pending_writes.append((key, int(value), force))
+        else:
+            self.acquisition.exposed_set_csr(key, value, force)
 
-    def set_iir(self, iir_name: str, b: list[float], a: list[float]) -> None:
+    def set_iir(self, iir_name: str, b: Sequence[float], a: Sequence[float]) -> None:
         if self._iir_cache.get(iir_name) != (b, a):
             # as setting iir parameters takes some time, take care that we don't  do it
             # too often
-            self.acquisition.exposed_set_iir_csr(iir_name, b, a)
+            if self._pending_iir_writes is not None:
+                self._pending_iir_writes.append(
+                    (iir_name, tuple(map(float, b)), tuple(map(float, a)))
+                )
+            else:
+                self.acquisition.exposed_set_iir_csr(iir_name, b, a)
             self._iir_cache[iir_name] = (b, a)
 
 
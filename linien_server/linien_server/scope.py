@@ -0,0 +1,75 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Sequence
+
+import numpy as np
+
+# last address of the scope buffer that is read before wrapping around
+MAX_DATA_LENGTH = 16383
+
+# memory blocks of the scope that hold the signals selected by `scopegen_adc_a_sel` /
+# `scopegen_adc_b_sel` and `scopegen_adc_a_q_sel` / `scopegen_adc_b_q_sel`
+CHANNEL_OFFSETS = (0x10000, 0x20000)
+
+
+def read_scope_channels(
+    scope,
+    offsets: Sequence[int],
+    addr: int,
+    data_length: int,
+    out: np.ndarray,
+) -> np.ndarray:
+    """
+    Read `data_length` samples starting at `addr` from the scope memory blocks given by
+    `offsets` and store them in the preallocated int16 array `out`.
+
+    Each memory block contains two signals, i.e. rows `2 * i` and `2 * i + 1` of `out`
+    are filled with the signals of `offsets[i]`. If the requested range wraps around
+    the end of the scope buffer, it is read in two contiguous chunks that are written
+    next to each other in `out`. Apart from the views returned by `scope.reads`, no
+    memory is allocated.
+    """
+    first_length = max(min(data_length, MAX_DATA_LENGTH - addr), 0)
+    chunks = [(addr, 0, first_length)]
+    if first_length < data_length:
+        chunks.append((0, first_length, data_length - first_length))
+
+    for channel_idx, offset in enumerate(offsets):
+        signal_a = out[2 * channel_idx]
+        signal_b = out[2 * channel_idx + 1]
+        for start, out_start, length in chunks:
+            if length == 0:
+                continue
+            # raw data is an array of 32-bit ints that contains two signals:
+            #   2'h0,adc_b_rd,2'h0,adc_a_rd
+            #   i.e.: 2 zero bits, channel b (14 bit), 2 zero bits, channel a (14 bit)
+            raw_data = scope.reads(offset + (4 * start), length).view(np.int16)
+            out_slice = slice(out_start, out_start + length)
+            _sign_extend(raw_data[0::2], signal_a[out_slice])
+            _sign_extend(raw_data[1::2], signal_b[out_slice])
+
+    return out
+
+
+def _sign_extend(data: np.ndarray, out: np.ndarray) -> None:
+    """
+    The sign bit of the 14 bit samples is at position 13. Shifting it to the position
+    of the sign bit of int16 and back (arithmetic shift) yields the signed value.
+    """
+    np.left_shift(data, 2, out=out)
+    np.right_shift(out, 2, out=out)
@@ -20,15 +20,14 @@ import atexit
 import logging
 import pickle
 from copy import copy
-from random import randint, random
+from random import random
 from socket import socket
 from threading import Event, Thread
-from time import sleep
+from time import perf_counter, sleep
 from typing import Any, Callable
 
-import numpy as np
 import rpyc
-from linien_common.common import N_POINTS, check_plot_data, update_signal_history
+from linien_common.common import check_plot_data, update_signal_history
 from linien_common.communication import (
     LinienControlService,
     ParameterValues,
@@ -39,11 +38,22 @@ from linien_common.config import SERVER_PORT
 from linien_common.influxdb import InfluxDBCredentials, restore_credentials
 from linien_server import __version__
 from linien_server.autolock.autolock import Autolock
+from linien_server.frame_buffer import Frame, serialize_frame
 from linien_server.influxdb import InfluxDBLogger
+from linien_server.metrics import PipelineMetrics
 from linien_server.noise_analysis import PIDOptimization, PSDAcquisition
 from linien_server.optimization.optimization import OptimizeSpectroscopy
-from linien_server.parameters import Parameters, restore_parameters, save_parameters
+from linien_server.parameters import (
+    PARAMETER_STORE_FILENAME,
+    ParameterJournal,
+    Parameters,
+    restore_parameters,
+)
 from linien_server.registers import Registers
+from linien_server.signal_stats import compute_signal_stats
+from linien_server.simulation import SyntheticPlotData, load_spectra
+from linien_server.subscriptions import ParameterChangePusher, PlotSubscription
+from linien_server.wire_format import WIRE_FORMAT_PICKLE, negotiate_wire_format
 from rpyc.core.protocol import Connection
 from rpyc.utils.server import ThreadedServer
 
@@ -57,11 +67,20 @@ class BaseService(rpyc.Service):
     on the client.
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self, parameter_store_filename: str = PARAMETER_STORE_FILENAME
+    ) -> None:
         self.parameters = Parameters()
-        self.parameters = restore_parameters(self.parameters)
-        atexit.register(save_parameters, self.parameters)
+        self.parameters = restore_parameters(self.parameters, parameter_store_filename)
+        # record changes continuously, a snapshot is written when the server exits
+        self.parameter_journal = ParameterJournal(
+            self.parameters, parameter_store_filename
+        )
+        self.parameter_journal.start()
+        atexit.register(self.parameter_journal.stop)
         self._uuid_mapping: dict[Connection, str] = {}
+        self._parameter_change_pushers: dict[str, ParameterChangePusher] = {}
+        self._plot_subscriptions: dict[str, PlotSubscription] = {}
 
         influxdb_credentials = restore_credentials()
         self.influxdb_logger = InfluxDBLogger(influxdb_credentials, self.parameters)
@@ -76,22 +95,70 @@ class BaseService(rpyc.Service):
 
     def on_disconnect(self, conn: Connection) -> None:
         uuid = self._uuid_mapping[conn]
+        self.exposed_unsubscribe_parameter_changes(uuid)
+        self.exposed_unsubscribe_to_plot(uuid)
         self.parameters.unregister_remote_listeners(uuid)
 
     def exposed_get_server_version(self) -> str:
         return __version__
 
-    def exposed_get_param(self, param_name: str) -> bytes | ParameterValues:
-        return pack(getattr(self.parameters, param_name).value)
+    def exposed_get_param(
+        self, param_name: str, wire_format: str = WIRE_FORMAT_PICKLE
+    ) -> bytes | ParameterValues:
+        return pack(
+            serialize_frame(getattr(self.parameters, param_name).value, wire_format)
+        )
 
     def exposed_set_param(
         self, param_name: str, value: bytes | ParameterValues
     ) -> None:
         getattr(self.parameters, param_name).value = unpack(value)
 
+    def exposed_set_params(
+        self,
+        values: bytes | dict[str, ParameterValues],
+        write_registers: bool = True,
+        pause_acquisition: bool = True,
+    ) -> None:
+        """
+        Set several parameters in a single call, e.g. when loading a profile. `values`
+        maps parameter names to values and should be pickled as a whole (values are not
+        pickled individually as for `exposed_set_param`).
+
+        All names and values are checked before any parameter is changed. Clients are
+        notified once about all changes. If `write_registers` is set, the registers are
+        written once afterwards, while the acquisition is paused if `pause_acquisition`
+        is set.
+        """
+        # copy such that a dict sent by reference is fetched in one go
+        values = dict(unpack(values))
+        if pause_acquisition:
+            self.exposed_pause_acquisition()
+        try:
+            self.parameters.set_values(values)
+            if write_registers:
+                self.exposed_write_registers()
+        finally:
+            if pause_acquisition:
+                self.exposed_continue_acquisition()
+
     def exposed_reset_param(self, param_name: str) -> None:
         getattr(self.parameters, param_name).reset()
 
+    def exposed_negotiate_wire_format(
+        self, uuid: str, client_formats: list[str]
+    ) -> str:
+        """
+        Choose the format in which frames (`to_plot`, `acquisition_raw_data`) are sent
+        to the client, cf. `linien_server.wire_format`. `client_formats` are the
+        formats supported by the client in order of preference. Returns the chosen
+        format, pickle if none of them is known to the server. Clients should call this
+        before `exposed_init_parameter_sync`.
+        """
+        wire_format = negotiate_wire_format(tuple(client_formats))
+        self.parameters.set_wire_format(uuid, wire_format)
+        return wire_format
+
     def exposed_init_parameter_sync(
         self, uuid: str
     ) -> list[tuple[str, Any, bool, bool, bool, bool]]:
@@ -109,6 +176,66 @@ class BaseService(rpyc.Service):
     def exposed_get_changed_parameters_queue(self, uuid: str) -> list[tuple[str, Any]]:
         return self.parameters.get_changed_parameters_queue(uuid)
 
+    def exposed_get_dropped_parameter_changes(self, uuid: str) -> int:
+        return self.parameters.get_dropped_parameter_changes(uuid)
+
+    def exposed_subscribe_parameter_changes(
+        self,
+        uuid: str,
+        callback: Callable[[bytes], None],
+        coalesce_interval: float = 0.02,
+    ) -> None:
+        """
+        Push parameter changes to `callback` instead of requiring the client to poll
+        `exposed_get_changed_parameters_queue`. Changes are collected for
+        `coalesce_interval` seconds and sent in the format of that method, pickled. See
+        `ParameterChangePusher` for details.
+        """
+        self.exposed_unsubscribe_parameter_changes(uuid)
+        pusher = ParameterChangePusher(
+            self.parameters, uuid, callback, coalesce_interval
+        )
+        self._parameter_change_pushers[uuid] = pusher
+        pusher.start()
+
+    def exposed_unsubscribe_parameter_changes(self, uuid: str) -> None:
+        pusher = self._parameter_change_pushers.pop(uuid, None)
+        if pusher is not None:
+            pusher.stop()
+
+    def exposed_subscribe_to_plot(
+        self,
+        uuid: str,
+        callback: Callable[[bytes], None],
+        max_rate: float | None = None,
+        n_points: int | None = None,
+        signals: list[str] | None = None,
+    ) -> None:
+        """
+        Send `to_plot` to `callback` (in the negotiated wire format) at most
+        `max_rate` times per second, reduced to a min/max envelope of `n_points` points
+        and restricted to the given `signals`. This is meant for passive monitors that
+        do not need every full-resolution frame.
+        """
+        self.exposed_unsubscribe_to_plot(uuid)
+        subscription = PlotSubscription(
+            callback,
+            max_rate=max_rate,
+            n_points=n_points,
+            # copy such that the names are not fetched from the client for every frame
+            signals=tuple(signals) if signals is not None else None,
+            wire_format=self.parameters.get_wire_format(uuid),
+        )
+        self._plot_subscriptions[uuid] = subscription
+        subscription.start()
+        self.parameters.to_plot.add_callback(subscription.offer)
+
+    def exposed_unsubscribe_to_plot(self, uuid: str) -> None:
+        subscription = self._plot_subscriptions.pop(uuid, None)
+        if subscription is not None:
+            self.parameters.to_plot.remove_callback(subscription.offer)
+            subscription.stop()
+
     def exposed_set_parameter_log(self, param_name: str, value: bool) -> None:
         if getattr(self.parameters, param_name).log != value:
             logger.debug(f"Setting log for {param_name} to {value}")
@@ -150,13 +277,26 @@ class BaseService(rpyc.Service):
 class RedPitayaControlService(BaseService, LinienControlService):
     """Control server that runs on the RP that provides high-level methods."""
 
-    def __init__(self, host=None):
+    def __init__(
+        self,
+        host=None,
+        board=None,
+        parameter_store_filename: str = PARAMETER_STORE_FILENAME,
+    ):
         self._cached_data = {}
         self.exposed_is_locked = None
+        self.metrics = PipelineMetrics()
 
-        super(RedPitayaControlService, self).__init__()
+        super(RedPitayaControlService, self).__init__(parameter_store_filename)
+        # run autolock, optimization and noise analysis on worker threads such that
+        # they do not stall the data pusher. A frame that waits for a busy task must
+        # not reach it if the task changed the settings in the meantime.
+        self.parameters.task_executor.background = True
+        self.parameters.task_executor.is_stale = self._is_stale_frame
 
-        self.registers = Registers(control=self, parameters=self.parameters, host=host)
+        self.registers = Registers(
+            control=self, parameters=self.parameters, host=host, board=board
+        )
         # Connect the acquisition loop to the parameters: Every received value is pushed
         # to `parameters.to_plot`.
         self.exposed_pause_acquisition()
@@ -191,59 +331,121 @@ class RedPitayaControlService(BaseService, LinienControlService):
             sleep(1)
 
     def _push_acquired_data_to_parameters(self, stop_event: Event):
-        last_hash = None
+        last_sequence = None
         while not stop_event.is_set():
-            (
-                new_data_returned,
-                new_hash,
-                data_was_raw,
-                new_data,
-                data_uuid,
-            ) = self.registers.acquisition.exposed_return_data(last_hash)
-            if new_data_returned:
-                last_hash = new_hash
+            # blocks until the acquisition publishes a new frame, the timeout only
+            # ensures that `stop_event` is checked regularly
+            frame = self._wait_for_new_data(last_sequence, timeout=0.5)
+            if frame is None:
+                continue
+
+            if last_sequence is not None and frame.sequence > last_sequence + 1:
+                # frames that were published while we were busy with older ones
+                self.metrics.count("dropped", frame.sequence - last_sequence - 1)
+            last_sequence = frame.sequence
+
             # When a parameter is changed, `pause_acquisition` is set. This means that
             # the we should skip new data until we are sure that it was recorded with
             # the new settings.
-            if not self.parameters.pause_acquisition.value:
-                if data_uuid != self.data_uuid:
+            if self.parameters.pause_acquisition.value:
+                self.metrics.count("skipped_paused")
+                continue
+            if frame.uuid != self.data_uuid:
+                self.metrics.count("skipped_uuid_mismatch")
+                continue
+
+            callbacks_start = perf_counter()
+            if not frame.raw:
+                is_locked = self.parameters.lock.value
+                data_loaded = frame.as_plot_data()
+
+                if not check_plot_data(is_locked, data_loaded):
+                    logger.error("incorrect data received for lock state, ignoring!")
+                    self.metrics.count("skipped_incorrect_data")
                     continue
 
-                data_loaded = pickle.loads(new_data)
+                # generate signal stats
+                stats_selection = self.parameters.signal_stats_selection.value
+                if stats_selection:
+                    stats = compute_signal_stats(data_loaded, stats_selection)
+                    callbacks_start = self.metrics.record_since(
+                        "stats", callbacks_start
+                    )
 
-                if not data_was_raw:
-                    is_locked = self.parameters.lock.value
+                # update signal history (if in locked state)
+                (
+                    self.parameters.control_signal_history.value,
+                    self.parameters.monitor_signal_history.value,
+                ) = update_signal_history(
+                    self.parameters.control_signal_history.value,
+                    self.parameters.monitor_signal_history.value,
+                    data_loaded,
+                    is_locked,
+                    self.parameters.control_signal_history_length.value,
+                )
+                if stats_selection:
+                    self.parameters.signal_stats.value = stats
+                # server-side listeners receive the frame itself, it is only pickled
+                # if it is sent to a client
+                self.parameters.to_plot.value = frame
+            else:
+                self.parameters.acquisition_raw_data.value = frame
+            done_time = self.metrics.record_since("callbacks", callbacks_start)
 
-                    if not check_plot_data(is_locked, data_loaded):
-                        logger.error(
-                            "incorrect data received for lock state, ignoring!"
-                        )
-                        continue
+            if frame.trigger_time is not None:
+                self.metrics.record("total", done_time - frame.trigger_time)
 
-                    self.parameters.to_plot.value = new_data
+    def _is_stale_frame(self, value) -> bool:
+        """
+        Whether `value` is a frame that was recorded before the last call of
+        `exposed_pause_acquisition`, i.e. possibly with outdated settings.
+        """
+        return isinstance(value, Frame) and value.uuid != self.data_uuid
 
-                    # generate signal stats
-                    stats = {}
-                    for signal_name, signal in data_loaded.items():
-                        stats[f"{signal_name}_mean"] = np.mean(signal)
-                        stats[f"{signal_name}_std"] = np.std(signal)
-                        stats[f"{signal_name}_max"] = np.max(signal)
-                        stats[f"{signal_name}_min"] = np.min(signal)
-                    self.parameters.signal_stats.value = stats
-                    # update signal history (if in locked state)
-                    (
-                        self.parameters.control_signal_history.value,
-                        self.parameters.monitor_signal_history.value,
-                    ) = update_signal_history(
-                        self.parameters.control_signal_history.value,
-                        self.parameters.monitor_signal_history.value,
-                        data_loaded,
-                        is_locked,
-                        self.parameters.control_signal_history_length.value,
-                    )
-                else:
-                    self.parameters.acquisition_raw_data.value = new_data
-            sleep(0.05)
+    def _wait_for_new_data(
+        self, last_sequence: int | None, timeout: float
+    ) -> Frame | None:
+        """
+        Wait for a frame that is newer than `last_sequence`.
+
+        Returns `None` if there is no new frame within `timeout`. If the acquisition
+        runs in the same process, the frame is copied out of its ring buffer.
+        """
+        frame_buffer = self.registers.frame_buffer
+        if frame_buffer is None:
+            # remote acquisition service
+            (
+                new_data_returned,
+                sequence,
+                data_was_raw,
+                new_data,
+                data_uuid,
+            ) = self.registers.frame_source.exposed_wait_for_frame(
+                last_sequence, timeout
+            )
+            if not new_data_returned:
+                return None
+            return Frame.from_plot_data(
+                pickle.loads(new_data),
+                sequence,
+                data_was_raw,
+                uuid=data_uuid,
+                pickled=new_data,
+            )
+
+        view = frame_buffer.wait_for_frame(last_sequence, timeout)
+        if view is None:
+            return None
+        pickup_time = perf_counter()
+        self.metrics.record("pickup", pickup_time - view.header.publish_time)
+
+        frame = Frame.from_view(view)
+        if not view.is_valid():
+            # the acquisition loop reused the slot while we were copying it
+            self.metrics.count("skipped_overwritten")
+            return None
+        self.metrics.record_since("copy", pickup_time)
+        return frame
 
     def _task_running(self):
         return (
@@ -253,6 +455,35 @@ class RedPitayaControlService(BaseService, LinienControlService):
             or self.parameters.psd_optimization_running.value
         )
 
+    def exposed_get_pipeline_metrics(self) -> dict[str, dict]:
+        """
+        Rolling statistics (count, mean, p50, p95 and p99 in seconds) of the time frames
+        spend in each stage on their way from the scope trigger to the parameters, and
+        counters of skipped frames.
+
+        Stages of the acquisition are `read` (trigger detected to buffer read),
+        `publish` and `serialize` (if the acquisition runs remotely). Stages of the
+        control service are `pickup` (published to picked up by the pusher), `copy`
+        (out of the ring buffer), `stats`, `callbacks` (setting the parameters) and
+        `total` (trigger to callbacks done). `pickup`, `copy` and `total` are only
+        recorded if the acquisition runs in the same process.
+        """
+        return {
+            "acquisition": self.registers.acquisition.exposed_get_pipeline_metrics(),
+            "control": self.metrics.get_stats(),
+        }
+
+    def exposed_set_pipeline_metrics_enabled(self, enabled: bool) -> None:
+        self.metrics.enabled = enabled
+        self.registers.acquisition.exposed_set_pipeline_metrics_enabled(enabled)
+
+    def exposed_get_task_stats(self) -> dict[str, dict]:
+        """
+        Number of processed and dropped (i.e. skipped because the task was busy) values
+        as well as durations of the callbacks of running tasks.
+        """
+        return self.parameters.task_executor.get_stats()
+
     def exposed_write_registers(self) -> None:
         """Sync the parameters with the FPGA registers."""
         self.registers.write_registers()
@@ -312,8 +543,10 @@ class RedPitayaControlService(BaseService, LinienControlService):
         self.stop_event.set()
         self.ping_thread.join()
         self.data_pusher_thread.join()
+        self.parameters.task_executor.stop()
         self.registers.acquisition.exposed_stop_acquisition()
-        # FIXME: hacky way to trigger atexit handlers for saving parameters
+        self.parameter_journal.stop()
+        # FIXME: hacky way to stop the server running in the main thread
         _thread.interrupt_main()
         raise SystemExit()
 
@@ -346,33 +579,58 @@ class RedPitayaControlService(BaseService, LinienControlService):
 
 
 class FakeRedPitayaControlService(BaseService, LinienControlService):
-    def __init__(self):
+    """
+    Control service without hardware that publishes synthetic plot data (cf.
+    `SyntheticPlotData`) at `frame_rate` frames per second, e.g. for load testing
+    clients. If `spectra_path` is given, recorded spectra are replayed. If
+    `lock_toggle_interval` is given, the lock is switched on and off periodically.
+    """
+
+    def __init__(
+        self,
+        frame_rate: float = 10.0,
+        spectra_path: str | None = None,
+        lock_toggle_interval: float | None = None,
+        jitter: float = 0.01,
+    ):
         super().__init__()
         self.exposed_is_locked = None
+        self.frame_rate = frame_rate
+        self.lock_toggle_interval = lock_toggle_interval
+        spectra = load_spectra(spectra_path) if spectra_path is not None else None
+        self.plot_data_generator = SyntheticPlotData(spectra, jitter=jitter)
 
-        self.random_data_thread = Thread(
-            target=self._write_random_data_to_parameters_loop,
+        self.synthetic_data_thread = Thread(
+            target=self._write_synthetic_data_to_parameters_loop,
             args=(self.stop_event,),
             daemon=True,
         )
-        self.random_data_thread.start()
+        self.synthetic_data_thread.start()
 
-    def _write_random_data_to_parameters_loop(self, stop_event: Event):
+    def _write_synthetic_data_to_parameters_loop(self, stop_event: Event):
+        period = 1 / self.frame_rate
+        start = next_frame = perf_counter()
+        sequence = 0
         while not stop_event.is_set():
-            max_ = randint(0, 8191)
-
-            def gen():
-                return np.array([randint(-max_, max_) for _ in range(N_POINTS)])
-
-            self.parameters.to_plot.value = pickle.dumps(
-                {
-                    "error_signal_1": gen(),
-                    "error_signal_1_quadrature": gen(),
-                    "error_signal_2": gen(),
-                    "error_signal_2_quadrature": gen(),
-                }
+            if self.lock_toggle_interval:
+                elapsed = perf_counter() - start
+                locked = int(elapsed / self.lock_toggle_interval) % 2 == 1
+                if locked != self.parameters.lock.value:
+                    self.parameters.lock.value = locked
+
+            plot_data = self.plot_data_generator.generate(self.parameters.lock.value)
+            self.parameters.to_plot.value = Frame.from_plot_data(
+                plot_data, sequence, raw=False
             )
-            sleep(0.1)
+            sequence += 1
+
+            next_frame += period
+            delay = next_frame - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            else:
+                # don't try to catch up if publishing takes longer than `period`
+                next_frame = perf_counter()
 
     def exposed_write_registers(self):
         pass
@@ -0,0 +1,76 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Iterable
+
+import numpy as np
+
+SIGNAL_STATS = ("mean", "std", "max", "min")
+
+
+def compute_signal_stats(
+    plot_data: dict[str, Any], selection: Iterable[str] = SIGNAL_STATS
+) -> dict[str, float]:
+    """
+    Compute statistics of all signals in `plot_data` (cf. `Frame.as_plot_data`). The
+    returned dictionary has keys like `error_signal_1_mean` for each statistic in
+    `selection` (any of `SIGNAL_STATS`).
+
+    Instead of reducing every signal separately, the signals are stacked into one int32
+    block and each statistic is obtained by a single reduction over all signals. The
+    standard deviation is calculated from the sum and the sum of squares, which are
+    exact in int64 for 14 bit samples. Scalar values like `slow_control_signal` are
+    handled without any array operations.
+    """
+    selection = [name for name in SIGNAL_STATS if name in set(selection)]
+    if not selection:
+        return {}
+
+    names = []
+    arrays = []
+    stats: dict[str, float] = {}
+    for name, value in plot_data.items():
+        if np.ndim(value) == 0:
+            scalar = {"mean": value, "std": 0.0, "max": value, "min": value}
+            for stat in selection:
+                stats[f"{name}_{stat}"] = scalar[stat]
+        else:
+            names.append(name)
+            arrays.append(value)
+    if not arrays:
+        return stats
+
+    block = np.stack(arrays).astype(np.int32, copy=False)
+    n_points = block.shape[1]
+    results = {}
+    if "mean" in selection or "std" in selection:
+        sums = block.sum(axis=1, dtype=np.int64)
+        results["mean"] = sums / n_points
+        if "std" in selection:
+            sums_of_squares = np.einsum("ij,ij->i", block, block, dtype=np.int64)
+            # exact integer variance, scaled by `n_points ** 2`
+            variances = n_points * sums_of_squares - sums * sums
+            results["std"] = np.sqrt(variances) / n_points
+    if "max" in selection:
+        results["max"] = block.max(axis=1)
+    if "min" in selection:
+        results["min"] = block.min(axis=1)
+
+    for stat in selection:
+        for name, value in zip(names, results[stat].tolist()):
+            stats[f"{name}_{stat}"] = value
+    return stats
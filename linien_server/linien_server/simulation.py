@@ -0,0 +1,356 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Simulated Red Pitaya that allows running the acquisition and control services without
+hardware, e.g. `linien-server run --simulate`.
+
+`SimulatedRedPitaya` mimics the parts of `pyrp3.board.RedPitaya` that are used by
+`AcquisitionService`: CSR memory (`read` / `write`) and the scope (`scope`) including
+its trigger, write pointer and decimation. Spectra are either replayed from recordings
+(e.g. `robust_spectra.npy`) or synthesized.
+"""
+
+import logging
+from glob import glob
+from math import ceil, log2
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+from linien_common.common import DECIMATION, MAX_N_POINTS, N_POINTS
+
+from . import csrmap
+from .csr import PythonCSR
+from .polling import FPGA_CLOCK_RATE, sweep_speed_to_time
+from .scope import CHANNEL_OFFSETS, MAX_DATA_LENGTH
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# maximum value of a signed 14 bit sample
+MAX_SAMPLE = 8191
+
+
+def synthesize_spectrum(
+    n_points: int = 2048,
+    n_lines: int = 5,
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Synthesize an error signal with `n_lines` dispersive lines on a sweep range of
+    [-1, 1].
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-1, 1, n_points)
+    spectrum = np.zeros(n_points)
+    for _ in range(n_lines):
+        position = rng.uniform(-0.8, 0.8)
+        width = rng.uniform(0.005, 0.03)
+        amplitude = rng.uniform(0.2, 1)
+        dx = (x - position) / width
+        # derivative of a Lorentzian
+        spectrum += amplitude * -2 * dx / (1 + dx**2) ** 2
+    return 2000 * spectrum / np.max(np.abs(spectrum))
+
+
+def load_spectra(path: str) -> list[np.ndarray]:
+    """
+    Load recorded spectra, e.g. `robust_spectra.npy`. `path` may be a glob pattern that
+    matches several files, the spectra of all files are concatenated.
+    """
+    spectra = []
+    for filename in sorted(glob(path)):
+        data = np.load(filename, allow_pickle=True)
+        if data.dtype == object or data.ndim == 1:
+            data = np.atleast_2d(np.array(list(data), dtype=float))
+        spectra += [np.asarray(spectrum, dtype=float) for spectrum in data]
+    if not spectra:
+        raise FileNotFoundError(f"No spectra found at {path}")
+    return spectra
+
+
+class SimulatedScope:
+    """
+    Mimics `pyrp3.instrument.Scope`.
+
+    After `rearm`, the scope is triggered by the next start of the sweep (or
+    immediately if the laser is locked) and the acquisition is completed after
+    `trigger_delay` samples. The data are written to the scope memory starting at
+    `write_pointer_trigger`.
+    """
+
+    def __init__(self, board: "SimulatedRedPitaya") -> None:
+        self._board = board
+        # two memory blocks of 32 bit words, each containing two 14 bit signals
+        self._memory = {
+            offset: np.zeros(MAX_N_POINTS, dtype=np.uint32)
+            for offset in CHANNEL_OFFSETS
+        }
+        self.data_decimation = 1
+        self.trigger_delay = 0
+        self.write_pointer_trigger = 0
+        self._completed_at: Optional[float] = None
+        self._armed = False
+
+    def rearm(self, trigger_source=None) -> None:
+        now = self._board.clock()
+        if self._board.locked:
+            trigger_at = now
+        else:
+            # triggered by the start of the next sweep
+            period = self._board.sweep_period(self.data_decimation)
+            trigger_at = ceil((now - self._board.start_time) / period) * period
+            trigger_at += self._board.start_time
+        duration = self.trigger_delay * self.data_decimation / FPGA_CLOCK_RATE
+        self._completed_at = trigger_at + duration
+        self._armed = True
+
+    def read(self, addr: int) -> int:
+        if addr == 0x1 << 2:
+            # status register: bit 2 is set as long as the scope waits for the trigger
+            if self._armed and self._board.clock() >= self._completed_at:
+                self._acquire()
+            return 0x4 if self._armed else 0
+        return 0
+
+    def _acquire(self) -> None:
+        self._armed = False
+        n_points = min(self.trigger_delay + 1, MAX_N_POINTS)
+        self.write_pointer_trigger = (
+            self.write_pointer_trigger + 4321
+        ) % MAX_DATA_LENGTH
+        # like the reader (cf. `read_scope_channels`), treat the memory as ring buffer
+        # of `MAX_DATA_LENGTH` samples
+        idxs = (self.write_pointer_trigger + np.arange(n_points)) % MAX_DATA_LENGTH
+        signals = self._board.generate_scope_signals(n_points)
+        for block_idx, offset in enumerate(CHANNEL_OFFSETS):
+            signal_a = signals[2 * block_idx].astype(np.int32) & 0x3FFF
+            signal_b = signals[2 * block_idx + 1].astype(np.int32) & 0x3FFF
+            self._memory[offset][idxs] = (signal_b.astype(np.uint32) << 16) | signal_a
+
+    def reads(self, addr: int, length: int) -> np.ndarray:
+        offset = addr & ~0xFFFF
+        start = (addr - offset) // 4
+        return self._memory[offset][start : start + length]
+
+
+class SimulatedRedPitaya:
+    """
+    Simulated replacement of `pyrp3.board.RedPitaya` that provides the CSR memory and
+    the scope.
+
+    CSR writes are honoured where relevant for the acquisition: sweep center and
+    amplitude, scope signal selection, demodulation phase and lock request. Spectra are
+    replayed from `spectra` (one after another, which emulates jitter between sweeps)
+    or synthesized if none are given.
+    """
+
+    def __init__(
+        self,
+        spectra: Optional[Sequence[np.ndarray]] = None,
+        noise: float = 5.0,
+        seed: Optional[int] = None,
+        clock: Callable[[], float] = perf_counter,
+    ) -> None:
+        self.clock = clock
+        self.start_time = clock()
+        self._rng = np.random.default_rng(seed)
+        self.noise = noise
+        self.spectra = (
+            list(spectra) if spectra is not None else [synthesize_spectrum(seed=seed)]
+        )
+        self._spectrum_idx = 0
+        self._control_signal = 0.0
+
+        self._lock = Lock()
+        self._memory: dict[int, int] = {}
+        self.csr = PythonCSR(self)
+        self.scope = SimulatedScope(self)
+
+    # CSR memory
+
+    def read(self, addr: int) -> int:
+        return self._memory.get(addr, 0)
+
+    def write(self, addr: int, value: int) -> None:
+        with self._lock:
+            self._memory[addr] = value
+            if addr in self.csr.plan("logic_autolock_request_lock").addresses:
+                # the lock starts immediately after it was requested
+                for address in self.csr.plan("logic_autolock_lock_running").addresses:
+                    self._memory[address] = value
+
+    def get_signed(self, name: str) -> int:
+        value = self.csr.get(name)
+        width = self.csr.plan(name).width
+        return value - (1 << width) if value >= 1 << (width - 1) else value
+
+    @property
+    def locked(self) -> bool:
+        return bool(self.csr.get("logic_autolock_lock_running"))
+
+    def sweep_period(self, decimation: int) -> float:
+        """
+        Duration of the sweep, which is given by `sweep_speed` that also determines the
+        decimation of the scope (cf.
+        `AcquisitionService.program_acquisition_and_rearm`).
+        """
+        sweep_speed = log2(max(decimation, DECIMATION)) - log2(DECIMATION)
+        return sweep_speed_to_time(sweep_speed)
+
+    # signals
+
+    def generate_scope_signals(self, n_points: int) -> np.ndarray:
+        """Return the signals selected by the `scopegen_*_sel` CSRs."""
+        signals = self._generate_signals(n_points)
+        selected = np.zeros((4, n_points), dtype=np.int16)
+        for idx, name in enumerate(
+            (
+                "scopegen_adc_a_sel",
+                "scopegen_adc_b_sel",
+                "scopegen_adc_a_q_sel",
+                "scopegen_adc_b_q_sel",
+            )
+        ):
+            signal_name = csrmap.signals[self.csr.get(name) % len(csrmap.signals)]
+            if signal_name in signals:
+                np.clip(
+                    signals[signal_name],
+                    -MAX_SAMPLE,
+                    MAX_SAMPLE,
+                    out=signals[signal_name],
+                )
+                selected[idx] = signals[signal_name]
+        return selected
+
+    def _generate_signals(self, n_points: int) -> dict[str, np.ndarray]:
+        noise = self._rng.normal(0, self.noise, (4, n_points))
+        if self.locked:
+            # the laser stays close to the lock point, the control signal slowly drifts
+            self._control_signal += self._rng.normal(0, 20)
+            error_signal = noise[0]
+            control_signal = self._control_signal + np.cumsum(noise[1]) / 10
+            return {
+                "logic_combined_error_signal": error_signal,
+                "logic_combined_error_signal_filtered": error_signal,
+                "logic_control_signal": control_signal,
+                "fast_b_x": noise[2] + 500,
+            }
+
+        spectrum = self.spectra[self._spectrum_idx]
+        self._spectrum_idx = (self._spectrum_idx + 1) % len(self.spectra)
+
+        center = self.get_signed("logic_out_offset") / MAX_SAMPLE
+        amplitude = self.get_signed("logic_sweep_max") / MAX_SAMPLE
+        x = center + amplitude * np.linspace(-1, 1, n_points)
+        error_signal = np.interp(x, np.linspace(-1, 1, len(spectrum)), spectrum)
+
+        signals = {"fast_b_x": 500 - np.abs(error_signal) / 4 + noise[3]}
+        for chain, noise_i, noise_q in (
+            ("a", noise[0], noise[1]),
+            ("b", noise[2], noise[3]),
+        ):
+            phase = 2 * np.pi * self.csr.get(f"fast_{chain}_demod_delay") / (1 << 14)
+            signals[f"fast_{chain}_out_i"] = error_signal * np.cos(phase) + noise_i
+            signals[f"fast_{chain}_out_q"] = error_signal * np.sin(phase) + noise_q
+        signals["logic_combined_error_signal"] = signals["fast_a_out_i"]
+        signals["logic_control_signal"] = MAX_SAMPLE * x
+        return signals
+
+
+class SyntheticPlotData:
+    """
+    Generates plot data in the format of `to_plot` directly, i.e. without simulating
+    the FPGA and the acquisition. This is much cheaper than `SimulatedRedPitaya` and
+    used by `FakeRedPitayaControlService` to feed clients with hundreds of frames per
+    second.
+
+    While unlocked, `spectra` (or a synthesized spectrum) are replayed one after
+    another, shifted by a random `jitter` (in units of the sweep range) and split into I
+    and Q with a slowly drifting demodulation phase. While locked, the error signal is
+    noise and the control signal drifts.
+    """
+
+    def __init__(
+        self,
+        spectra: Optional[Sequence[np.ndarray]] = None,
+        n_points: int = N_POINTS,
+        noise: float = 5.0,
+        jitter: float = 0.01,
+        seed: Optional[int] = None,
+    ) -> None:
+        self._rng = np.random.default_rng(seed)
+        self.n_points = n_points
+        self.noise = noise
+        self.jitter = jitter
+        self.spectra = (
+            list(spectra) if spectra is not None else [synthesize_spectrum(seed=seed)]
+        )
+        self._spectrum_idx = 0
+        self._phase = 0.0
+        self._control_signal = 0.0
+        self._x = np.linspace(-1, 1, n_points)
+
+    def generate(self, locked: bool = False) -> dict[str, np.ndarray]:
+        noise = self._rng.normal(0, self.noise, (4, self.n_points))
+        if locked:
+            self._control_signal += self._rng.normal(0, 20)
+            control_signal = self._control_signal + np.cumsum(noise[1]) / 10
+            return {
+                "error_signal": self._to_samples(noise[0]),
+                "control_signal": self._to_samples(control_signal),
+            }
+
+        spectrum = self.spectra[self._spectrum_idx]
+        self._spectrum_idx = (self._spectrum_idx + 1) % len(self.spectra)
+        shift = self._rng.normal(0, self.jitter)
+        error_signal = np.interp(
+            self._x + shift, np.linspace(-1, 1, len(spectrum)), spectrum
+        )
+        self._phase += self._rng.normal(0, 0.01)
+
+        signals = {}
+        for channel, phase, noise_i, noise_q in (
+            (1, self._phase, noise[0], noise[1]),
+            (2, self._phase + np.pi / 4, noise[2], noise[3]),
+        ):
+            signals[f"error_signal_{channel}"] = self._to_samples(
+                error_signal * np.cos(phase) + noise_i
+            )
+            signals[f"error_signal_{channel}_quadrature"] = self._to_samples(
+                error_signal * np.sin(phase) + noise_q
+            )
+        return signals
+
+    @staticmethod
+    def _to_samples(signal: np.ndarray) -> np.ndarray:
+        return np.clip(signal, -MAX_SAMPLE, MAX_SAMPLE).astype(np.int16)
+
+
+def create_simulated_red_pitaya(
+    spectra_path: Optional[str] = None,
+) -> SimulatedRedPitaya:
+    """
+    Create a simulated board that replays the spectra at `spectra_path` (if given).
+    """
+    if spectra_path is None:
+        return SimulatedRedPitaya()
+    spectra = load_spectra(spectra_path)
+    logger.info(f"Replaying {len(spectra)} spectra from {spectra_path}")
+    return SimulatedRedPitaya(spectra=spectra)
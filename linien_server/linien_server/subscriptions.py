@@ -0,0 +1,175 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import pickle
+from threading import Event, Thread
+from time import perf_counter
+from typing import Any, Callable, Optional
+
+from linien_common.communication import pack
+from linien_server.frame_buffer import Frame
+from linien_server.parameters import Parameters
+from linien_server.wire_format import WIRE_FORMAT_PICKLE
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class ParameterChangePusher:
+    """
+    Pushes the parameter changes of a single client to a callback of that client
+    instead of letting the client poll `get_changed_parameters_queue`.
+
+    After the first change, further changes are collected for `coalesce_interval`
+    seconds and then sent as one batch. The callback is called synchronously, i.e.
+    there is at most one batch in flight per client. While a slow client processes a
+    batch, new changes pile up in its queue where values of collapsible parameters
+    replace older ones (backpressure).
+
+    The callback receives the batch as pickled list of `(name, value)` tuples, the same
+    format that `get_changed_parameters_queue` returns.
+    """
+
+    def __init__(
+        self,
+        parameters: Parameters,
+        uuid: str,
+        callback: Callable[[Any], None],
+        coalesce_interval: float = 0.02,
+    ) -> None:
+        self.parameters = parameters
+        self.uuid = uuid
+        self.callback = callback
+        self.coalesce_interval = coalesce_interval
+        self.n_batches = 0
+        self.n_changes = 0
+
+        self.stop_event = Event()
+        self.thread = Thread(target=self._push_loop, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def _push_loop(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                # the timeout only ensures that `stop_event` is checked regularly
+                changed = self.parameters.wait_for_changed_parameters(
+                    self.uuid, timeout=0.5
+                )
+            except KeyError:
+                # the client unregistered its listeners
+                break
+            if not changed:
+                continue
+            # collect further changes, e.g. all parameters set by one client call
+            if self.stop_event.wait(self.coalesce_interval):
+                break
+
+            batch = self.parameters.get_changed_parameters_queue(self.uuid)
+            if not batch:
+                continue
+            try:
+                self.callback(pack(batch))
+            except Exception:
+                logger.exception(f"Pushing parameter changes to {self.uuid} failed")
+                break
+            self.n_batches += 1
+            self.n_changes += len(batch)
+
+
+class PlotSubscription:
+    """
+    Sends frames of `to_plot` to a client callback, limited to `max_rate` frames per
+    second, decimated to a min/max envelope of `n_points` points and restricted to the
+    signal names in `signals` (all of them optional).
+
+    `offer` is registered as a callback of `to_plot` and only stores the frame. The
+    frame is encoded and sent by a separate thread such that a slow client neither
+    delays the acquisition nor other clients. If the client is still busy when a new
+    frame arrives, only the most recent frame is sent. The encoded variant is cached
+    by the frame, i.e. clients that requested the same decimation share it.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[bytes], None],
+        max_rate: Optional[float] = None,
+        n_points: Optional[int] = None,
+        signals: Optional[tuple[str, ...]] = None,
+        wire_format: str = WIRE_FORMAT_PICKLE,
+        clock: Callable[[], float] = perf_counter,
+    ) -> None:
+        self.callback = callback
+        self.min_interval = 1 / max_rate if max_rate else 0.0
+        self.n_points = n_points
+        self.signals = tuple(sorted(signals)) if signals is not None else None
+        self.wire_format = wire_format
+        self._clock = clock
+
+        self.n_sent = 0
+        self.n_skipped = 0
+        self._last_offer: Optional[float] = None
+        self._pending: Optional[Frame] = None
+        self._new_frame = Event()
+        self.stop_event = Event()
+        self.thread = Thread(target=self._send_loop, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self._new_frame.set()
+
+    def offer(self, value: Frame | bytes) -> None:
+        now = self._clock()
+        if self._last_offer is not None and now - self._last_offer < self.min_interval:
+            self.n_skipped += 1
+            return
+        self._last_offer = now
+
+        if not isinstance(value, Frame):
+            # e.g. pickled plot data of `FakeRedPitayaControlService`
+            value = Frame.from_plot_data(
+                pickle.loads(value), sequence=0, raw=False, pickled=value
+            )
+        if self._pending is not None:
+            # the client did not keep up
+            self.n_skipped += 1
+        self._pending = value
+        self._new_frame.set()
+
+    def _send_loop(self) -> None:
+        while not self.stop_event.is_set():
+            self._new_frame.wait()
+            self._new_frame.clear()
+            frame, self._pending = self._pending, None
+            if frame is None or self.stop_event.is_set():
+                continue
+            try:
+                self.callback(
+                    frame.to_bytes(self.n_points, self.signals, self.wire_format)
+                )
+            except Exception:
+                logger.exception("Sending plot data to client failed")
+                break
+            self.n_sent += 1
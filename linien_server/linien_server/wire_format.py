@@ -0,0 +1,226 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compact binary format for frames of `to_plot` and `acquisition_raw_data`.
+
+A frame consists of a fixed header, the names of the signals and the signals as
+little-endian int16 arrays (the ADC has 14 bit). Optionally, the signals are delta
+encoded and compressed with zlib. Uncompressed frames are decoded without copying via
+`np.frombuffer`. Unlike pickle, decoding does not execute anything that is contained in
+the data.
+
+Clients announce the formats they understand with
+`RedPitayaControlService.exposed_negotiate_wire_format`. Pickle remains the default for
+clients that do not do so.
+"""
+
+import struct
+import zlib
+from math import isnan, nan
+from typing import Any, Optional
+
+import numpy as np
+
+WIRE_FORMAT_PICKLE = "pickle"
+WIRE_FORMAT_BINARY = "binary-v2"
+WIRE_FORMAT_BINARY_ZLIB = "binary-v2+zlib"
+# in order of preference
+SUPPORTED_WIRE_FORMATS = (
+    WIRE_FORMAT_BINARY_ZLIB,
+    WIRE_FORMAT_BINARY,
+    WIRE_FORMAT_PICKLE,
+)
+
+MAGIC = b"LNF"
+VERSION = 2
+
+FLAG_RAW = 1
+FLAG_LOCKED = 2
+FLAG_SLOW_CONTROL_SIGNAL = 4
+FLAG_DELTA = 8
+FLAG_ZLIB = 16
+
+# magic, version, flags, number of signals, decimation, number of points, sequence,
+# uuid (NaN if not set), slow control signal. Decimation is 32 bit as slow sweeps use
+# decimations of up to 2**18 (version 1 used 16 bit).
+HEADER = struct.Struct("<3sBBBIIQdq")
+
+_INT16_INFO = np.iinfo(np.int16)
+
+
+class WireHeader:
+    """Meta data of an encoded frame."""
+
+    def __init__(
+        self,
+        names: tuple[str, ...],
+        n_points: int,
+        sequence: int,
+        locked: bool,
+        raw: bool,
+        uuid: Optional[float] = None,
+        decimation: int = 1,
+        slow_control_signal: Optional[int] = None,
+    ) -> None:
+        self.names = names
+        self.n_points = n_points
+        self.sequence = sequence
+        self.locked = locked
+        self.raw = raw
+        self.uuid = uuid
+        self.decimation = decimation
+        self.slow_control_signal = slow_control_signal
+
+
+def encode(
+    header: WireHeader, signals: dict[str, np.ndarray], compress: bool = False
+) -> bytes:
+    """
+    Encode `signals` (all of length `header.n_points`, in the order of `header.names`).
+    Signals that are not int16 are converted if their values fit, otherwise a
+    `ValueError` is raised (as it is for header fields that are out of range).
+    """
+    flags = 0
+    if header.raw:
+        flags |= FLAG_RAW
+    if header.locked:
+        flags |= FLAG_LOCKED
+    if header.slow_control_signal is not None:
+        flags |= FLAG_SLOW_CONTROL_SIGNAL
+    if compress:
+        flags |= FLAG_DELTA | FLAG_ZLIB
+
+    payload = np.empty((len(header.names), header.n_points), dtype="<i2")
+    for row, name in zip(payload, header.names):
+        signal = signals[name]
+        if (
+            signal.dtype != np.int16
+            and len(signal)
+            and (signal.min() < _INT16_INFO.min or signal.max() > _INT16_INFO.max)
+        ):
+            raise ValueError(f"Signal {name} does not fit into int16")
+        row[:] = signal
+    if compress:
+        # differences wrap around in int16, which is undone by the cumulative sum
+        payload[:, 1:] = np.diff(payload, axis=1)
+        body = zlib.compress(payload.tobytes(), 1)
+    else:
+        body = payload.tobytes()
+
+    names = b"".join(
+        bytes((len(encoded),)) + encoded
+        for encoded in (name.encode("ascii") for name in header.names)
+    )
+    try:
+        packed_header = HEADER.pack(
+            MAGIC,
+            VERSION,
+            flags,
+            len(header.names),
+            header.decimation,
+            header.n_points,
+            header.sequence,
+            nan if header.uuid is None else header.uuid,
+            header.slow_control_signal or 0,
+        )
+    except struct.error as e:
+        raise ValueError(f"Header can't be encoded: {e}") from e
+    return packed_header + names + body
+
+
+def is_binary_frame(data: bytes) -> bool:
+    return bytes(data[: len(MAGIC)]) == MAGIC
+
+
+def decode(data: bytes | memoryview) -> tuple[WireHeader, dict[str, np.ndarray]]:
+    """
+    Decode a frame created by `encode`. For uncompressed frames, the signals are
+    read-only views on `data`.
+    """
+    if not is_binary_frame(data):
+        raise ValueError("Data is not a binary frame")
+    (
+        _,
+        version,
+        flags,
+        n_signals,
+        decimation,
+        n_points,
+        sequence,
+        uuid,
+        slow_control_signal,
+    ) = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary frame version {version}")
+
+    view = memoryview(data)
+    offset = HEADER.size
+    names = []
+    for _ in range(n_signals):
+        length = view[offset]
+        names.append(bytes(view[offset + 1 : offset + 1 + length]).decode("ascii"))
+        offset += 1 + length
+
+    if flags & FLAG_ZLIB:
+        body: bytes | memoryview = zlib.decompress(view[offset:])
+    else:
+        body = view[offset:]
+    payload = np.frombuffer(body, dtype="<i2", count=n_signals * n_points).reshape(
+        n_signals, n_points
+    )
+    if flags & FLAG_DELTA:
+        payload = np.cumsum(payload, axis=1, dtype=np.int16)
+
+    header = WireHeader(
+        tuple(names),
+        n_points=n_points,
+        sequence=sequence,
+        locked=bool(flags & FLAG_LOCKED),
+        raw=bool(flags & FLAG_RAW),
+        uuid=None if isnan(uuid) else uuid,
+        decimation=decimation,
+        slow_control_signal=(
+            slow_control_signal if flags & FLAG_SLOW_CONTROL_SIGNAL else None
+        ),
+    )
+    return header, dict(zip(header.names, payload))
+
+
+def decode_plot_data(data: bytes | memoryview) -> Any:
+    """
+    Decode a binary frame into the format of `Frame.as_plot_data`, i.e. a dictionary of
+    signals for `to_plot` and a tuple of two signals for `acquisition_raw_data`.
+    """
+    header, signals = decode(data)
+    if header.raw:
+        return tuple(signals.values())
+    plot_data: dict[str, Any] = dict(signals)
+    if header.slow_control_signal is not None:
+        plot_data["slow_control_signal"] = header.slow_control_signal
+    return plot_data
+
+
+def negotiate_wire_format(client_formats: list[str] | tuple[str, ...]) -> str:
+    """
+    Pick the first format of `client_formats` (ordered by the preference of the client)
+    that is supported by the server. Falls back to pickle.
+    """
+    for wire_format in client_formats:
+        if wire_format in SUPPORTED_WIRE_FORMATS:
+            return wire_format
+    return WIRE_FORMAT_PICKLE
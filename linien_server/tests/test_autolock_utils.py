@@ -0,0 +1,152 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+from linien_server.autolock.robust import (
+    LockPositionNotFound,
+    calculate_autolock_instructions,
+    get_lock_position_from_autolock_instructions,
+)
+from linien_server.autolock.utils import (
+    get_diff_at_time_scale,
+    sign,
+    sum_up_spectrum,
+)
+
+RNG = np.random.default_rng(seed=0)
+
+
+def reference_sum_diff(spectrum, xscale):
+    """Sample-by-sample calculation as done by the FPGA."""
+    summed = []
+    sum_ = 0
+    for value in spectrum:
+        sum_ += int(value)
+        summed.append(sum_)
+    return summed, [
+        value - (summed[idx - xscale] if idx >= xscale else 0)
+        for idx, value in enumerate(summed)
+    ]
+
+
+def reference_lock_position(spectrum, description, time_scale, final_wait_time):
+    _, summed_xscaled = reference_sum_diff(spectrum, time_scale)
+    description_idx = 0
+    last_detected_peak = 0
+    for idx, value in enumerate(summed_xscaled):
+        wait_for, current_threshold = description[description_idx]
+        if (
+            sign(value) == sign(current_threshold)
+            and abs(value) >= abs(current_threshold)
+            and idx - last_detected_peak > wait_for
+        ):
+            description_idx += 1
+            last_detected_peak = idx
+            if description_idx == len(description):
+                return idx + final_wait_time
+    raise LockPositionNotFound()
+
+
+@pytest.mark.parametrize("xscale", [0, 1, 5, 100, 2048, 3000])
+def test_sum_diff_is_bit_exact(xscale):
+    # full-scale 14 bit values summed over a whole spectrum do not fit into int32
+    spectrum = RNG.integers(-8192, 8192, 2048, dtype=np.int16)
+    spectrum[:1024] = 8191
+
+    summed = sum_up_spectrum(spectrum)
+    summed_xscaled = get_diff_at_time_scale(summed, xscale)
+    reference_summed, reference_xscaled = reference_sum_diff(spectrum, xscale)
+
+    assert summed.dtype == np.int64
+    assert summed.tolist() == reference_summed
+    assert summed_xscaled.tolist() == reference_xscaled
+
+
+def test_lock_position_matches_reference():
+    x = np.linspace(-30, 30, 512)
+    spectrum = np.round(np.exp(-np.abs(x)) * np.sin(x) * 2048).astype(np.int64)
+    time_scale = 8
+
+    for _ in range(200):
+        n_instructions = RNG.integers(1, 5)
+        description = [
+            (int(RNG.integers(0, 100)), int(RNG.integers(-3000, 3000)))
+            for _ in range(n_instructions)
+        ]
+        noisy = spectrum + RNG.integers(-50, 50, len(spectrum))
+        try:
+            expected = reference_lock_position(noisy, description, time_scale, 3)
+        except LockPositionNotFound:
+            with pytest.raises(LockPositionNotFound):
+                get_lock_position_from_autolock_instructions(
+                    noisy, description, time_scale, spectrum, 3
+                )
+        else:
+            assert (
+                get_lock_position_from_autolock_instructions(
+                    noisy, description, time_scale, spectrum, 3
+                )
+                == expected
+            )
+
+
+def test_threshold_of_zero_matches_non_negative_values():
+    spectrum = [0, 0, -1, -1, 0, 2, 0]
+    # `sign(0)` is positive, i.e. a threshold of zero is reached by zero values
+    assert get_lock_position_from_autolock_instructions(
+        spectrum, [(0, 0), (0, -1), (0, 0)], 1, spectrum, 0
+    ) == reference_lock_position(spectrum, [(0, 0), (0, -1), (0, 0)], 1, 0)
+    with pytest.raises(LockPositionNotFound):
+        get_lock_position_from_autolock_instructions(spectrum, [(0, 3)], 1, spectrum, 0)
+
+
+def test_tolerance_search_stops_at_first_failing_spectrum():
+    rng = np.random.default_rng(seed=1)
+    x = np.linspace(-30, 30, 2048)
+
+    def peak(x):
+        return np.exp(-np.abs(x)) * np.sin(x)
+
+    spectra = []
+    for _ in range(10):
+        spectrum = peak(x) * 2048 + (peak(x - 10) - peak(x + 10)) * 1024
+        spectrum += rng.standard_normal(len(x)) * 20
+        spectra.append(
+            np.roll(np.round(spectrum).astype(np.int64), rng.integers(-5, 5))
+        )
+    target_idxs = (1310, 1400)
+
+    description, final_wait_time, time_scale = calculate_autolock_instructions(
+        spectra, target_idxs
+    )
+    *result, diagnostics = calculate_autolock_instructions(
+        spectra, target_idxs, return_diagnostics=True
+    )
+    assert result == [description, final_wait_time, time_scale]
+
+    n_tried = diagnostics["n_tolerances_tried"]
+    # the strictest tolerance is too strict for these noisy spectra
+    assert n_tried > 1
+    assert diagnostics["tolerance_factor"] == [0.95, 0.9, 0.85][n_tried - 1]
+    # the selected description was checked against all spectra, the rejected ones
+    # only until the first spectrum failed
+    assert (
+        len(spectra) + n_tried - 1
+        <= diagnostics["n_lock_position_evaluations"]
+        < n_tried * len(spectra)
+    )
@@ -0,0 +1,139 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from linien_server.csr import (
+    CSRWriteQueue,
+    MMapRegisters,
+    PythonCSR,
+    iir_register_values,
+)
+from linien_server.iir_coeffs import get_params, make_filter, make_filter_cached
+
+
+class DictRegisters:
+    def __init__(self):
+        self.memory = {}
+
+    def read(self, addr):
+        return self.memory.get(addr, 0)
+
+    def write(self, addr, value):
+        self.memory[addr] = value
+
+
+def test_python_csr_layout():
+    registers = DictRegisters()
+    csr = PythonCSR(registers)
+    map_, addr, width, _ = csr.map["logic_pid_kp"]
+    csr.set("logic_pid_kp", -2)
+    # most significant byte first, one byte per 32 bit word
+    n_bytes = (width + 7) // 8
+    value = sum(
+        registers.memory[csr.offset + (map_ << 11) + ((addr + i) << 2)]
+        << (8 * (n_bytes - i - 1))
+        for i in range(n_bytes)
+    )
+    assert value == (1 << width) - 2
+    assert csr.get("logic_pid_kp") == value
+
+
+def test_python_csr_mmap(tmp_path):
+    path = tmp_path / "registers"
+    path.touch()
+    registers = MMapRegisters(str(path), file_offset=0)
+    csr = PythonCSR(registers)
+
+    csr.set_many({"logic_pid_kp": 1234, "logic_pid_ki": 5, "gpio_p_outs": 0b1010})
+    assert csr.get_many(["logic_pid_kp", "logic_pid_ki", "gpio_p_outs"]) == {
+        "logic_pid_kp": 1234,
+        "logic_pid_ki": 5,
+        "gpio_p_outs": 0b1010,
+    }
+    registers.close()
+
+    # the data ended up in the file at the same place as in the register window
+    registers = MMapRegisters(str(path), file_offset=0)
+    assert PythonCSR(registers).get("logic_pid_kp") == 1234
+    registers.close()
+
+
+def test_csr_write_queue():
+    queue = CSRWriteQueue()
+    written = []
+
+    def write(key, value):
+        written.append((key, value))
+
+    # only the last value of each key is written, in the order of the last write
+    queue.put("a", 1)
+    queue.put("b", 2)
+    queue.put("a", 3)
+    assert len(queue) == 2
+    queue.flush(write)
+    assert written == [("b", 2), ("a", 3)]
+    assert len(queue) == 0
+
+    # values that did not change are skipped
+    written.clear()
+    queue.put("a", 3)
+    queue.put("b", 4)
+    queue.flush(write)
+    assert written == [("b", 4)]
+
+    # forced writes are neither merged nor skipped
+    written.clear()
+    queue.put("sweep_run", 0)
+    queue.flush(write)
+    written.clear()
+    queue.put_many([("sweep_run", 0, True), ("sweep_run", 1, True)])
+    queue.flush(write)
+    assert written == [("sweep_run", 0), ("sweep_run", 1)]
+
+    assert queue.get_stats() == {
+        "queued": 8,
+        "coalesced": 1,
+        "skipped": 1,
+        "written": 6,
+    }
+
+
+def test_set_iir():
+    registers = DictRegisters()
+    csr = PythonCSR(registers)
+    prefix = "fast_a_iir_c_1"
+
+    b, a = make_filter_cached("LP", f=0.01, k=1)
+    assert (list(b), list(a)) == make_filter("LP", f=0.01, k=1)
+    assert make_filter_cached("LP", f=0.01, k=1)[0] is b
+
+    iir_register_values.cache_clear()
+    csr.set_iir(prefix, b, a)
+    csr.set_iir(prefix, list(b), list(a))
+    assert iir_register_values.cache_info().hits == 1
+
+    _, _, params = get_params(list(b), list(a), 23, 25)
+    for k, value in params.items():
+        width = csr.plan(f"{prefix}_{k}").width
+        assert csr.get(f"{prefix}_{k}") == value % (1 << width)
+
+    # the second order coefficients of a first order filter are cleared
+    prefix = "logic_raw_acquisition_iir"
+    csr.set_iir(prefix, *make_filter_cached("LP2", f=0.01, k=1))
+    assert csr.get(f"{prefix}_b2") != 0
+    csr.set_iir(prefix, b, a)
+    assert csr.get(f"{prefix}_b2") == 0
+    assert csr.get(f"{prefix}_a2") == 0
@@ -0,0 +1,109 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Event
+from time import perf_counter, sleep
+
+import numpy as np
+from linien_server.executor import TaskExecutor
+from linien_server.frame_buffer import Frame
+from linien_server.parameters import Parameter
+
+
+def test_background_callbacks_do_not_block():
+    parameter = Parameter(start=None)
+    executor = TaskExecutor(background=True)
+    received = []
+    release = Event()
+
+    def slow_task(value):
+        received.append(value)
+        release.wait(1)
+
+    executor.add_callback(parameter, slow_task)
+    start = perf_counter()
+    for value in range(10):
+        parameter.value = value
+        sleep(0.01)
+    # setting the value does not wait for the task
+    assert perf_counter() - start < 0.5
+
+    release.set()
+    sleep(0.1)
+    # the task was busy with the first value, only the latest one was processed after
+    assert received == [0, 9]
+    stats = executor.get_stats()[
+        "test_background_callbacks_do_not_block.<locals>.slow_task"
+    ]
+    assert stats["processed"] == 2
+    assert stats["dropped"] == 8
+
+    executor.remove_callback(parameter, slow_task)
+    parameter.value = 10
+    sleep(0.05)
+    assert received == [0, 9]
+
+
+def test_synchronous_fallback():
+    parameter = Parameter(start=None)
+    executor = TaskExecutor()
+    received = []
+    executor.add_callback(parameter, received.append)
+    parameter.value = 1
+    assert received == [1]
+    executor.remove_callback(parameter, received.append)
+    parameter.value = 2
+    assert received == [1]
+
+
+def test_stale_frames_are_not_delivered():
+    class Control:
+        data_uuid = 1
+
+    def frame(sequence, uuid):
+        signals = {"error_signal_1": np.zeros(16, dtype=np.int16)}
+        return Frame(signals, sequence, locked=False, raw=False, uuid=uuid)
+
+    control = Control()
+    parameter = Parameter(start=None)
+    executor = TaskExecutor(
+        background=True, is_stale=lambda value: value.uuid != control.data_uuid
+    )
+    received = []
+
+    def task(value):
+        received.append(value.sequence)
+        if value.sequence == 1:
+            # the task changes the settings (pause -> write registers -> continue)
+            # while a frame recorded with the old settings is published
+            parameter.value = frame(2, uuid=1)
+            control.data_uuid = 2
+
+    executor.add_callback(parameter, task)
+    parameter.value = frame(1, uuid=1)
+    sleep(0.1)
+    parameter.value = frame(3, uuid=2)
+    sleep(0.1)
+
+    assert received == [1, 3]
+    assert (
+        executor.get_stats()["test_stale_frames_are_not_delivered.<locals>.task"][
+            "stale"
+        ]
+        == 1
+    )
+    executor.stop()
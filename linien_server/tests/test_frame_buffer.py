@@ -0,0 +1,147 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import pickle
+from threading import Timer
+from time import time
+
+import numpy as np
+import pytest
+from linien_server.frame_buffer import (
+    Frame,
+    FrameRingBuffer,
+    load_plot_data,
+    serialize_frame,
+)
+from linien_server.parameters import Parameters
+
+
+def write_frame(buffer, value, n_points=2048):
+    return buffer.write(
+        {
+            "error_signal_1": np.full(n_points, value, dtype=np.int16),
+            "monitor_signal": np.full(n_points, -value, dtype=np.int16),
+        },
+        locked=False,
+        raw=False,
+        uuid=0.5,
+        decimation=8,
+        slow_control_signal=value,
+    )
+
+
+def test_frame_ring_buffer():
+    buffer = FrameRingBuffer(n_slots=4)
+    assert buffer.latest() is None
+
+    sequence = write_frame(buffer, 1)
+    frame = buffer.latest()
+    assert frame.sequence == sequence == 1
+    assert frame.header.uuid == 0.5
+
+    plot_data = frame.as_plot_data()
+    assert set(plot_data) == {"error_signal_1", "monitor_signal", "slow_control_signal"}
+    assert len(plot_data["error_signal_1"]) == 2048
+    assert np.all(plot_data["monitor_signal"] == -1)
+    assert plot_data["slow_control_signal"] == 1
+    # signals are views on the ring buffer, not copies
+    assert np.shares_memory(plot_data["error_signal_1"], buffer.data)
+
+    # the slot is still valid as long as the producer did not wrap around
+    for value in range(2, 5):
+        write_frame(buffer, value)
+    assert frame.is_valid()
+    write_frame(buffer, 5)
+    assert not frame.is_valid()
+    assert buffer.latest().sequence == 5
+
+    buffer.clear()
+    assert buffer.latest() is None
+    assert write_frame(buffer, 6) == 6
+
+
+def test_wait_for_frame():
+    buffer = FrameRingBuffer(n_slots=4)
+    assert buffer.wait_for_frame(None, timeout=0.01) is None
+
+    write_frame(buffer, 1)
+    # a frame newer than the given sequence is available --> return immediately
+    assert buffer.wait_for_frame(None, timeout=0).sequence == 1
+    assert buffer.wait_for_frame(1, timeout=0.01) is None
+
+    timer = Timer(0.05, write_frame, args=(buffer, 2))
+    timer.start()
+    start = time()
+    frame = buffer.wait_for_frame(1, timeout=5)
+    timer.join()
+    assert frame.sequence == 2
+    assert time() - start < 1
+
+
+def test_raw_frame():
+    buffer = FrameRingBuffer(n_slots=2)
+    buffer.write(
+        {"raw_a": np.arange(16384), "raw_b": -np.arange(16384)},
+        locked=True,
+        raw=True,
+        uuid=None,
+        decimation=1,
+    )
+    data = buffer.latest().as_plot_data()
+    assert isinstance(data, tuple)
+    assert data[0][5] == 5 and data[1][5] == -5
+
+
+def test_frame():
+    buffer = FrameRingBuffer(n_slots=2)
+    write_frame(buffer, 3)
+    view = buffer.latest()
+    frame = Frame.from_view(view)
+
+    # the frame does not change if the slot is overwritten
+    write_frame(buffer, 4)
+    write_frame(buffer, 5)
+    assert not view.is_valid()
+    plot_data = load_plot_data(frame)
+    assert np.all(plot_data["error_signal_1"] == 3)
+    with pytest.raises(ValueError):
+        plot_data["error_signal_1"][0] = 0
+
+    # remote clients receive the pickled plot data that is only created once
+    pickled = serialize_frame(frame)
+    assert pickled is frame.to_bytes()
+    assert set(pickle.loads(pickled)) == set(plot_data)
+    assert load_plot_data(pickled).keys() == plot_data.keys()
+
+    restored = Frame.from_plot_data(pickle.loads(pickled), 1, raw=False)
+    assert np.all(restored.signals()["monitor_signal"] == -3)
+
+
+def test_frames_are_pickled_for_remote_listeners():
+    parameters = Parameters()
+    parameters.register_remote_listener("client", "to_plot")
+    buffer = FrameRingBuffer()
+    for value in range(3):
+        write_frame(buffer, value)
+        parameters.to_plot.value = Frame.from_view(buffer.latest())
+
+    queue = parameters.get_changed_parameters_queue("client")
+    # only the most recent frame is sent
+    assert len(queue) == 1
+    name, value = queue[0]
+    assert name == "to_plot"
+    assert np.all(pickle.loads(value)["error_signal_1"] == 2)
@@ -0,0 +1,39 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from linien_server.metrics import PipelineMetrics
+
+
+def test_pipeline_metrics():
+    metrics = PipelineMetrics(window_size=100)
+    for i in range(200):
+        metrics.record("read", i)
+    metrics.count("skipped_paused")
+    metrics.count("dropped", 3)
+
+    stats = metrics.get_stats()
+    read = stats["stages"]["read"]
+    assert read["count"] == 200
+    # only the most recent samples are kept
+    assert read["p50"] == 149.5
+    assert 194 < read["p95"] < read["p99"] < 199
+    assert stats["counters"] == {"skipped_paused": 1, "dropped": 3}
+
+    metrics.enabled = False
+    metrics.record("read", 0)
+    metrics.count("dropped")
+    assert metrics.get_stats() == stats
@@ -0,0 +1,94 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Thread
+from time import sleep
+
+import pytest
+import rpyc
+from linien_server.multi_board import BoardSelectorService
+from rpyc.utils.helpers import classpartial
+from rpyc.utils.server import ThreadedServer
+
+
+class FakeBoard(rpyc.Service):
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.clients = []
+
+    def on_connect(self, conn) -> None:
+        self.clients.append(conn.root.uuid)
+
+    def on_disconnect(self, conn) -> None:
+        self.clients.remove(conn.root.uuid)
+
+    def exposed_get_name(self) -> str:
+        return self.name
+
+
+def client_service(board=None):
+    class ClientService(rpyc.Service):
+        exposed_uuid = "client"
+        if board is not None:
+            exposed_board = board
+
+    return ClientService
+
+
+@pytest.fixture
+def server():
+    boards = {"laser1": FakeBoard("laser1"), "laser2": FakeBoard("laser2")}
+    server = ThreadedServer(
+        classpartial(BoardSelectorService, boards),
+        hostname="127.0.0.1",
+        port=0,
+        protocol_config={"allow_pickle": True, "allow_public_attrs": True},
+    )
+    thread = Thread(target=server.start, daemon=True)
+    thread.start()
+    while not server.active:
+        sleep(0.01)
+    yield server.listener.getsockname()[1], boards
+    server.close()
+
+
+def test_select_board_on_connect(server):
+    port, boards = server
+    conn = rpyc.connect("127.0.0.1", port, service=client_service("laser2"))
+    assert conn.root.get_name() == "laser2"
+    assert conn.root.get_board() == "laser2"
+    assert boards["laser2"].clients == ["client"]
+    assert boards["laser1"].clients == []
+    conn.close()
+
+
+def test_select_board_later(server):
+    port, boards = server
+    conn = rpyc.connect("127.0.0.1", port, service=client_service())
+    assert sorted(conn.root.get_boards()) == ["laser1", "laser2"]
+    with pytest.raises(AttributeError):
+        conn.root.get_name()
+
+    conn.root.select_board("laser1")
+    assert conn.root.get_name() == "laser1"
+    conn.root.select_board("laser2")
+    assert conn.root.get_name() == "laser2"
+    assert boards["laser1"].clients == []
+    assert boards["laser2"].clients == ["client"]
+    with pytest.raises(ValueError):
+        conn.root.select_board("laser3")
+    conn.close()
@@ -0,0 +1,150 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from time import sleep
+
+import linien_server.parameters
+import pytest
+from linien_server.parameters import (
+    ChangedParametersQueue,
+    ParameterJournal,
+    Parameters,
+    restore_parameters,
+)
+
+
+def test_changed_parameters_queue_collapses_on_insert():
+    queue = ChangedParametersQueue(max_size=3)
+    queue.append("p", 1)
+    queue.append("i", 2)
+    queue.append("p", 3)
+    for value in range(5):
+        queue.append("log", value, collapse=False)
+    queue.append("i", 4)
+
+    # the oldest values of parameters that are not collapsed are dropped
+    assert queue.drain() == [("p", 3), ("log", 2), ("log", 3), ("log", 4), ("i", 4)]
+    assert queue.n_dropped == 2
+    assert queue.drain() == []
+
+
+def test_get_changed_parameters_queue():
+    parameters = Parameters()
+    parameters.register_remote_listener("client", "p")
+    parameters.register_remote_listener("client", "i")
+    for value in range(5000):
+        parameters.p.value = value
+    parameters.i.value = 1
+
+    assert parameters.get_changed_parameters_queue("client") == [("p", 4999), ("i", 1)]
+    assert parameters.get_changed_parameters_queue("client") == []
+    assert parameters.get_changed_parameters_queue("unknown") == []
+    assert parameters.get_dropped_parameter_changes("client") == 0
+
+
+def test_set_values():
+    parameters = Parameters()
+    parameters.register_remote_listener("client", "p")
+    parameters.register_remote_listener("client", "i")
+    parameters.get_changed_parameters_queue("client")
+
+    # nothing is changed if any name or value is invalid
+    with pytest.raises(ValueError):
+        parameters.set_values({"p": 10, "not_a_parameter": 1})
+    with pytest.raises(TypeError):
+        parameters.set_values({"p": 10, "i": "a"})
+    assert parameters.get_changed_parameters_queue("client") == []
+
+    notifications = []
+    original_set = parameters._changed_parameters_events["client"].set
+
+    def set_event():
+        notifications.append(True)
+        original_set()
+
+    parameters._changed_parameters_events["client"].set = set_event
+    parameters.set_values({"p": 10, "i": 20})
+    assert parameters.p.value == 10
+    assert parameters.i.value == 20
+    # the client is notified once
+    assert len(notifications) == 1
+    assert parameters.get_changed_parameters_queue("client") == [("p", 10), ("i", 20)]
+
+
+def test_parameter_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(linien_server.parameters, "USER_DATA_PATH", tmp_path)
+    parameters = Parameters()
+    journal = ParameterJournal(parameters, flush_interval=0.05, compact_after=3)
+    journal.start()
+
+    parameters.p.value = 1
+    parameters.p.value = 2
+    parameters.i.value = 3
+    # not restorable
+    parameters.ping.value = 4
+    sleep(0.2)
+    # changes within `flush_interval` are written as a single entry
+    lines = (tmp_path / "parameters.json.journal").read_text().splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["changes"] == {
+        "p": {"value": 2, "log": False},
+        "i": {"value": 3, "log": False},
+    }
+
+    # simulate a crash that leaves an incomplete entry
+    parameters.d.value = 5
+    sleep(0.2)
+    with open(tmp_path / "parameters.json.journal", "a") as f:
+        f.write('{"time": 1, "chan')
+    restored = restore_parameters(Parameters())
+    assert (restored.p.value, restored.i.value, restored.d.value) == (2, 3, 5)
+
+    # after `compact_after` entries, a snapshot is written and the journal truncated
+    parameters.p.value = 6
+    sleep(0.2)
+    assert (tmp_path / "parameters.json").exists()
+    assert (tmp_path / "parameters.json.journal").read_text() == ""
+
+    parameters.p.value = 7
+    journal.stop()
+    assert restore_parameters(Parameters()).p.value == 7
+
+
+def test_parameter_journal_survives_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(linien_server.parameters, "USER_DATA_PATH", tmp_path)
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(linien_server.parameters, "save_parameters", fail)
+    parameters = Parameters()
+    journal = ParameterJournal(parameters, flush_interval=0.05, compact_after=1)
+    journal.start()
+
+    # compacting fails after every entry, but the changes are still journaled
+    parameters.p.value = 1
+    sleep(0.2)
+    parameters.p.value = 2
+    sleep(0.2)
+    assert journal.thread.is_alive()
+    lines = (tmp_path / "parameters.json.journal").read_text().splitlines()
+    assert [json.loads(line)["changes"]["p"]["value"] for line in lines] == [1, 2]
+
+    # stopping at exit doesn't raise either
+    journal.stop()
+    assert not journal.thread.is_alive()
@@ -0,0 +1,75 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from linien_server.polling import AdaptivePoller, sweep_speed_to_time
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def test_poll_interval_follows_sweep_period():
+    fast = AdaptivePoller(period=sweep_speed_to_time(0), cpu_budget=1)
+    slow = AdaptivePoller(period=sweep_speed_to_time(12), cpu_budget=1)
+    # several polls per sweep for fast sweeps, few wakeups for slow ones
+    assert fast.next_interval() < sweep_speed_to_time(0)
+    assert slow.next_interval() > 0.05
+
+
+def test_backoff_and_cpu_budget():
+    clock = FakeClock()
+    poller = AdaptivePoller(period=0.1, polls_per_period=10, backoff=2, clock=clock)
+    intervals = [poller.next_interval() for _ in range(5)]
+    assert intervals[:3] == [0.01, 0.02, 0.04]
+    # never sleep longer than half a period
+    assert intervals[3:] == [0.05, 0.05]
+
+    poller.frame_received()
+    assert poller.next_interval() == 0.01
+
+    # polling that takes 10 ms must not use more than 10% of the time
+    def expensive_check():
+        clock.time += 0.01
+        return False
+
+    poller.poll(expensive_check)
+    assert poller.next_interval() > 0.09
+
+    for cpu_budget in (0, -0.1):
+        with pytest.raises(ValueError):
+            poller.set_cpu_budget(cpu_budget)
+    assert poller.cpu_budget == 0.1
+
+
+def test_frame_rate():
+    clock = FakeClock()
+    poller = AdaptivePoller(period=0.1, clock=clock)
+    assert poller.get_stats()["achieved_frame_rate"] is None
+    for _ in range(11):
+        poller.poll(lambda: True)
+        poller.frame_received()
+        clock.time += 0.2
+
+    stats = poller.get_stats()
+    assert abs(stats["achieved_frame_rate"] - 5) < 1e-9
+    assert stats["theoretical_frame_rate"] == 10
+    assert stats["polls_per_frame"] == 1
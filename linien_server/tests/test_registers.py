@@ -0,0 +1,93 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import linien_server.registers
+from linien_server.parameters import Parameters
+from linien_server.registers import REGISTER_GROUP_DEPENDENCIES, Registers
+
+
+class FakeAcquisition:
+    def __init__(self):
+        self.csr_writes = []
+        self.iir_writes = []
+        self.n_calls = 0
+
+    def exposed_set_csr_batch(self, writes, iir_writes):
+        # everything has to be transferred by value
+        assert isinstance(writes, tuple) and isinstance(iir_writes, tuple)
+        self.n_calls += 1
+        self.csr_writes += [key for key, value, force in writes]
+        self.iir_writes += [name for name, b, a in iir_writes]
+
+    def __getattr__(self, name):
+        # ignore the remaining calls to the acquisition service
+        return lambda *args: None
+
+
+class FakeConnection:
+    def __init__(self):
+        self.root = FakeAcquisition()
+
+
+class FakeControl:
+    def __init__(self):
+        self.exposed_is_locked = None
+        self._cached_data = {}
+
+
+def test_register_group_dependencies():
+    parameter_names = [name for name, _ in Parameters()]
+    for names in REGISTER_GROUP_DEPENDENCIES.values():
+        for name in names:
+            assert name in parameter_names
+
+
+def test_write_only_dirty_registers(monkeypatch):
+    monkeypatch.setattr(
+        linien_server.registers.rpyc, "connect", lambda *args: FakeConnection()
+    )
+    parameters = Parameters()
+    registers = Registers(FakeControl(), parameters, host="localhost")
+    acquisition = registers.acquisition
+
+    registers.write_registers()
+    assert len(acquisition.csr_writes) > 50
+    assert len(acquisition.iir_writes) == 9
+    assert acquisition.n_calls == 1
+
+    # nothing changed
+    acquisition.csr_writes.clear()
+    acquisition.iir_writes.clear()
+    registers.write_registers()
+    assert acquisition.csr_writes == []
+    assert acquisition.iir_writes == []
+    assert acquisition.n_calls == 1
+
+    parameters.lock.value = True
+    registers.write_registers()
+    assert "logic_autolock_request_lock" in acquisition.csr_writes
+
+    # changing the PID parameters while locked only writes the PID registers
+    acquisition.csr_writes.clear()
+    parameters.p.value = 100
+    registers.write_registers()
+    assert acquisition.csr_writes == ["logic_pid_kp", "logic_pid_ki", "logic_pid_kd"]
+
+    acquisition.csr_writes.clear()
+    parameters.filter_automatic_a.value = False
+    registers.write_registers()
+    assert acquisition.csr_writes == []
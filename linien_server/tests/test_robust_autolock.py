@@ -316,7 +316,7 @@ def test_sum_diff_calculator2():
     # plt.plot(out_fpga[1:])
     # plt.plot(summed_xscaled)
     # plt.show()
-    assert out_fpga[1:] == summed_xscaled[:-1]
+    assert out_fpga[1:] == summed_xscaled[:-1].tolist()
 
 
 @pytest.mark.slow
@@ -380,11 +380,11 @@ def test_compare_sum_diff_calculator_implementations(plt, debug=True):
             plt.legend()
 
         assert (
-            summed[:-FPGA_DELAY_SUMDIFF_CALCULATOR]
+            summed[:-FPGA_DELAY_SUMDIFF_CALCULATOR].tolist()
             == summed_fpga["summed"][FPGA_DELAY_SUMDIFF_CALCULATOR:]
         )
         assert (
-            summed_xscaled[:-FPGA_DELAY_SUMDIFF_CALCULATOR]
+            summed_xscaled[:-FPGA_DELAY_SUMDIFF_CALCULATOR].tolist()
             == summed_fpga["summed_xscaled"][FPGA_DELAY_SUMDIFF_CALCULATOR:]
         )
 
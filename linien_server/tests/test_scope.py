@@ -0,0 +1,56 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from linien_server.scope import CHANNEL_OFFSETS, MAX_DATA_LENGTH, read_scope_channels
+
+
+class FakeScope:
+    def __init__(self, adc_a: np.ndarray, adc_b: np.ndarray) -> None:
+        # two zero bits, channel b (14 bit), two zero bits, channel a (14 bit)
+        words = ((adc_b.astype(np.uint32) & 0x3FFF) << 16) | (
+            adc_a.astype(np.uint32) & 0x3FFF
+        )
+        self.memory = {offset: words.tobytes() for offset in CHANNEL_OFFSETS}
+
+    def reads(self, addr: int, length: int) -> np.ndarray:
+        offset = addr & ~0xFFFF
+        return np.frombuffer(
+            self.memory[offset], dtype=np.uint32, count=length, offset=addr - offset
+        )
+
+
+def test_read_scope_channels():
+    adc_a = np.arange(-8192, 8192, dtype=np.int64)
+    adc_b = -adc_a - 1
+    scope = FakeScope(adc_a, adc_b)
+    out = np.zeros((4, 16384), dtype=np.int16)
+
+    # no wrap-around
+    read_scope_channels(scope, CHANNEL_OFFSETS, 100, 2048, out)
+    assert np.array_equal(out[0, :2048], adc_a[100:2148])
+    assert np.array_equal(out[1, :2048], adc_b[100:2148])
+    assert np.array_equal(out[2, :2048], adc_a[100:2148])
+    assert np.array_equal(out[3, :2048], adc_b[100:2148])
+
+    # wrap-around: read until the end of the buffer, then continue at the beginning
+    addr = MAX_DATA_LENGTH - 1000
+    read_scope_channels(scope, CHANNEL_OFFSETS[:1], addr, 2048, out)
+    expected_a = np.concatenate((adc_a[addr:MAX_DATA_LENGTH], adc_a[:1048]))
+    expected_b = np.concatenate((adc_b[addr:MAX_DATA_LENGTH], adc_b[:1048]))
+    assert np.array_equal(out[0, :2048], expected_a)
+    assert np.array_equal(out[1, :2048], expected_b)
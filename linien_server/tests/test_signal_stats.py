@@ -0,0 +1,40 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from linien_server.signal_stats import compute_signal_stats
+
+
+def test_signal_stats():
+    rng = np.random.default_rng(0)
+    plot_data = {
+        name: rng.integers(-8192, 8192, 2048).astype(np.int16)
+        for name in ("error_signal_1", "error_signal_1_quadrature", "monitor_signal")
+    }
+    plot_data["slow_control_signal"] = -12
+
+    stats = compute_signal_stats(plot_data)
+    assert len(stats) == 4 * len(plot_data)
+    for name, signal in plot_data.items():
+        assert np.isclose(stats[f"{name}_mean"], np.mean(signal))
+        assert np.isclose(stats[f"{name}_std"], np.std(signal))
+        assert stats[f"{name}_max"] == np.max(signal)
+        assert stats[f"{name}_min"] == np.min(signal)
+
+    stats = compute_signal_stats(plot_data, ["max"])
+    assert set(stats) == {f"{name}_max" for name in plot_data}
+    assert compute_signal_stats(plot_data, []) == {}
@@ -0,0 +1,152 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Thread
+from time import perf_counter, sleep
+
+import linien_server.registers
+import numpy as np
+from linien_server.acquisition import AcquisitionService
+from linien_server.parameters import Parameters
+from linien_server.polling import capture_time, sweep_speed_to_time
+from linien_server.registers import Registers
+from linien_server.scope import read_scope_channels
+from linien_server.simulation import (
+    SimulatedRedPitaya,
+    SyntheticPlotData,
+    synthesize_spectrum,
+)
+from rpyc.utils.server import ThreadedServer
+
+
+class FakeControl:
+    def __init__(self):
+        self.exposed_is_locked = None
+        self._cached_data = {}
+
+
+def test_simulated_scope_memory():
+    board = SimulatedRedPitaya(noise=0, seed=0)
+    csr = board.csr
+    csr.set("scopegen_adc_a_sel", 2)  # fast_a_out_i
+    csr.set("logic_sweep_max", 8191)
+
+    scope = board.scope
+    scope.data_decimation = 8
+    scope.trigger_delay = 2047
+    scope.rearm()
+    while scope.read(0x1 << 2) & 0x4:
+        pass
+
+    out = np.zeros((4, 2048), dtype=np.int16)
+    read_scope_channels(scope, (0x10000,), scope.write_pointer_trigger, 2048, out)
+    expected = np.round(synthesize_spectrum(seed=0))
+    assert np.max(np.abs(out[0] - expected)) <= 1
+    # monitor signal is not selected
+    assert not np.any(out[1])
+
+
+def test_acquisition_with_simulated_board():
+    parameters = Parameters()
+    parameters.sweep_speed.value = 0
+    registers = Registers(FakeControl(), parameters, board=SimulatedRedPitaya(seed=0))
+    acquisition = registers.acquisition
+    try:
+        registers.write_registers()
+        acquisition.exposed_continue_acquisition(None)
+        frame = registers.frame_buffer.wait_for_frame(None, timeout=5)
+        assert frame is not None
+        assert frame.header.names[0] == "error_signal_1"
+        assert np.max(np.abs(frame.signals()["error_signal_1"])) > 1000
+
+        # lock request is honoured
+        parameters.lock.value = True
+        registers.write_registers()
+        frame = registers.frame_buffer.wait_for_frame(frame.sequence + 1, timeout=5)
+        assert frame is not None
+        assert frame.header.locked
+        assert "control_signal" in frame.header.names
+    finally:
+        acquisition.exposed_stop_acquisition()
+
+
+def test_poll_period_while_waiting_for_lock():
+    acquisition = AcquisitionService(board=SimulatedRedPitaya(seed=0))
+    # the loop would confirm the lock on its own
+    acquisition.exposed_stop_acquisition()
+
+    acquisition.exposed_set_lock_status(True)
+    acquisition.program_acquisition_and_rearm()
+    # the gateware only starts the lock when the sweep reaches the lock point
+    assert acquisition.poller.period == sweep_speed_to_time(acquisition.sweep_speed)
+
+    acquisition.confirmed_that_in_lock = True
+    acquisition.program_acquisition_and_rearm()
+    assert acquisition.poller.period == capture_time(acquisition.decimation)
+
+
+def test_remote_register_writes_do_not_wait_for_frames(monkeypatch):
+    acquisition = AcquisitionService(board=SimulatedRedPitaya(seed=0))
+    server = ThreadedServer(acquisition, hostname="127.0.0.1", port=0)
+    Thread(target=server.start, daemon=True).start()
+    while not server.active:
+        sleep(0.01)
+    monkeypatch.setattr(
+        linien_server.registers, "ACQUISITION_PORT", server.listener.getsockname()[1]
+    )
+    try:
+        registers = Registers(FakeControl(), Parameters(), host="127.0.0.1")
+        # no frames are published while the acquisition is paused
+        registers.acquisition.exposed_pause_acquisition()
+        waiter = Thread(
+            target=registers.frame_source.exposed_wait_for_frame, args=(None, 2)
+        )
+        waiter.start()
+        sleep(0.1)
+
+        start = perf_counter()
+        registers.acquisition.exposed_set_csr("logic_sweep_max", 8191)
+        registers.acquisition.exposed_continue_acquisition(None)
+        assert perf_counter() - start < 1
+        waiter.join()
+    finally:
+        server.close()
+        acquisition.exposed_stop_acquisition()
+
+
+def test_synthetic_plot_data():
+    spectrum = synthesize_spectrum(seed=1)
+    generator = SyntheticPlotData([spectrum], n_points=1024, jitter=0.05, seed=1)
+
+    unlocked = generator.generate(locked=False)
+    assert sorted(unlocked) == [
+        "error_signal_1",
+        "error_signal_1_quadrature",
+        "error_signal_2",
+        "error_signal_2_quadrature",
+    ]
+    for signal in unlocked.values():
+        assert signal.dtype == np.int16
+        assert len(signal) == 1024
+    # the lines are visible above the noise, but jitter between frames
+    assert np.abs(unlocked["error_signal_1"]).max() > 500
+    assert not np.array_equal(
+        unlocked["error_signal_1"], generator.generate()["error_signal_1"]
+    )
+
+    locked = generator.generate(locked=True)
+    assert sorted(locked) == ["control_signal", "error_signal"]
@@ -0,0 +1,111 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import pickle
+from threading import Event
+from time import sleep
+
+import numpy as np
+from linien_server.frame_buffer import Frame, min_max_envelope
+from linien_server.parameters import Parameters
+from linien_server.subscriptions import ParameterChangePusher, PlotSubscription
+
+
+def test_parameter_change_pusher():
+    parameters = Parameters()
+    parameters.register_remote_listener("client", "p")
+    parameters.register_remote_listener("client", "i")
+    # drop the initial values
+    parameters.get_changed_parameters_queue("client")
+
+    batches = []
+    received = Event()
+
+    def callback(batch):
+        batches.append(pickle.loads(batch))
+        received.set()
+        # a slow client
+        sleep(0.2)
+
+    pusher = ParameterChangePusher(parameters, "client", callback, 0.05)
+    pusher.start()
+
+    # changes within the coalescing window are sent as a single batch
+    parameters.p.value = 1
+    parameters.i.value = 2
+    parameters.p.value = 3
+    assert received.wait(1)
+    assert batches == [[("i", 2), ("p", 3)]]
+
+    # while the client is busy, changes are collapsed
+    for value in range(10, 20):
+        parameters.p.value = value
+    sleep(0.5)
+    assert batches[1] == [("p", 19)]
+
+    parameters.unregister_remote_listeners("client")
+    pusher.thread.join(timeout=1)
+    assert not pusher.thread.is_alive()
+
+
+def test_min_max_envelope():
+    signal = np.zeros(1000, dtype=np.int16)
+    signal[123] = 500
+    signal[789] = -500
+    envelope = min_max_envelope(signal, 100)
+    assert len(envelope) == 100
+    # narrow peaks survive the decimation
+    assert envelope.max() == 500
+    assert envelope.min() == -500
+    # short signals are not touched
+    assert len(min_max_envelope(signal[:50], 100)) == 50
+
+
+def test_plot_subscription():
+    time = [0.0]
+    sent = []
+    frame = Frame.from_plot_data(
+        {"error_signal_1": np.arange(2048), "error_signal_2": np.arange(2048)},
+        sequence=0,
+        raw=False,
+    )
+
+    subscription = PlotSubscription(
+        lambda data: sent.append(pickle.loads(data)),
+        max_rate=10,
+        n_points=64,
+        signals=("error_signal_1",),
+        clock=lambda: time[0],
+    )
+    subscription.start()
+    subscription.offer(frame)
+    # rate limited
+    time[0] = 0.05
+    subscription.offer(frame)
+    sleep(0.1)
+    assert subscription.n_sent == 1
+    assert subscription.n_skipped == 1
+    assert list(sent[0]) == ["error_signal_1"]
+    assert len(sent[0]["error_signal_1"]) == 64
+
+    # the encoded variant is computed once per frame and shared
+    assert frame.to_bytes(64, ("error_signal_1",)) is frame.to_bytes(
+        64, ("error_signal_1",)
+    )
+    subscription.stop()
+    subscription.thread.join(timeout=1)
+    assert not subscription.thread.is_alive()
@@ -0,0 +1,103 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import pickle
+
+import numpy as np
+import pytest
+from linien_server.frame_buffer import Frame
+from linien_server.wire_format import (
+    WIRE_FORMAT_BINARY,
+    WIRE_FORMAT_BINARY_ZLIB,
+    WIRE_FORMAT_PICKLE,
+    decode,
+    decode_plot_data,
+    negotiate_wire_format,
+)
+
+
+def _frame(**kwargs) -> Frame:
+    rng = np.random.default_rng(0)
+    signals = {
+        "error_signal_1": rng.integers(-8192, 8192, 2048).astype(np.int16),
+        "error_signal_2": (1000 * np.sin(np.linspace(0, 10, 2048))).astype(np.int16),
+    }
+    return Frame(signals, sequence=7, locked=False, raw=False, uuid=0.5, **kwargs)
+
+
+@pytest.mark.parametrize("wire_format", [WIRE_FORMAT_BINARY, WIRE_FORMAT_BINARY_ZLIB])
+def test_round_trip(wire_format):
+    frame = _frame(slow_control_signal=123)
+    data = frame.to_bytes(wire_format=wire_format)
+
+    header, signals = decode(data)
+    assert header.sequence == 7
+    assert header.uuid == 0.5
+    assert not header.locked
+    assert header.slow_control_signal == 123
+
+    plot_data = decode_plot_data(data)
+    expected = frame.as_plot_data()
+    assert plot_data.keys() == expected.keys()
+    for name in frame.signals():
+        assert np.array_equal(plot_data[name], expected[name])
+    assert plot_data["slow_control_signal"] == 123
+
+
+def test_binary_is_compact_and_zero_copy():
+    frame = _frame()
+    pickled = frame.to_bytes()
+    binary = frame.to_bytes(wire_format=WIRE_FORMAT_BINARY)
+    compressed = frame.to_bytes(wire_format=WIRE_FORMAT_BINARY_ZLIB)
+    assert len(binary) < len(pickled)
+    assert len(compressed) < len(binary)
+
+    _, signals = decode(binary)
+    # the signals are views on the received data
+    assert not signals["error_signal_1"].flags.owndata
+    assert not signals["error_signal_1"].flags.writeable
+
+
+def test_raw_and_decimated_frames():
+    raw = Frame.from_plot_data(
+        (np.arange(4096), -np.arange(4096)), sequence=1, raw=True
+    )
+    a, b = decode_plot_data(raw.to_bytes(n_points=64, wire_format=WIRE_FORMAT_BINARY))
+    assert len(a) == len(b) == 64
+    assert b.min() == -4095
+
+
+@pytest.mark.parametrize("wire_format", [WIRE_FORMAT_BINARY, WIRE_FORMAT_BINARY_ZLIB])
+def test_slow_sweep_decimation(wire_format):
+    # sweep speed 15 corresponds to a decimation of 2**18
+    data = _frame(decimation=2**18).to_bytes(wire_format=wire_format)
+    header, _ = decode(data)
+    assert header.decimation == 2**18
+
+
+def test_fallback_to_pickle():
+    # values that do not fit into int16 are sent pickled
+    frame = Frame({"error_signal_1": np.array([0, 100000])}, 0, False, False)
+    data = frame.to_bytes(wire_format=WIRE_FORMAT_BINARY)
+    assert np.array_equal(pickle.loads(data)["error_signal_1"], [0, 100000])
+
+    assert negotiate_wire_format(["binary-v9", WIRE_FORMAT_BINARY]) == (
+        WIRE_FORMAT_BINARY
+    )
+    assert negotiate_wire_format(["json"]) == WIRE_FORMAT_PICKLE
+    # version 1 had a 16 bit decimation field and is not supported anymore
+    assert negotiate_wire_format(["binary-v1"]) == WIRE_FORMAT_PICKLE